@@ -0,0 +1 @@
+default_app_config = 'sparkdoor.apps.common.config.CommonConfig'
@@ -3,9 +3,11 @@ apps.py - contains server side counterparts to device firmware.
 """
 from sparkdoor.apps.spark.apps import DeviceAppBase, DeviceAppError
 from sparkdoor.apps.spark.services import ServiceError
+from sparkdoor.apps.spark.tasks import publish_device_event
 
 
-from .models import IDCard
+from .events import event_buffer
+from .models import DoorEvent, IDCard
 
 
 class DoorApp(DeviceAppBase):
@@ -14,6 +16,18 @@ class DoorApp(DeviceAppBase):
     """
     action_names = ['open', 'pair_id_card']
     template_name = 'common/door_app.html'
+    # `pair_id_card` only returns once a card is read or the firmware
+    # gives up waiting for one.
+    pair_timeout = 30 # seconds
+
+    def get_context_data(self):
+        """
+        Add when the door was last opened and how many cards are paired.
+        """
+        context = super(DoorApp, self).get_context_data()
+        context['last_opened'] = DoorEvent.objects.last(self.device, DoorEvent.OPEN_EVENT)
+        context['paired_cards'] = IDCard.objects.filter(device=self.device).count()
+        return context
 
     def action(self, name, args=None):
         """
@@ -30,16 +44,19 @@ class DoorApp(DeviceAppBase):
             self.device.call("open", None)
         except ServiceError as err:
             raise DeviceAppError('Device could not be reached', err.status_code)
+        event_buffer.record(self.device.pk, DoorEvent.OPEN_EVENT)
+        publish_device_event.delay(self.device.device_id, 'opened')
 
     def pair_id_card(self, args):
         """
         Read an ID card and pair it with this device.
         """
         try:
-            success = self.device.call("pair_id_card", None) == 0
+            success = self.device.call("pair_id_card", None, self.pair_timeout) == 0
             uid = self.device.read("card_uid") if success else None
         except ServiceError as err:
             raise DeviceAppError('Device could not be reached', err.status_code)
         if not success:
             raise DeviceAppError('Card read timed out', 408)
-        IDCard(device=self.device, uid=uid).save()
+        IDCard.objects.pair(self.device, uid)
+        publish_device_event.delay(self.device.device_id, 'card_paired')
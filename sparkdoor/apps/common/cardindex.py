@@ -0,0 +1,219 @@
+"""
+cardindex.py - in-memory index of the ID cards allowed to open each
+    door.
+"""
+import logging
+import random
+import threading
+import time
+from collections import Counter
+
+from django.core.cache import cache
+
+from sparkdoor.apps.spark.models import Device
+
+from .models import IDCard
+
+
+logger = logging.getLogger(__name__)
+
+
+class CardIndexEntry:
+    """
+    The cards paired with one device, as the set of their uids. Uids
+    must be normalized with `models.normalize_uid`.
+    """
+    def __init__(self, uids, device_pk=None):
+        """
+        Constructor.
+        """
+        self.device_pk = device_pk
+        self.uids = frozenset(uids)
+
+
+class CardIndex:
+    """
+    Keeps every registered cloud device id and the uids of the cards
+    paired with it in process memory, so that a card swipe is answered
+    without a database query.
+
+    Devices without cards are indexed too, so swipes from unknown
+    device ids and unpaired cards are both answered from memory.
+
+    The index follows a version counter stored in the Django cache.
+    `invalidate` is called by the `IDCard` and `Device` signal receivers
+    to increment it, recording which device changed under the new
+    version, so that every process sharing the cache rebuilds only that
+    device's entry on its next lookup. A full reload happens when a
+    process falls too far behind or a change isn't tied to one device.
+
+    Changes are only seen by other processes when the cache is shared
+    between them, as with the Redis `CACHES` of the project settings.
+    Changes that never invalidate the index, such as a query set
+    `update` or a cache that isn't shared, are still picked up by the
+    full reload done every `MAX_AGE` seconds, which bounds how long an
+    unpaired card can keep opening a door.
+
+    Lookups are counted by outcome, see `stats`, and the counts are
+    logged every `STATS_INTERVAL` seconds.
+    """
+    MAX_DELTAS = 100
+    DELTA_TIMEOUT = 60*60 # 1 hour
+    MAX_AGE = 60 # seconds
+    STATS_INTERVAL = 60*60 # 1 hour
+
+    def __init__(self, version_key='common.card_index.version'):
+        """
+        Constructor.
+        """
+        self.version_key = version_key
+        self._lock = threading.Lock()
+        self._entries = None
+        self._version = None
+        self._expires = 0
+        self._stats = Counter()
+        self._stats_lock = threading.Lock()
+        self._stats_logged = time.time()
+
+    def allows(self, device_id, card_uid):
+        """
+        Check if `card_uid` is paired with the device that has the cloud
+        id `device_id`.
+        """
+        entry = self._current().get(device_id)
+        if entry is None:
+            outcome = 'unknown_device'
+        elif card_uid in entry.uids:
+            outcome = 'allowed'
+        else:
+            outcome = 'unpaired'
+        self._count(outcome)
+        return outcome == 'allowed'
+
+    def stats(self):
+        """
+        Get the number of lookups made by this process so far that were
+        `allowed`, the hits, and that were misses because of an
+        `unknown_device` or an `unpaired` card.
+        """
+        with self._stats_lock:
+            return {name: self._stats[name]
+                for name in ('allowed', 'unknown_device', 'unpaired')}
+
+    def device_pk(self, device_id):
+        """
+        Get the primary key of the device that has the cloud id
+        `device_id`, or None if there isn't one.
+        """
+        entry = self._current().get(device_id)
+        return entry.device_pk if entry is not None else None
+
+    def invalidate(self, device_id=None):
+        """
+        Mark the entry for the cloud id `device_id`, or the whole index
+        if it isn't given, as stale in this and every other process.
+        """
+        version = self._incr_version()
+        cache.set(self._delta_key(version), device_id, self.DELTA_TIMEOUT)
+
+    def _count(self, outcome):
+        """
+        Count a lookup, logging the counts if they are due.
+        """
+        with self._stats_lock:
+            self._stats[outcome] += 1
+            now = time.time()
+            if now < self._stats_logged + self.STATS_INTERVAL:
+                return
+            self._stats_logged = now
+        stats = self.stats()
+        logger.info('Card index lookups: %d allowed, %d unknown device, %d unpaired',
+            stats['allowed'], stats['unknown_device'], stats['unpaired'])
+
+    def _current(self):
+        """
+        Get the index, bringing it up to date with the shared version.
+        """
+        version = self._shared_version()
+        if self._stale(version):
+            with self._lock:
+                if self._stale(version):
+                    self._entries = self._update(version)
+                    self._version = version
+        return self._entries
+
+    def _stale(self, version):
+        """
+        Check if the index is behind `version` or older than `MAX_AGE`.
+        """
+        return (self._entries is None or version != self._version or
+            time.time() >= self._expires)
+
+    def _update(self, version):
+        """
+        Apply the changes recorded since our version, or reload
+        everything if they can't all be found.
+        """
+        if (self._entries is None or time.time() >= self._expires or
+                not isinstance(self._version, int) or
+                not 0 < version - self._version <= self.MAX_DELTAS):
+            entries = self._load()
+            self._expires = time.time() + self.MAX_AGE
+            return entries
+        keys = [self._delta_key(v) for v in range(self._version + 1, version + 1)]
+        deltas = cache.get_many(keys)
+        changed = set(deltas.get(k) for k in keys)
+        if len(deltas) != len(keys) or None in changed:
+            return self._load()
+        entries = dict(self._entries)
+        for device_id in changed:
+            entries.pop(device_id, None)
+            entries.update(self._load(device_id))
+        return entries
+
+    def _load(self, device_id=None):
+        """
+        Build the entries for every device, or just for `device_id`,
+        from the database.
+        """
+        devices = Device.objects.all()
+        cards = IDCard.objects.all()
+        if device_id is not None:
+            devices = devices.filter(device_id=device_id)
+            cards = cards.filter(cloud_device_id=device_id)
+        pks = dict(devices.values_list('device_id', 'id'))
+        uids = {d: [] for d in pks}
+        for d, uid in cards.values_list('cloud_device_id', 'uid'):
+            uids.setdefault(d, []).append(uid)
+        return {d: CardIndexEntry(u, pks.get(d)) for d, u in uids.items()}
+
+    def _shared_version(self):
+        """
+        Get the version from the Django cache, starting from a random
+        number if it isn't there so a process can't mistake a restarted
+        counter for its own version.
+        """
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, random.randint(0, 2 ** 48), None)
+            version = cache.get(self.version_key)
+        return version
+
+    def _incr_version(self):
+        """
+        Atomically increment the shared version and return it.
+        """
+        try:
+            return cache.incr(self.version_key)
+        except ValueError:
+            self._shared_version()
+            return cache.incr(self.version_key)
+
+    def _delta_key(self, version):
+        """
+        Get the cache key recording what changed under `version`.
+        """
+        return '{0}.{1}'.format(self.version_key, version)
+
+
+card_index = CardIndex()
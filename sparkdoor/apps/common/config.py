@@ -0,0 +1,22 @@
+"""
+config.py - Django app configuration for the `common` app.
+"""
+from django.apps import AppConfig
+
+
+class CommonConfig(AppConfig):
+    """
+    App configuration for `sparkdoor.apps.common`.
+    """
+    name = 'sparkdoor.apps.common'
+    label = 'common'
+    verbose_name = 'Common'
+
+    def ready(self):
+        """
+        Connect signal receivers and write the buffered door events
+        when the process is told to stop.
+        """
+        from . import signals
+        from .events import event_buffer
+        event_buffer.install_signal_handler()
@@ -0,0 +1,218 @@
+"""
+events.py - buffered recording of `DoorEvent`s.
+"""
+import atexit
+import logging
+import os
+import queue
+import signal
+import threading
+import time
+
+from django.db import DatabaseError, connection, transaction, close_old_connections
+from django.utils import timezone
+
+from .models import DoorEvent
+
+
+logger = logging.getLogger(__name__)
+
+
+class EventBuffer:
+    """
+    Collects `DoorEvent`s in process memory and writes them in batches
+    with `bulk_create` from a background thread, so that recording an
+    event doesn't add a database write to the request that caused it.
+
+    When the buffer is full `record` waits for up to `PUT_TIMEOUT`
+    seconds and then writes the event itself, slowing callers down
+    instead of dropping events. A batch that fails to write is retried
+    until it is written.
+
+    Events are written at least once when the process stops: `close`
+    writes what is left, retrying for up to `SHUTDOWN_TIMEOUT` seconds
+    while the database can't be reached. It is called when the process
+    exits normally, on SIGTERM once `install_signal_handler` was called,
+    which the `common` app does, and when a Celery prefork child stops,
+    which skips exit handlers, see `signals.close_event_buffer`. Only
+    SIGKILL or a database that stays unreachable for longer loses
+    buffered events, and the latter is logged.
+    """
+    MAX_SIZE = 10000
+    BATCH_SIZE = 500
+    FLUSH_INTERVAL = 1 # seconds
+    PUT_TIMEOUT = 0.05 # seconds
+    RETRY_DELAY = 1 # seconds
+    SHUTDOWN_TIMEOUT = 10 # seconds
+
+    def __init__(self, background=True):
+        """
+        Constructor. Without a `background` thread events are only
+        written by `flush` or when the buffer is full.
+        """
+        self.background = background
+        self._queue = queue.Queue(self.MAX_SIZE)
+        self._failed = []
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._registered = False
+
+    def record(self, device_pk, event, event_data=''):
+        """
+        Record an `event` for the device with the primary key
+        `device_pk`.
+        """
+        door_event = DoorEvent(device_id=device_pk, event=event, event_data=event_data,
+            time=timezone.now())
+        if self.background:
+            self._start()
+        try:
+            self._queue.put(door_event, timeout=self.PUT_TIMEOUT)
+        except queue.Full:
+            if not self._write([door_event]):
+                with self._lock:
+                    self._failed.append(door_event)
+
+    def flush(self):
+        """
+        Write everything buffered so far from the calling thread.
+        Returns False if a batch couldn't be written, in which case it
+        stays buffered.
+        """
+        with self._lock:
+            failed, self._failed = self._failed, []
+        if failed and not self._write(failed):
+            with self._lock:
+                self._failed.extend(failed)
+            return False
+        batch = self._take()
+        while batch:
+            if not self._write(batch):
+                with self._lock:
+                    self._failed.extend(batch)
+                return False
+            batch = self._take()
+        return True
+
+    def close(self, timeout=None):
+        """
+        Stop the background thread and write what is left, trying again
+        until `timeout` seconds, `SHUTDOWN_TIMEOUT` by default, have
+        passed. Returns False if events are still buffered.
+        """
+        if timeout is None:
+            timeout = self.SHUTDOWN_TIMEOUT
+        until = time.time() + timeout
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and self._pid == os.getpid():
+            self._stopping.set()
+            try:
+                self._queue.put_nowait(None) # wakes the thread up
+            except queue.Full:
+                pass # it is retrying a batch and will see `_stopping`
+            thread.join(timeout)
+            self._stopping.clear()
+        while not self.flush():
+            if time.time() + self.RETRY_DELAY > until:
+                logger.error('Could not write %d door events before stopping',
+                    len(self._failed) + self._queue.qsize())
+                return False
+            time.sleep(self.RETRY_DELAY)
+        return True
+
+    def install_signal_handler(self, signum=signal.SIGTERM):
+        """
+        Close the buffer when the process gets `signum`, before handling
+        the signal as it was handled so far. Only the main thread can
+        install a signal handler, returns False from other threads.
+        """
+        previous = signal.getsignal(signum)
+
+        def handler(signum, frame):
+            signal.signal(signum, previous)
+            self.close()
+            if callable(previous):
+                previous(signum, frame)
+            elif previous == signal.SIG_DFL:
+                os.kill(os.getpid(), signum)
+        try:
+            signal.signal(signum, handler)
+        except ValueError:
+            return False
+        return True
+
+    def _start(self):
+        """
+        Start the background thread if it isn't running in this process.
+        """
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            if self._pid is not None and self._pid != os.getpid():
+                # events buffered before a fork belong to the parent.
+                self._queue = queue.Queue(self.MAX_SIZE)
+                self._failed = []
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='door-events')
+            self._thread.daemon = True
+            self._thread.start()
+            if not self._registered:
+                atexit.register(self.close)
+                self._registered = True
+
+    def _run(self):
+        """
+        Background thread, writes a batch whenever one is full or every
+        `FLUSH_INTERVAL` seconds.
+        """
+        try:
+            while not self._stopping.is_set():
+                batch = self._take(self.FLUSH_INTERVAL)
+                if batch:
+                    close_old_connections()
+                while batch and not self._write(batch):
+                    if self._stopping.wait(self.RETRY_DELAY):
+                        with self._lock:
+                            self._failed.extend(batch)
+                        return
+                    close_old_connections()
+        finally:
+            connection.close()
+
+    def _take(self, timeout=None):
+        """
+        Take up to `BATCH_SIZE` events from the buffer, waiting up to
+        `timeout` seconds for the first one.
+        """
+        batch = []
+        try:
+            event = self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait()
+            while True:
+                if event is not None:
+                    batch.append(event)
+                if len(batch) >= self.BATCH_SIZE:
+                    break
+                event = self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        return batch
+
+    def _write(self, events):
+        """
+        Insert `events`, returns False if that failed.
+        """
+        try:
+            with transaction.atomic():
+                DoorEvent.objects.bulk_create(events, batch_size=self.BATCH_SIZE)
+        except DatabaseError:
+            logger.exception('Could not write %d door events', len(events))
+            return False
+        return True
+
+
+event_buffer = EventBuffer()
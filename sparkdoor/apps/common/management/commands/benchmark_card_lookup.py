@@ -0,0 +1,84 @@
+"""
+benchmark_card_lookup.py - management command that times ID card
+    lookups against a large number of cards.
+"""
+import time
+from optparse import make_option
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from sparkdoor.apps.spark.models import Device
+
+from ...cardindex import CardIndex
+from ...models import IDCard
+
+
+class Rollback(Exception):
+    """
+    Raised to roll back the benchmark data.
+    """
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Creates `--cards` cards spread over `--devices` devices inside a
+    transaction, times `--lookups` swipes with the old join query, the
+    indexed `IDCardManager.is_paired` probe and `CardIndex.allows`,
+    shows the index's lookup counters and then rolls everything back.
+    """
+    help = 'Time ID card lookups against a large number of cards.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--cards', type='int', default=100000),
+        make_option('--devices', type='int', default=100),
+        make_option('--lookups', type='int', default=1000),
+    )
+
+    def handle(self, *args, **options):
+        """
+        Run the benchmark.
+        """
+        try:
+            with transaction.atomic():
+                self._run(options['cards'], options['devices'], options['lookups'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _run(self, card_count, device_count, lookup_count):
+        """
+        Create the data and time the lookups.
+        """
+        user = get_user_model().objects.create(username='benchmark-card-lookup')
+        Device.objects.bulk_create([Device(device_id='bench{0}'.format(i),
+            name='bench{0}'.format(i), user=user) for i in range(device_count)])
+        devices = list(Device.objects.filter(user=user))
+        IDCard.objects.bulk_create([IDCard(device=devices[i % device_count],
+            cloud_device_id=devices[i % device_count].device_id,
+            uid='{0:X}'.format(i + 1)) for i in range(card_count)])
+
+        step = max(card_count // lookup_count, 1)
+        swipes = [(devices[i % device_count].device_id, '{0:X}'.format(i + 1))
+            for i in range(0, card_count, step)][:lookup_count]
+        misses = [(d, 'FFFFFFFF') for d, uid in swipes]
+        self.stdout.write('{0} cards on {1} devices, {2} lookups each'.format(
+            card_count, device_count, len(swipes)))
+
+        join = lambda d, uid: IDCard.objects.filter(device__device_id=d, uid=uid).count() > 0
+        index = CardIndex(version_key='common.card_index.benchmark')
+        index.allows(*swipes[0])
+        for name, lookup in (('join + count', join),
+                ('indexed probe', IDCard.objects.is_paired),
+                ('card index', index.allows)):
+            for label, data in (('hit', swipes), ('miss', misses)):
+                started = time.time()
+                for device_id, uid in data:
+                    lookup(device_id, uid)
+                elapsed = (time.time() - started) / len(data)
+                self.stdout.write('{0:>14} {1:>4}: {2:.1f} us/lookup'.format(
+                    name, label, elapsed * 1e6))
+        self.stdout.write('card index lookups: {0}'.format(', '.join('{0} {1}'.format(
+            count, name) for name, count in sorted(index.stats().items()))))
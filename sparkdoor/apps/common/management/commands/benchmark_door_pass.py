@@ -0,0 +1,92 @@
+"""
+benchmark_door_pass.py - management command that times concurrent
+    redemptions of a single shared `DoorPass`.
+"""
+import time
+import threading
+from optparse import make_option
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from sparkdoor.apps.spark.models import Device
+
+from ...models import DoorPass
+
+
+def locking_redeem(token):
+    """
+    The read-modify-write redemption that `DoorPassManager.redeem`
+    replaces, the row stays locked until the transaction commits.
+    """
+    with transaction.atomic():
+        door_pass = DoorPass.objects.select_for_update().get(token=token)
+        if door_pass.is_expired():
+            return False
+        door_pass.uses += 1
+        door_pass.save()
+        return True
+
+
+class Command(BaseCommand):
+    """
+    Creates a pass with a `--limit` of uses and has `--threads` threads
+    redeem it `--redemptions` times in total, first with a locking
+    read-modify-write and then with `DoorPassManager.redeem`, reporting
+    the throughput and how many redemptions were granted. No device is
+    contacted. The data is deleted afterwards.
+    """
+    help = 'Time concurrent redemptions of a shared door pass.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--threads', type='int', default=16),
+        make_option('--redemptions', type='int', default=2000),
+        make_option('--limit', type='int', default=1000),
+    )
+
+    def handle(self, *args, **options):
+        """
+        Run the benchmark.
+        """
+        user = get_user_model().objects.create(username='benchmark-door-pass')
+        try:
+            device = Device.objects.create(device_id='bench-door-pass', name='bench',
+                user=user)
+            for name, redeem in (('locking', locking_redeem),
+                    ('conditional update', lambda t: DoorPass.objects.redeem(t) is not None)):
+                door_pass = DoorPass.objects.create(device=device, use_limit=options['limit'])
+                granted, elapsed = self._run(redeem, door_pass.token, options['threads'],
+                    options['redemptions'])
+                uses = DoorPass.objects.get(token=door_pass.token).uses
+                self.stdout.write('{0:>18}: {1:.0f} redemptions/s, {2} granted, {3} uses '
+                    '(limit {4})'.format(name, options['redemptions'] / elapsed, granted, uses,
+                    options['limit']))
+        finally:
+            user.delete()
+
+    def _run(self, redeem, token, thread_count, redemption_count):
+        """
+        Redeem `token` from `thread_count` threads at once, returns the
+        number of granted redemptions and the elapsed time.
+        """
+        granted = []
+        start = threading.Barrier(thread_count + 1)
+
+        def worker(count):
+            start.wait()
+            try:
+                granted.append(sum(1 for i in range(count) if redeem(token)))
+            finally:
+                connection.close()
+
+        counts = [redemption_count // thread_count] * thread_count
+        counts[0] += redemption_count % thread_count
+        threads = [threading.Thread(target=worker, args=(c,)) for c in counts]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        started = time.time()
+        for thread in threads:
+            thread.join()
+        return sum(granted), time.time() - started
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.db import models, migrations
+
+
+def normalize_uid(uid):
+    """
+    Copy of `models.normalize_uid` as it was when this migration was
+    written.
+    """
+    uid = re.sub(r'[\s:-]', '', str(uid)).upper()
+    return uid.lstrip('0') or '0'
+
+
+def normalize_cards(apps, schema_editor):
+    """
+    Normalize the uids, copy the device cloud ids and remove duplicate
+    pairings, keeping the oldest.
+    """
+    IDCard = apps.get_model('common', 'IDCard')
+    seen = set()
+    duplicates = []
+    for card in IDCard.objects.select_related('device').order_by('pk'):
+        card.uid = normalize_uid(card.uid)
+        card.cloud_device_id = card.device.device_id
+        key = (card.device_id, card.uid)
+        if key in seen:
+            duplicates.append(card.pk)
+        else:
+            seen.add(key)
+            card.save(update_fields=['uid', 'cloud_device_id'])
+    for i in range(0, len(duplicates), 500):
+        IDCard.objects.filter(pk__in=duplicates[i:i + 500]).delete()
+
+
+def keep_cards(apps, schema_editor):
+    """
+    Normalized uids are still valid uids, nothing to undo.
+    """
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spark', '0006_device_app_name'),
+        ('common', '0004_remove_idcard_name'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='idcard',
+            name='uid',
+            field=models.CharField(max_length=20),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='idcard',
+            name='cloud_device_id',
+            field=models.CharField(max_length=250, editable=False, default=''),
+            preserve_default=False,
+        ),
+        migrations.RunPython(normalize_cards, keep_cards),
+        migrations.AlterUniqueTogether(
+            name='idcard',
+            unique_together=set([('device', 'uid')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='idcard',
+            index_together=set([('cloud_device_id', 'uid')]),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.utils.timezone
+from django.db import models, migrations
+
+
+def add_time_brin_index(apps, schema_editor):
+    """
+    Events are appended in time order, so on PostgreSQL (9.5 or newer)
+    a tiny BRIN index covers range scans over `time`.
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE INDEX common_doorevent_time_brin '
+            'ON common_doorevent USING brin (time)')
+
+
+def remove_time_brin_index(apps, schema_editor):
+    """
+    Drop the BRIN index added by `add_time_brin_index`.
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS common_doorevent_time_brin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spark', '0006_device_app_name'),
+        ('common', '0005_idcard_lookup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='doorevent',
+            name='event',
+            field=models.CharField(max_length=50, choices=[('open', 'open'), ('use_pass', 'use pass')]),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='doorevent',
+            name='time',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+            preserve_default=True,
+        ),
+        migrations.AlterIndexTogether(
+            name='doorevent',
+            index_together=set([('device', 'time')]),
+        ),
+        migrations.RunPython(add_time_brin_index, remove_time_brin_index),
+        migrations.CreateModel(
+            name='DoorEventRollup',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('event', models.CharField(max_length=50, choices=[('open', 'open'), ('use_pass', 'use pass')])),
+                ('period', models.CharField(max_length=4, choices=[('hour', 'hour'), ('day', 'day')])),
+                ('start', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+                ('device', models.ForeignKey(to='spark.Device')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dooreventrollup',
+            unique_together=set([('device', 'period', 'start', 'event')]),
+        ),
+        migrations.CreateModel(
+            name='RollupCursor',
+            fields=[
+                ('name', models.CharField(max_length=50, serialize=False, primary_key=True)),
+                ('position', models.BigIntegerField(default=0)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0006_door_event_rollups'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='doorevent',
+            name='event',
+            field=models.CharField(max_length=50, choices=[('open', 'open'), ('use_pass', 'use pass'), ('card_granted', 'card granted'), ('card_denied', 'card denied')]),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='dooreventrollup',
+            name='event',
+            field=models.CharField(max_length=50, choices=[('open', 'open'), ('use_pass', 'use pass'), ('card_granted', 'card granted'), ('card_denied', 'card denied')]),
+            preserve_default=True,
+        ),
+    ]
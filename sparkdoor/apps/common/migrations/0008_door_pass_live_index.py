@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+LIVE_PREDICATE = 'use_limit IS NULL OR use_limit = 0 OR uses < use_limit'
+
+
+def add_live_pass_indexes(apps, schema_editor):
+    """
+    On PostgreSQL, index only the passes that still have uses left, for
+    looking a pass up by token and for listing a device's passes. Dead
+    passes waiting for the sweeper don't make either index bigger.
+    `uses` and `use_limit` are indexed too, since PostgreSQL before 11
+    has no INCLUDE, so the check for uses left can be made on the index
+    entries.
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE INDEX common_doorpass_live_token '
+            'ON common_doorpass (token, expires_at, uses, use_limit) WHERE ' + LIVE_PREDICATE)
+        schema_editor.execute('CREATE INDEX common_doorpass_live_device '
+            'ON common_doorpass (device_id, expires_at, uses, use_limit) WHERE ' + LIVE_PREDICATE)
+
+
+def remove_live_pass_indexes(apps, schema_editor):
+    """
+    Drop the indexes added by `add_live_pass_indexes`.
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS common_doorpass_live_token')
+        schema_editor.execute('DROP INDEX IF EXISTS common_doorpass_live_device')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0007_card_events'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_live_pass_indexes, remove_live_pass_indexes),
+    ]
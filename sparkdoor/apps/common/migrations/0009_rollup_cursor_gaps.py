@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0008_door_pass_live_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollupcursor',
+            name='gaps',
+            field=models.TextField(default='{}'),
+            preserve_default=True,
+        ),
+    ]
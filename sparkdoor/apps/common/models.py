@@ -1,31 +1,200 @@
 """
 models.py - `common` app models module.
 """
+import json
 import os
+import re
 import binascii
 from datetime import datetime
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.utils import timezone
 
 from sparkdoor.apps.spark.models import Device
 
 
+class DoorEventManager(models.Manager):
+    """
+    Custom model manager for `DoorEvent`.
+    """
+    def last(self, device, event):
+        """
+        Get the most recent `event` for `device` or None.
+        """
+        try:
+            return self.filter(device=device, event=event).latest('time')
+        except DoorEvent.DoesNotExist:
+            return None
+
+
 class DoorEvent(models.Model):
     """
     Timeseries data for events that are recorded by the door app.
+
+    Events are append-only and indexed by (`device`, `time`). History
+    and analytics should read the `DoorEventRollup` counts instead of
+    scanning this table.
     """
-    OPEN_EVENT = 'open',
+    OPEN_EVENT = 'open'
     USE_PASS_EVENT = 'use_pass'
+    CARD_GRANTED_EVENT = 'card_granted'
+    CARD_DENIED_EVENT = 'card_denied'
     EVENTS = (
         (OPEN_EVENT, 'open'),
-        (USE_PASS_EVENT, 'use pass')
+        (USE_PASS_EVENT, 'use pass'),
+        (CARD_GRANTED_EVENT, 'card granted'),
+        (CARD_DENIED_EVENT, 'card denied')
     )
 
     device = models.ForeignKey(Device)
-    time = models.DateTimeField(auto_now=True)
+    time = models.DateTimeField(default=timezone.now)
     event = models.CharField(max_length=50, blank=False, choices=EVENTS)
     event_data = models.TextField(blank=True)
 
+    objects = DoorEventManager()
+
+    class Meta:
+        index_together = ('device', 'time')
+
+    def save(self, *args, **kwargs):
+        """
+        Only allow new events to be saved.
+        """
+        if not self._state.adding:
+            raise ValueError('Door events are append-only.')
+        return super(self.__class__, self).save(*args, **kwargs)
+
+
+class DoorEventRollupManager(models.Manager):
+    """
+    Custom model manager for `DoorEventRollup`.
+    """
+    def history(self, device, period, since=None):
+        """
+        Get the counts for `device` over each `period` starting from
+        `since`, oldest first.
+        """
+        rollups = self.filter(device=device, period=period)
+        if since is not None:
+            rollups = rollups.filter(start__gte=since)
+        return rollups.order_by('start')
+
+    def add(self, device_id, event, period, start, count):
+        """
+        Add `count` events to a rollup, creating it if needed.
+        """
+        rollups = self.filter(device_id=device_id, event=event, period=period, start=start)
+        if not rollups.update(count=models.F('count') + count):
+            try:
+                with transaction.atomic():
+                    self.create(device_id=device_id, event=event, period=period,
+                        start=start, count=count)
+            except IntegrityError:
+                rollups.update(count=models.F('count') + count)
+
+
+class DoorEventRollup(models.Model):
+    """
+    The number of `DoorEvent`s of each kind per device per hour or day,
+    maintained by the `tasks.rollup_door_events` task.
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIODS = (
+        (HOUR, 'hour'),
+        (DAY, 'day')
+    )
+
+    device = models.ForeignKey(Device)
+    event = models.CharField(max_length=50, choices=DoorEvent.EVENTS)
+    period = models.CharField(max_length=4, choices=PERIODS)
+    start = models.DateTimeField()
+    count = models.IntegerField(default=0)
+
+    objects = DoorEventRollupManager()
+
+    class Meta:
+        unique_together = ('device', 'period', 'start', 'event')
+
+
+class RollupCursor(models.Model):
+    """
+    Remembers the last `DoorEvent` id that was rolled up, and the ids
+    below it that were skipped because no event had them yet.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    position = models.BigIntegerField(default=0)
+    gaps = models.TextField(default='{}') # JSON, skipped id to when it was skipped
+
+    def get_gaps(self):
+        """
+        Get the skipped ids as a dictionary of the timestamp each one
+        was skipped at.
+        """
+        return {int(i): seen for i, seen in json.loads(self.gaps).items()}
+
+    def set_gaps(self, gaps):
+        """
+        Replace the skipped ids with `gaps`, see `get_gaps`.
+        """
+        self.gaps = json.dumps({str(i): seen for i, seen in gaps.items()})
+
+
+class DoorPassQuerySet(models.QuerySet):
+    """
+    Custom queryset for `DoorPass`.
+    """
+    def live(self):
+        """
+        Only passes that haven't expired and have uses left, the
+        database counterpart of `DoorPass.is_expired`.
+        """
+        return self.filter(
+            models.Q(expires_at__isnull=True) | models.Q(expires_at__gt=timezone.now())).filter(
+            models.Q(use_limit__isnull=True) | models.Q(use_limit=0) |
+            models.Q(uses__lt=models.F('use_limit')))
+
+    def dead(self, expired_before=None):
+        """
+        Only passes that have no uses left or expired before
+        `expired_before`, which defaults to now.
+        """
+        return self.filter(
+            models.Q(expires_at__lt=expired_before or timezone.now()) |
+            (models.Q(use_limit__gt=0) & models.Q(uses__gte=models.F('use_limit'))))
+
+
+class DoorPassManager(models.Manager.from_queryset(DoorPassQuerySet)):
+    """
+    Custom model manager for `DoorPass`.
+    """
+    def for_device(self, device):
+        """
+        Get the live passes for `device`.
+        """
+        return self.live().filter(device=device)
+
+    def redeem(self, token):
+        """
+        Use the pass with `token` once, returns the `DoorPass` or None
+        if there isn't a usable one.
+
+        Checking and counting the use is a single conditional UPDATE, so
+        concurrent redemptions of a shared pass never go over its
+        `use_limit` and no row lock is held once it returns.
+        """
+        usable = self.live().filter(token=token)
+        if not usable.update(uses=models.F('uses') + 1):
+            return None
+        return self.select_related('device').get(token=token)
+
+    def refund(self, door_pass):
+        """
+        Give back a use of `door_pass`, used when the door couldn't be
+        opened.
+        """
+        self.filter(token=door_pass.token, uses__gt=0).update(uses=models.F('uses') - 1)
+
 
 class DoorPass(models.Model):
     """
@@ -38,6 +207,8 @@ class DoorPass(models.Model):
     use_limit = models.IntegerField(null=True)
     uses = models.IntegerField(default=0)
 
+    objects = DoorPassManager()
+
     def is_expired(self):
         """
         Test if this token is expired or not.
@@ -65,10 +236,60 @@ class DoorPass(models.Model):
         return binascii.hexlify(os.urandom(20)).decode()
 
 
+def normalize_uid(uid):
+    """
+    Get the canonical form of a card uid: no separators or whitespace,
+    upper case and no leading zeros, so that the same card always
+    matches however the reader formats it.
+    """
+    uid = re.sub(r'[\s:-]', '', str(uid)).upper()
+    return uid.lstrip('0') or '0'
+
+
+class IDCardManager(models.Manager):
+    """
+    Custom model manager for `IDCard`.
+    """
+    def pair(self, device, uid):
+        """
+        Pair a card with a device unless it already is, returns the
+        `IDCard`.
+        """
+        card, created = self.get_or_create(device=device, uid=normalize_uid(uid),
+            defaults={'cloud_device_id': device.device_id})
+        return card
+
+    def is_paired(self, device_id, uid):
+        """
+        Check if a card is paired with the device that has the cloud id
+        `device_id`, which is a single probe of the
+        (`cloud_device_id`, `uid`) index.
+        """
+        return self.filter(cloud_device_id=device_id, uid=normalize_uid(uid)).exists()
+
+
 class IDCard(models.Model):
     """
     Stores RFID cards that can be registered with a door and used to
     open it.
+
+    The device's cloud id is copied into `cloud_device_id` so that card
+    lookups by cloud id don't need to join the device table.
     """
-    uid = models.CharField(max_length=10, blank=False)
+    uid = models.CharField(max_length=20, blank=False)
     device = models.ForeignKey(Device)
+    cloud_device_id = models.CharField(max_length=250, editable=False)
+
+    objects = IDCardManager()
+
+    class Meta:
+        unique_together = ('device', 'uid')
+        index_together = ('cloud_device_id', 'uid')
+
+    def save(self, *args, **kwargs):
+        """
+        Normalize the uid and copy the device's cloud id.
+        """
+        self.uid = normalize_uid(self.uid)
+        self.cloud_device_id = self.device.device_id
+        return super(self.__class__, self).save(*args, **kwargs)
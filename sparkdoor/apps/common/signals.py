@@ -0,0 +1,99 @@
+"""
+signals.py - signal receivers for the `common` app.
+"""
+import threading
+
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from celery.signals import worker_process_shutdown
+
+from sparkdoor.apps.spark.models import Device
+from sparkdoor.apps.spark.versions import device_versions
+
+from .cardindex import card_index
+from .events import event_buffer
+from .models import IDCard
+
+
+# the primary keys of the devices this thread is deleting.
+_deleting_devices = threading.local()
+
+
+def _deleting(device_pk):
+    """
+    Whether `device_pk` is being deleted, so its cards go along with it.
+    """
+    return device_pk in getattr(_deleting_devices, 'pks', ())
+
+
+@receiver(post_save, sender=IDCard)
+@receiver(post_delete, sender=IDCard)
+def update_card_index_for_card(sender, instance, **kwargs):
+    """
+    A card was paired or removed, only its device's entry changes.
+    Nothing is invalidated when the card goes along with its device,
+    which drops its entry itself.
+    """
+    if not _deleting(instance.device_id):
+        card_index.invalidate(instance.cloud_device_id)
+
+
+@receiver(post_save, sender=IDCard)
+@receiver(post_delete, sender=IDCard)
+def bump_device_version_for_card(sender, instance, **kwargs):
+    """
+    A card was paired or removed, so its user's cached device responses
+    are stale. Nothing is bumped when the card goes along with its
+    device, which bumps the version itself.
+    """
+    if _deleting(instance.device_id):
+        return
+    for user_id in Device.objects.filter(pk=instance.device_id).values_list('user_id',
+            flat=True):
+        device_versions.bump(user_id)
+
+
+@receiver(pre_delete, sender=Device)
+def mark_device_deleting(sender, instance, **kwargs):
+    """
+    A device is about to be removed. Its cards are deleted first and
+    their `post_delete` is sent while the device still exists, so mark
+    it for the card receivers to skip them.
+    """
+    if not hasattr(_deleting_devices, 'pks'):
+        _deleting_devices.pks = set()
+    _deleting_devices.pks.add(instance.pk)
+
+
+@receiver(post_save, sender=Device)
+def update_card_index_for_device(sender, instance, created, **kwargs):
+    """
+    A new device only adds an entry, but an existing device may have
+    changed its cloud id so its cards are updated and the whole index is
+    reloaded.
+    """
+    if created:
+        card_index.invalidate(instance.device_id)
+    else:
+        IDCard.objects.filter(device=instance).exclude(
+            cloud_device_id=instance.device_id).update(cloud_device_id=instance.device_id)
+        card_index.invalidate()
+
+
+@receiver(post_delete, sender=Device)
+def remove_device_from_card_index(sender, instance, **kwargs):
+    """
+    A device was removed, drop its entry.
+    """
+    getattr(_deleting_devices, 'pks', set()).discard(instance.pk)
+    card_index.invalidate(instance.device_id)
+
+
+@worker_process_shutdown.connect
+def close_event_buffer(**kwargs):
+    """
+    A Celery prefork child is stopping, it exits without running exit
+    handlers so write its buffered door events now.
+    """
+    event_buffer.close()
@@ -0,0 +1,39 @@
+// Keeps the door panels up to date with the live events of the user's
+// devices, see `spark.views.DeviceEventsView`.
+$(document).ready(function() {
+  var panels = $('.door-app[data-device]');
+  if (!panels.length || !window.EventSource) {
+    return;
+  }
+  function panel(evt) {
+    return panels.filter('[data-device="' + JSON.parse(evt.data).device + '"]');
+  }
+  function when(evt) {
+    var published = JSON.parse(evt.data).published_at;
+    return (published ? new Date(published) : new Date()).toLocaleString();
+  }
+  function connect() {
+    var source = new EventSource(panels.first().data('events-uri'));
+    source.addEventListener('spark/status', function(evt) {
+      var online = JSON.parse(evt.data).data === 'online';
+      panel(evt).find('.device-status')
+        .toggleClass('label-success', online)
+        .toggleClass('label-default', !online)
+        .text(online ? 'online' : 'offline');
+    });
+    source.addEventListener('sparkdoor/opened', function(evt) {
+      panel(evt).find('.last-opened').text('Last opened on ' + when(evt));
+    });
+    source.addEventListener('sparkdoor/card_paired', function(evt) {
+      panel(evt).find('.paired-cards').text('ID card paired on ' + when(evt));
+    });
+    // the browser gives up when the server refuses the stream because
+    // too many are open, try again in a while.
+    source.addEventListener('error', function() {
+      if (source.readyState === EventSource.CLOSED) {
+        setTimeout(connect, 60000);
+      }
+    });
+  }
+  connect();
+});
@@ -0,0 +1,138 @@
+"""
+tasks.py - `common` app web worker tasks module.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from celery import shared_task
+
+from sparkdoor.apps.spark.locks import singleton_task
+
+from .models import DoorEvent, DoorEventRollup, DoorPass, RollupCursor
+
+
+ROLLUP_BATCH_SIZE = 5000
+ROLLUP_LAG = 60 # seconds
+ROLLUP_GAP_TIMEOUT = 60*10 # seconds
+ROLLUP_MAX_GAPS = 10000
+SWEEP_BATCH_SIZE = 1000
+SWEEP_GRACE = timedelta(days=1)
+
+
+def count_event(counts, device_id, event, time):
+    """
+    Add an event to the hourly and daily `counts`.
+    """
+    hour = time.replace(minute=0, second=0, microsecond=0)
+    counts[(device_id, event, DoorEventRollup.HOUR, hour)] += 1
+    counts[(device_id, event, DoorEventRollup.DAY, hour.replace(hour=0))] += 1
+
+
+def save_rollup(cursor, counts, position, gaps):
+    """
+    Add `counts` to the rollups and move `cursor` to `position` with
+    `gaps` in one transaction.
+    """
+    with transaction.atomic():
+        for (device_id, event, period, start), count in counts.items():
+            DoorEventRollup.objects.add(device_id, event, period, start, count)
+        cursor.position = position
+        cursor.set_gaps(gaps)
+        cursor.save()
+
+
+def rollup_batch(cursor, cutoff, now):
+    """
+    Roll up the next batch of events after `cursor`, stopping at the
+    first event newer than `cutoff`. Ids that are passed over are
+    recorded as gaps at `now`, a timestamp. Returns the number of
+    events that were counted.
+    """
+    events = DoorEvent.objects.filter(id__gt=cursor.position).order_by('id'
+        ).values_list('id', 'device_id', 'event', 'time')[:ROLLUP_BATCH_SIZE]
+    counts = Counter()
+    position = cursor.position
+    gaps = cursor.get_gaps()
+    for event_id, device_id, event, time in events:
+        if time > cutoff:
+            break
+        for skipped in range(position + 1, min(event_id, position + 1 + ROLLUP_MAX_GAPS)):
+            gaps[skipped] = now
+        count_event(counts, device_id, event, time)
+        position = event_id
+    if len(gaps) > ROLLUP_MAX_GAPS:
+        gaps = dict(sorted(gaps.items())[-ROLLUP_MAX_GAPS:])
+    save_rollup(cursor, counts, position, gaps)
+    return sum(counts.values()) // 2
+
+
+def rollup_gaps(cursor, now):
+    """
+    Roll up the events that were committed under ids that `cursor` had
+    already passed, and forget the gaps older than `ROLLUP_GAP_TIMEOUT`
+    seconds at `now`, a timestamp, whose events were rolled back.
+    """
+    gaps = cursor.get_gaps()
+    if not gaps:
+        return
+    events = DoorEvent.objects.filter(id__gte=min(gaps), id__lt=cursor.position).values_list(
+        'id', 'device_id', 'event', 'time')
+    counts = Counter()
+    for event_id, device_id, event, time in events:
+        if gaps.pop(event_id, None) is not None:
+            count_event(counts, device_id, event, time)
+    gaps = {i: seen for i, seen in gaps.items() if seen > now - ROLLUP_GAP_TIMEOUT}
+    save_rollup(cursor, counts, cursor.position, gaps)
+
+
+@shared_task
+@singleton_task()
+def rollup_door_events():
+    """
+    Run this task periodically to fold new `DoorEvent`s into the hourly
+    and daily `DoorEventRollup` counts.
+
+    Events are read in id order from where the last run stopped, events
+    from the last `ROLLUP_LAG` seconds are left for the next run. Ids
+    are taken before their transaction commits, so an event can appear
+    under an id the cursor already passed, a batch of the
+    `events.EventBuffer` that took long to write for instance. Passed
+    over ids are kept as gaps and looked up again by every run for
+    `ROLLUP_GAP_TIMEOUT` seconds.
+    """
+    cursor, created = RollupCursor.objects.get_or_create(name='door_events')
+    now = timezone.now()
+    rollup_gaps(cursor, now.timestamp())
+    cutoff = now - timedelta(seconds=ROLLUP_LAG)
+    while rollup_batch(cursor, cutoff, now.timestamp()) == ROLLUP_BATCH_SIZE:
+        pass
+
+
+def sweep_batch(expired_before):
+    """
+    Delete up to `SWEEP_BATCH_SIZE` dead passes, returns how many were
+    deleted.
+    """
+    tokens = list(DoorPass.objects.dead(expired_before).values_list('token', flat=True)[
+        :SWEEP_BATCH_SIZE])
+    if tokens:
+        DoorPass.objects.filter(token__in=tokens).delete()
+    return len(tokens)
+
+
+@shared_task
+@singleton_task()
+def sweep_door_passes():
+    """
+    Run this task periodically to delete `DoorPass`es that are used up
+    or expired more than `SWEEP_GRACE` ago.
+
+    Passes are deleted in batches of `SWEEP_BATCH_SIZE` so that no
+    single statement holds locks on a large part of the table.
+    """
+    expired_before = timezone.now() - SWEEP_GRACE
+    while sweep_batch(expired_before) == SWEEP_BATCH_SIZE:
+        pass
@@ -0,0 +1,115 @@
+"""
+test_cardindex.py - test cases for the `common` app's cardindex module.
+"""
+from unittest import mock
+
+from django.test import TestCase
+
+from sparkdoor.apps.spark.tests.factories import DeviceFactory
+from sparkdoor.apps.spark.versions import device_versions
+from ..cardindex import CardIndex, card_index
+from ..models import IDCard
+
+
+class CardIndexTestCase(TestCase):
+    """
+    Test case for `cardindex.CardIndex`.
+    """
+    def setUp(self):
+        """
+        Add a device with a paired card.
+        """
+        self.device = DeviceFactory.create(device_id='door')
+        self.card = IDCard.objects.create(device=self.device, uid='1234')
+
+    def test_allows(self):
+        """
+        Test that `allows` only accepts cards paired with the device.
+        """
+        self.assertTrue(card_index.allows('door', '1234'))
+        self.assertFalse(card_index.allows('door', '4321'))
+        self.assertFalse(card_index.allows('not_a_door', '1234'))
+
+    def test_allows_without_queries(self):
+        """
+        Test that a loaded index answers without touching the database.
+        """
+        card_index.allows('door', '1234')
+        with self.assertNumQueries(0):
+            self.assertTrue(card_index.allows('door', '1234'))
+
+    def test_signals_refresh_index(self):
+        """
+        Test that pairing and removing cards is picked up.
+        """
+        self.assertFalse(card_index.allows('door', '5678'))
+        IDCard.objects.create(device=self.device, uid='5678')
+        self.assertTrue(card_index.allows('door', '5678'))
+        self.card.delete()
+        self.assertFalse(card_index.allows('door', '1234'))
+
+    def test_device_delete(self):
+        """
+        Test that deleting a device drops its entry once rather than
+        once for each of its cards.
+        """
+        IDCard.objects.create(device=self.device, uid='5678')
+        with mock.patch.object(card_index, 'invalidate') as invalidate, \
+                mock.patch.object(device_versions, 'bump') as bump:
+            self.device.delete()
+        invalidate.assert_called_once_with('door')
+        bump.assert_called_once_with(self.device.user_id)
+
+    def test_shared_version(self):
+        """
+        Test that another index sharing the version key reloads after
+        `invalidate` is called.
+        """
+        other = CardIndex()
+        self.assertTrue(other.allows('door', '1234'))
+        IDCard.objects.filter(pk=self.card.pk).update(uid='9999')
+        self.assertTrue(other.allows('door', '1234'))
+        card_index.invalidate()
+        self.assertFalse(other.allows('door', '1234'))
+
+    def test_max_age(self):
+        """
+        Test that a change that didn't invalidate the index is picked up
+        once the index is older than `MAX_AGE`.
+        """
+        other = CardIndex()
+        self.assertTrue(other.allows('door', '1234'))
+        IDCard.objects.filter(pk=self.card.pk).update(uid='9999')
+        self.assertTrue(other.allows('door', '1234'))
+        other._expires = 0
+        self.assertFalse(other.allows('door', '1234'))
+
+    def test_incremental_update(self):
+        """
+        Test that pairing a card only reloads that device's entry.
+        """
+        other = CardIndex()
+        other.allows('door', '1234')
+        IDCard.objects.create(device=self.device, uid='5678')
+        with self.assertNumQueries(2):
+            self.assertTrue(other.allows('door', '5678'))
+
+    def test_stats(self):
+        """
+        Test that `stats` counts hits and misses and that the counts are
+        logged when they are due.
+        """
+        index = type('LoggedIndex', (CardIndex,), {'STATS_INTERVAL': 0})()
+        with self.assertLogs('sparkdoor.apps.common.cardindex', 'INFO') as logs:
+            index.allows('door', '1234')
+            index.allows('door', 'FFFF')
+            index.allows('not_a_door', '1234')
+        self.assertEqual(index.stats(), {'allowed': 1, 'unknown_device': 1, 'unpaired': 1})
+        self.assertIn('1 allowed, 1 unknown device, 1 unpaired', logs.output[-1])
+
+    def test_device_pk(self):
+        """
+        Test that `device_pk` maps a cloud id to the device's primary key.
+        """
+        self.assertEqual(card_index.device_pk('door'), self.device.pk)
+        self.assertIsNone(card_index.device_pk('not_a_door'))
@@ -0,0 +1,109 @@
+"""
+test_events.py - test cases for the `common` app's events module.
+"""
+import os
+import signal
+import time
+
+from django.test import TestCase
+
+from sparkdoor.apps.spark.tests.factories import DeviceFactory
+from ..events import EventBuffer
+from ..models import DoorEvent
+
+
+class EventBufferTestCase(TestCase):
+    """
+    Test case for `events.EventBuffer`.
+    """
+    @classmethod
+    def setUpClass(cls):
+        """
+        Add a test device.
+        """
+        cls.device = DeviceFactory.create()
+
+    def test_flush(self):
+        """
+        Test that recorded events are only written when flushed.
+        """
+        buffer = EventBuffer(background=False)
+        buffer.record(self.device.pk, DoorEvent.OPEN_EVENT)
+        buffer.record(self.device.pk, DoorEvent.CARD_DENIED_EVENT, 'A1B')
+        self.assertEqual(DoorEvent.objects.count(), 0)
+        self.assertTrue(buffer.flush())
+        self.assertEqual(sorted(DoorEvent.objects.values_list('event', 'event_data')), [
+            (DoorEvent.CARD_DENIED_EVENT, 'A1B'), (DoorEvent.OPEN_EVENT, '')])
+
+    def test_full_buffer(self):
+        """
+        Test that an event that doesn't fit in the buffer is written
+        right away.
+        """
+        buffer = type('SmallBuffer', (EventBuffer,), {'MAX_SIZE': 1, 'PUT_TIMEOUT': 0})(
+            background=False)
+        buffer.record(self.device.pk, DoorEvent.OPEN_EVENT)
+        buffer.record(self.device.pk, DoorEvent.OPEN_EVENT)
+        self.assertEqual(DoorEvent.objects.count(), 1)
+        buffer.flush()
+        self.assertEqual(DoorEvent.objects.count(), 2)
+
+    def test_close(self):
+        """
+        Test that `close` stops the background thread and writes what
+        was buffered.
+        """
+        buffer = type('SlowBuffer', (EventBuffer,), {'FLUSH_INTERVAL': 60})()
+        buffer._write = lambda events: buffer.written.extend(events) or True
+        buffer.written = []
+        buffer.record(self.device.pk, DoorEvent.OPEN_EVENT)
+        buffer.close()
+        self.assertIsNone(buffer._thread)
+        self.assertEqual([e.event for e in buffer.written], [DoorEvent.OPEN_EVENT])
+
+    def test_close_when_full(self):
+        """
+        Test that `close` doesn't block on a full buffer while the
+        database is down.
+        """
+        buffer = type('StuckBuffer', (EventBuffer,), {'MAX_SIZE': 1, 'PUT_TIMEOUT': 0,
+            'FLUSH_INTERVAL': 0.01, 'RETRY_DELAY': 60})()
+        buffer._write = lambda events: False
+        buffer.record(self.device.pk, DoorEvent.OPEN_EVENT)
+        while not buffer._queue.empty():
+            time.sleep(0.01)
+        buffer.record(self.device.pk, DoorEvent.OPEN_EVENT)
+        self.assertTrue(buffer._queue.full())
+        buffer.close(timeout=1)
+        self.assertIsNone(buffer._thread)
+        self.assertFalse(buffer.flush())
+
+    def test_close_retries(self):
+        """
+        Test that `close` keeps trying to write what is left while the
+        database can't be reached.
+        """
+        buffer = type('RetryBuffer', (EventBuffer,), {'RETRY_DELAY': 0.01})(background=False)
+        attempts = []
+        buffer._write = lambda events: attempts.append(len(events)) or len(attempts) > 2
+        buffer.record(self.device.pk, DoorEvent.OPEN_EVENT)
+        self.assertTrue(buffer.close(timeout=1))
+        self.assertEqual(attempts, [1, 1, 1])
+
+    def test_signal_handler(self):
+        """
+        Test that the buffer is closed when the process gets the signal
+        and that the signal is then handled as before.
+        """
+        handled = []
+        previous = signal.signal(signal.SIGUSR1, lambda signum, frame: handled.append(signum))
+        try:
+            buffer = EventBuffer(background=False)
+            self.assertTrue(buffer.install_signal_handler(signal.SIGUSR1))
+            buffer.record(self.device.pk, DoorEvent.OPEN_EVENT)
+            os.kill(os.getpid(), signal.SIGUSR1)
+            time.sleep(0.01)
+        finally:
+            signal.signal(signal.SIGUSR1, previous)
+        self.assertEqual(handled, [signal.SIGUSR1])
+        self.assertEqual(DoorEvent.objects.count(), 1)
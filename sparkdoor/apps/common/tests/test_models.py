@@ -4,9 +4,10 @@ test_models.py - test cases for the `common` app's models module.
 from datetime import datetime, timedelta
 
 from django.test import TestCase
+from django.utils import timezone
 
 from sparkdoor.apps.spark.tests.factories import DeviceFactory
-from .factories import DoorPassFactory
+from .factories import DoorEventFactory, DoorPassFactory
 from .. import models
 
 
@@ -59,3 +60,121 @@ class DoorPassTestCase(TestCase):
         good_pass = DoorPassFactory.create(device=self.device, use_limit=2, uses=0)
         self.assertTrue(expired_pass.is_expired())
         self.assertFalse(good_pass.is_expired())
+
+    def test_redeem(self):
+        """
+        Test that `redeem` counts uses and stops at the use limit.
+        """
+        door_pass = DoorPassFactory.create(device=self.device, use_limit=2)
+        self.assertEqual(models.DoorPass.objects.redeem(door_pass.token).uses, 1)
+        self.assertEqual(models.DoorPass.objects.redeem(door_pass.token).uses, 2)
+        self.assertIsNone(models.DoorPass.objects.redeem(door_pass.token))
+        self.assertIsNone(models.DoorPass.objects.redeem('not_a_token'))
+
+    def test_redeem_expired(self):
+        """
+        Test that `redeem` refuses a pass past its expiration date.
+        """
+        door_pass = DoorPassFactory.create(device=self.device,
+            expires_at=timezone.now() - timedelta(hours=1))
+        self.assertIsNone(models.DoorPass.objects.redeem(door_pass.token))
+
+    def test_for_device(self):
+        """
+        Test that `for_device` only lists live passes.
+        """
+        live = DoorPassFactory.create(device=self.device, use_limit=2, uses=1)
+        DoorPassFactory.create(device=self.device, use_limit=2, uses=2)
+        DoorPassFactory.create(device=self.device,
+            expires_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(list(models.DoorPass.objects.for_device(self.device)), [live])
+
+    def test_refund(self):
+        """
+        Test that `refund` gives a use back.
+        """
+        door_pass = DoorPassFactory.create(device=self.device, use_limit=1)
+        door_pass = models.DoorPass.objects.redeem(door_pass.token)
+        models.DoorPass.objects.refund(door_pass)
+        self.assertIsNotNone(models.DoorPass.objects.redeem(door_pass.token))
+
+
+class IDCardTestCase(TestCase):
+    """
+    Test case for `models.IDCard`.
+    """
+    def setUp(self):
+        """
+        Add a test device.
+        """
+        self.device = DeviceFactory.create(device_id='door')
+
+    def test_normalize_uid(self):
+        """
+        Test that `normalize_uid` drops separators, whitespace and
+        leading zeros and upper cases the uid.
+        """
+        self.assertEqual(models.normalize_uid(' 0a:1b-2c '), 'A1B2C')
+        self.assertEqual(models.normalize_uid('000'), '0')
+        self.assertEqual(models.normalize_uid(1234), '1234')
+
+    def test_save(self):
+        """
+        Test that `save` normalizes the uid and copies the device's
+        cloud id.
+        """
+        card = models.IDCard(device=self.device, uid='0a:1b')
+        card.save()
+        self.assertEqual(card.uid, 'A1B')
+        self.assertEqual(card.cloud_device_id, 'door')
+
+    def test_pair(self):
+        """
+        Test that pairing the same card twice keeps a single `IDCard`.
+        """
+        first = models.IDCard.objects.pair(self.device, 'a1b')
+        second = models.IDCard.objects.pair(self.device, '0A1B')
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(models.IDCard.objects.filter(device=self.device).count(), 1)
+
+    def test_is_paired(self):
+        """
+        Test that `is_paired` looks cards up by cloud id and uid.
+        """
+        models.IDCard.objects.pair(self.device, 'a1b')
+        self.assertTrue(models.IDCard.objects.is_paired('door', 'A1:B'))
+        self.assertFalse(models.IDCard.objects.is_paired('door', 'b1a'))
+        self.assertFalse(models.IDCard.objects.is_paired('not_a_door', 'a1b'))
+
+
+class DoorEventTestCase(TestCase):
+    """
+    Test case for `models.DoorEvent`.
+    """
+    @classmethod
+    def setUpClass(cls):
+        """
+        Add a test device.
+        """
+        cls.device = DeviceFactory.create()
+
+    def test_append_only(self):
+        """
+        Test that a saved event can't be saved again.
+        """
+        event = DoorEventFactory.create(device=self.device)
+        with self.assertRaises(ValueError):
+            event.save()
+
+    def test_last(self):
+        """
+        Test that `last` finds the most recent event of a kind.
+        """
+        now = timezone.now()
+        self.assertIsNone(models.DoorEvent.objects.last(self.device, models.DoorEvent.OPEN_EVENT))
+        DoorEventFactory.create(device=self.device, time=now - timedelta(hours=1))
+        latest = DoorEventFactory.create(device=self.device, time=now)
+        DoorEventFactory.create(device=self.device, time=now + timedelta(hours=1),
+            event=models.DoorEvent.USE_PASS_EVENT)
+        self.assertEqual(
+            models.DoorEvent.objects.last(self.device, models.DoorEvent.OPEN_EVENT), latest)
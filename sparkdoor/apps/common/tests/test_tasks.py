@@ -0,0 +1,125 @@
+"""
+test_tasks.py - test cases for the `common` app's tasks module.
+"""
+from datetime import datetime, timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from sparkdoor.apps.spark.tests.factories import DeviceFactory
+from .factories import DoorEventFactory, DoorPassFactory
+from ..tasks import ROLLUP_GAP_TIMEOUT, rollup_door_events, rollup_gaps, sweep_door_passes
+from ..models import DoorEvent, DoorEventRollup, DoorPass, RollupCursor
+
+
+spark_test_settings = {
+    'CLOUD_USERNAME': 'a_user',
+    'CLOUD_PASSWORD': 'password',
+    'LOCK_URL': 'cache://',
+    'APPS': {}
+}
+
+
+@override_settings(SPARK=spark_test_settings)
+class RollupDoorEventsTestCase(TestCase):
+    """
+    Test case for `tasks.rollup_door_events`.
+    """
+    @classmethod
+    def setUpClass(cls):
+        """
+        Add a test device.
+        """
+        cls.device = DeviceFactory.create()
+        cls.day = datetime(2014, 11, 1, tzinfo=timezone.utc)
+
+    def counts(self, period):
+        """
+        Get the rollup counts for `period` as (start, event, count)
+        tuples.
+        """
+        rollups = DoorEventRollup.objects.history(self.device, period)
+        return [(r.start, r.event, r.count) for r in rollups]
+
+    def test_rollup(self):
+        """
+        Test that events are counted per hour and per day.
+        """
+        for minutes in [5, 10, 70]:
+            DoorEventFactory.create(device=self.device,
+                time=self.day + timedelta(minutes=minutes))
+        DoorEventFactory.create(device=self.device, time=self.day + timedelta(minutes=15),
+            event=DoorEvent.USE_PASS_EVENT)
+        rollup_door_events()
+        hour = timedelta(hours=1)
+        self.assertEqual(sorted(self.counts(DoorEventRollup.HOUR)), [
+            (self.day, DoorEvent.OPEN_EVENT, 2),
+            (self.day, DoorEvent.USE_PASS_EVENT, 1),
+            (self.day + hour, DoorEvent.OPEN_EVENT, 1)])
+        self.assertEqual(sorted(self.counts(DoorEventRollup.DAY)), [
+            (self.day, DoorEvent.OPEN_EVENT, 3),
+            (self.day, DoorEvent.USE_PASS_EVENT, 1)])
+
+    def test_rollup_is_incremental(self):
+        """
+        Test that events are only counted once across runs and that
+        recent events wait for a later run.
+        """
+        DoorEventFactory.create(device=self.device, time=self.day)
+        rollup_door_events()
+        DoorEventFactory.create(device=self.device, time=self.day)
+        DoorEventFactory.create(device=self.device, time=timezone.now())
+        rollup_door_events()
+        self.assertEqual(self.counts(DoorEventRollup.DAY),
+            [(self.day, DoorEvent.OPEN_EVENT, 2)])
+
+    def test_rollup_late_commit(self):
+        """
+        Test that an event committed under an id that was already passed
+        is counted by a later run, and that such gaps are forgotten
+        after `ROLLUP_GAP_TIMEOUT`.
+        """
+        late = DoorEventFactory.create(device=self.device, time=self.day)
+        DoorEventFactory.create(device=self.device, time=self.day)
+        late_id = late.id
+        late.delete()
+        rollup_door_events()
+        self.assertEqual(RollupCursor.objects.get().get_gaps().keys(), {late_id})
+        DoorEventFactory.create(id=late_id, device=self.device, time=self.day)
+        rollup_door_events()
+        self.assertEqual(self.counts(DoorEventRollup.DAY),
+            [(self.day, DoorEvent.OPEN_EVENT, 2)])
+        cursor = RollupCursor.objects.get()
+        self.assertEqual(cursor.get_gaps(), {})
+        cursor.set_gaps({late_id - 1: 0})
+        rollup_gaps(cursor, ROLLUP_GAP_TIMEOUT + 1)
+        self.assertEqual(RollupCursor.objects.get().get_gaps(), {})
+
+
+@override_settings(SPARK=spark_test_settings)
+class SweepDoorPassesTestCase(TestCase):
+    """
+    Test case for `tasks.sweep_door_passes`.
+    """
+    @classmethod
+    def setUpClass(cls):
+        """
+        Add a test device.
+        """
+        cls.device = DeviceFactory.create()
+
+    def test_sweep(self):
+        """
+        Test that used up and long expired passes are deleted.
+        """
+        now = timezone.now()
+        keep = [
+            DoorPassFactory.create(device=self.device),
+            DoorPassFactory.create(device=self.device, use_limit=2, uses=1),
+            DoorPassFactory.create(device=self.device, expires_at=now + timedelta(days=1)),
+            DoorPassFactory.create(device=self.device, expires_at=now - timedelta(hours=1))]
+        DoorPassFactory.create(device=self.device, use_limit=2, uses=2)
+        DoorPassFactory.create(device=self.device, expires_at=now - timedelta(days=2))
+        sweep_door_passes()
+        self.assertEqual(set(DoorPass.objects.values_list('token', flat=True)),
+            set(p.token for p in keep))
@@ -1,11 +1,32 @@
 """
 test_views.py - test cases for the `common` app's view module.
 """
-from django.test import SimpleTestCase
+from unittest import mock
 
-from sparkdoor.libs.testmixins import ViewsTestMixin
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from sparkdoor.apps.spark.apps import DeviceAppBase, DeviceAppError
+from sparkdoor.apps.spark.tests.factories import DeviceFactory
+from sparkdoor.libs.testmixins import ViewsTestMixin, APITestMixin
 
 from .. import views
+from ..events import EventBuffer
+from ..models import DoorEvent, DoorPass, IDCard
+from .factories import DoorPassFactory
+
+
+class OpenTestApp(DeviceAppBase):
+    action_names = ['open']
+    def action(self, name, args=None):
+        if self.device.name == 'broken':
+            raise DeviceAppError('Device could not be reached', 504)
+
+
+spark_test_settings = {
+    'CLOUD_USERNAME': 'a_user',
+    'CLOUD_PASSWORD': 'password',
+    'APPS': {'open_app': OpenTestApp}
+}
 
 
 class HomeViewTestCase(ViewsTestMixin, SimpleTestCase):
@@ -19,3 +40,116 @@ class HomeViewTestCase(ViewsTestMixin, SimpleTestCase):
         Test that the correct template is used.
         """
         self.assertCorrectTemplateUsed('common/home.html')
+
+
+class IDCardOpenViewTestCase(APITestMixin, TestCase):
+    """
+    Test case for `views.IDCardOpenView`.
+    """
+    view_class = views.IDCardOpenView
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Add a device with a paired card.
+        """
+        cls.device = DeviceFactory.create(device_id='door')
+        cls.card = IDCard.objects.create(device=cls.device, uid='1234')
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Clean up test data.
+        """
+        cls.card.delete()
+        cls.device.delete()
+
+    def test_paired_card(self):
+        """
+        Test that a paired card gets a 200.
+        """
+        response = self.send_request_to_view(method='POST',
+            data={'device_id': 'door', 'card_uid': '1234'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_unpaired_card(self):
+        """
+        Test that an unknown card gets a 403.
+        """
+        response = self.send_request_to_view(method='POST',
+            data={'device_id': 'door', 'card_uid': '4321'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_invalid_data(self):
+        """
+        Test that a request without a card uid gets a 400.
+        """
+        response = self.send_request_to_view(method='POST', data={'device_id': 'door'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_records_events(self):
+        """
+        Test that granted and denied swipes are buffered as events.
+        """
+        buffer = EventBuffer(background=False)
+        with mock.patch.object(views, 'event_buffer', buffer):
+            self.send_request_to_view(method='POST',
+                data={'device_id': 'door', 'card_uid': '1234'})
+            self.send_request_to_view(method='POST',
+                data={'device_id': 'door', 'card_uid': '4321'})
+            self.send_request_to_view(method='POST',
+                data={'device_id': 'not_a_door', 'card_uid': '1234'})
+        self.assertEqual(DoorEvent.objects.count(), 0)
+        buffer.flush()
+        self.assertEqual(sorted(DoorEvent.objects.values_list('event', 'event_data')), [
+            (DoorEvent.CARD_DENIED_EVENT, '4321'), (DoorEvent.CARD_GRANTED_EVENT, '1234')])
+
+
+@override_settings(SPARK=spark_test_settings)
+class DoorPassRedeemViewTestCase(APITestMixin, TestCase):
+    """
+    Test case for `views.DoorPassRedeemView`.
+    """
+    view_class = views.DoorPassRedeemView
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Add a working and a broken door.
+        """
+        cls.device = DeviceFactory.create(app_name='open_app')
+        cls.broken = DeviceFactory.create(app_name='open_app', name='broken')
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Clean up test data.
+        """
+        cls.device.delete()
+        cls.broken.delete()
+
+    def redeem(self, door_pass):
+        """
+        POST to the view for `door_pass`.
+        """
+        with mock.patch.object(views, 'event_buffer', EventBuffer(background=False)):
+            return self.send_request_to_view(method='POST',
+                kwargs={'token': door_pass.token})
+
+    def test_redeem(self):
+        """
+        Test that a pass opens the door until it runs out of uses.
+        """
+        door_pass = DoorPassFactory.create(device=self.device, use_limit=1)
+        response = self.redeem(door_pass)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'uses': 1, 'use_limit': 1})
+        self.assertEqual(self.redeem(door_pass).status_code, 403)
+
+    def test_open_fails(self):
+        """
+        Test that a use is given back if the door can't be opened.
+        """
+        door_pass = DoorPassFactory.create(device=self.broken, use_limit=1)
+        self.assertEqual(self.redeem(door_pass).status_code, 504)
+        self.assertEqual(DoorPass.objects.get(token=door_pass.token).uses, 0)
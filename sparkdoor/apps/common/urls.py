@@ -12,6 +12,11 @@ urlpatterns = patterns('',
         name='id-card-open'
     ),
 
+    url(r'^api/door-pass/(?P<token>[0-9a-f]{40})/redeem$',
+        views.DoorPassRedeemView.as_view(),
+        name='door-pass-redeem'
+    ),
+
     url(r'^profile$',
         views.ProfileView.as_view(),
         name='profile'
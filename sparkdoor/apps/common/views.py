@@ -6,9 +6,12 @@ from django.views.generic.base import TemplateView
 
 from rest_framework import views, response, serializers, permissions
 
+from sparkdoor.apps.spark.apps import DeviceAppError
 from sparkdoor.apps.spark.views import UserDevicesViewBase
 
-from .models import IDCard
+from .cardindex import card_index
+from .events import event_buffer
+from .models import DoorEvent, DoorPass, normalize_uid
 
 
 class HomeView(TemplateView):
@@ -40,7 +43,8 @@ class IDCardOpenView(views.APIView):
     API view that is POSTed to by a door device. The POST data must
     include a `device_id` and a `card_uid`. If a match is successfull,
     indicating that the door can be opened, a 200 is returned, otherwise
-    a 403. 
+    a 403. Every decision for a registered device is recorded as a
+    `DoorEvent`.
     """
     permission_classes = (permissions.AllowAny,)
 
@@ -52,18 +56,55 @@ class IDCardOpenView(views.APIView):
         if not serializer.is_valid():
             print(serializer.errors)
             return response.Response('Invalid request data.', 400)
-        if self.can_open_door(serializer.data):
+        allowed = self.can_open_door(serializer.data)
+        self.record_event(serializer.data, allowed)
+        if allowed:
             return response.Response('Valid ID card.', 200)
         return response.Response('Invalid ID card.', 403)
 
     def can_open_door(self, data):
         """
         Check if the provided `card_uid` is allowed to open the door
-        that corresponds to the provided `device_id`.
+        that corresponds to the provided `device_id`. This is answered
+        from the in-memory `cardindex.card_index`.
         """
+        return card_index.allows(data['device_id'], normalize_uid(data['card_uid']))
+
+    def record_event(self, data, allowed):
+        """
+        Buffer a `DoorEvent` for the swipe, unless the device isn't
+        registered.
+        """
+        device_pk = card_index.device_pk(data['device_id'])
+        if device_pk is not None:
+            event = DoorEvent.CARD_GRANTED_EVENT if allowed else DoorEvent.CARD_DENIED_EVENT
+            event_buffer.record(device_pk, event, normalize_uid(data['card_uid']))
+
+
+class DoorPassRedeemView(views.APIView):
+    """
+    API view that uses a `DoorPass` to open its door. The pass is used
+    once for every successful POST, a 403 is returned if the pass
+    doesn't exist, is expired or has no uses left. If the door can't
+    be opened the use is given back.
+    """
+    permission_classes = (permissions.AllowAny,)
+
+    def post(self, request, token, *args, **kwargs):
+        """
+        POST handler.
+        """
+        door_pass = DoorPass.objects.redeem(token)
+        if door_pass is None:
+            return response.Response({'detail': 'Invalid or expired pass.'}, 403)
+        app = door_pass.device.get_app()
+        if 'open' not in app.get_action_names():
+            DoorPass.objects.refund(door_pass)
+            return response.Response({'detail': 'This device has no door.'}, 404)
         try:
-            cards = IDCard.objects.filter(device__device_id=data['device_id'],
-                uid=data['card_uid'])
-        except:
-            return False
-        return cards.count() > 0
+            app.action('open')
+        except DeviceAppError as err:
+            DoorPass.objects.refund(door_pass)
+            return response.Response({'detail': err.msg}, err.status_code)
+        event_buffer.record(door_pass.device_id, DoorEvent.USE_PASS_EVENT)
+        return response.Response({'uses': door_pass.uses, 'use_limit': door_pass.use_limit}, 200)
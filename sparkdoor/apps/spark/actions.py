@@ -0,0 +1,45 @@
+"""
+actions.py - status records for device actions that run on a Celery
+    worker instead of in the request.
+"""
+import json
+import uuid
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import DeviceAction
+
+
+PENDING = DeviceAction.PENDING
+DONE = DeviceAction.DONE
+
+
+def create_action(user):
+    """
+    Record a new pending action for `user` and return its id.
+    """
+    return DeviceAction.objects.create(id=uuid.uuid4().hex, user=user).id
+
+
+def finish_action(action_id, status, data):
+    """
+    Record the response `status` code and `data` of a finished action.
+    """
+    DeviceAction.objects.filter(id=action_id, state=PENDING).update(state=DONE,
+        status=status, data=json.dumps(data, cls=DjangoJSONEncoder))
+
+
+def get_action(action_id, user):
+    """
+    Get the status of `action_id` as a dictionary with its `state` and,
+    once it is done, its `status` and `data`. Returns None if it
+    doesn't exist, has expired or belongs to another user.
+    """
+    try:
+        action = DeviceAction.objects.live().get(id=action_id, user=user)
+    except DeviceAction.DoesNotExist:
+        return None
+    record = {'state': action.state}
+    if action.state == DONE:
+        record.update(status=action.status, data=json.loads(action.data))
+    return record
@@ -0,0 +1,48 @@
+"""
+admin.py - `spark` app admin site module.
+"""
+from django.contrib import admin, messages
+
+from .breaker import CircuitBreaker, cloud_breaker, device_breaker
+from .models import Device
+from .settings import get_spark_settings
+
+
+class DeviceAdmin(admin.ModelAdmin):
+    """
+    Lists devices with the state of their circuit breakers, the state of
+    the Spark cloud's breaker is shown above the list.
+    """
+    list_display = ('name', 'device_id', 'app_name', 'user', 'breaker_state')
+    search_fields = ('name', 'device_id')
+    actions = ['reset_breakers']
+
+    def breaker_state(self, obj):
+        """
+        The state of the device's circuit breaker.
+        """
+        return device_breaker(obj.device_id).state()
+    breaker_state.short_description = 'circuit'
+
+    def reset_breakers(self, request, queryset):
+        """
+        Close the circuit breakers of the selected devices.
+        """
+        for device in queryset:
+            device_breaker(device.device_id).reset()
+    reset_breakers.short_description = 'Close the circuit of the selected devices'
+
+    def changelist_view(self, request, extra_context=None):
+        """
+        Report the Spark cloud's breaker along with the device list.
+        """
+        api_uri = get_spark_settings().API_URI
+        stats = cloud_breaker(api_uri).stats()
+        level = messages.INFO if stats['state'] == CircuitBreaker.CLOSED else messages.WARNING
+        messages.add_message(request, level, 'Spark cloud circuit for {0} is {1}, {2} of '
+            '{3} recent requests failed.'.format(api_uri, stats['state'], stats['failures'],
+            stats['calls']))
+        return super(DeviceAdmin, self).changelist_view(request, extra_context)
+
+
+admin.site.register(Device, DeviceAdmin)
@@ -0,0 +1,335 @@
+"""
+aioservices.py - asyncio counterpart of the `services` module for
+    driving many Spark devices concurrently from a single thread.
+"""
+import asyncio
+import threading
+import time
+import weakref
+from datetime import timedelta, datetime
+
+from django.utils import timezone
+
+import aiohttp
+
+from .breaker import cloud_breaker, device_breaker
+from .retries import backoff, retry_budget
+from .services import CLOUD_DATETIME_FORMAT, RETRY_STATUSES, ServiceError
+from .settings import get_spark_settings
+from .timeouts import adaptive_timeout, latency_tracker
+
+
+class AsyncTransport:
+    """
+    A pooled `aiohttp.ClientSession` plus a semaphore that bounds how
+    many cloud requests are in flight at once. One is shared by every
+    `AsyncSparkCloud` on an event loop.
+    """
+    def __init__(self, concurrency=100, loop=None):
+        """
+        Constructor.
+        """
+        self.loop = loop or asyncio.get_event_loop()
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency, loop=self.loop)
+        connector = aiohttp.TCPConnector(limit=concurrency, loop=self.loop)
+        self.session = aiohttp.ClientSession(connector=connector, loop=self.loop)
+
+    def close(self):
+        """
+        Close all pooled connections.
+        """
+        self.session.close()
+
+
+_transports = weakref.WeakKeyDictionary()
+_transports_lock = threading.Lock()
+
+
+def get_async_transport(loop=None):
+    """
+    Get the `AsyncTransport` for `loop`, or the current event loop,
+    creating it from the `SPARK` settings on first use.
+    """
+    loop = loop or asyncio.get_event_loop()
+    with _transports_lock:
+        transport = _transports.get(loop)
+        if transport is None:
+            transport = AsyncTransport(get_spark_settings().ASYNC_CONCURRENCY, loop)
+            _transports[loop] = transport
+        return transport
+
+
+class AsyncSparkCloud:
+    """
+    Asynchronous interface to a Spark cloud web service. Mirrors
+    `services.SparkCloud` except that every method is a coroutine.
+
+    Fanning out to many devices is a matter of gathering coroutines,
+    the transport's semaphore keeps the number of requests in flight
+    bounded:
+
+        cloud = AsyncSparkCloud(api_uri, access_token)
+        results = loop.run_until_complete(cloud.call_many(ids, 'open'))
+    """
+    def __init__(self, api_uri, access_token=None, transport=None):
+        """
+        Instances a new web service using the path in `api_uri`. An
+        `access_token` can be specified if one has already been granted.
+        """
+        self.api_uri = api_uri.rstrip('/')
+        self.access_token = access_token
+        self.transport = transport or get_async_transport()
+
+    @asyncio.coroutine
+    def _request(self, method, *path, key=None, device_id=None, retry=False, **kwargs):
+        """
+        Send a request to the cloud and return a tuple of the status
+        code and the decoded JSON content, which is None for a failed
+        request.
+
+        Like `services.SparkCloud._send`, a request for a `key` gets a
+        timeout adapted to the latency of earlier requests for `key`
+        and goes through the circuit breakers for this cloud and, if
+        given, the device `device_id`. Only idempotent requests should
+        be sent with `retry`, they are retried up to `READ_RETRIES`
+        times on errors that may pass while the `retries.RetryBudget`
+        allows it. Requests without a `key`, for access tokens, only
+        get the `TIMEOUT` setting.
+
+        Raises `ServiceError(503)` without sending anything while a
+        breaker is open, `ServiceError(503)` if the cloud can't be
+        reached and `ServiceError(504)` if it doesn't answer in time.
+        """
+        url = '/'.join([self.api_uri] + [str(p) for p in path])
+        s = get_spark_settings()
+        retries = s.READ_RETRIES if retry else 0
+        budget = retry_budget()
+        budget.deposit()
+        result, status_code = None, 504
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                yield from asyncio.sleep(backoff(attempt), loop=self.transport.loop)
+            timeout = s.TIMEOUT if key is None else adaptive_timeout(key)
+            result, status_code = yield from self._attempt(method, url, kwargs, timeout,
+                key, device_id)
+            if (status_code not in RETRY_STATUSES or attempt == retries or
+                    not budget.withdraw()):
+                break
+        if result is None:
+            raise ServiceError(status_code)
+        return result
+
+    @asyncio.coroutine
+    def _attempt(self, method, url, kwargs, timeout, key, device_id):
+        """
+        Make a single attempt at a request for `_request` with
+        `timeout`, returns the tuple of the status code and content, or
+        None if there wasn't a response, and the status code.
+        """
+        breakers = []
+        if key is not None:
+            breakers.append(cloud_breaker(self.api_uri))
+            if device_id is not None:
+                breakers.append(device_breaker(device_id))
+        with (yield from self.transport.semaphore):
+            tickets = []
+            for breaker in breakers:
+                ticket = breaker.admit()
+                if ticket is None:
+                    for b, t in tickets:
+                        b.cancel(t)
+                    raise ServiceError(503)
+                tickets.append((breaker, ticket))
+            started = time.time()
+            try:
+                result = yield from asyncio.wait_for(self._send(method, url, kwargs),
+                    timeout, loop=self.transport.loop)
+            except asyncio.TimeoutError:
+                # the request took at least `timeout`, so the timeouts for
+                # `key` grow when it keeps timing out.
+                if key is not None:
+                    latency_tracker.observe(key, timeout)
+                # the cloud answers slowly when the device does, so only the
+                # device's breaker counts it as a failure.
+                status_code = 504 if device_id is not None else None
+                for b, t in tickets:
+                    b.record(t, status_code)
+                return None, 504
+            except aiohttp.ClientError:
+                # the device isn't to blame when the cloud can't be reached.
+                if tickets:
+                    tickets[0][0].record(tickets[0][1], None)
+                for b, t in tickets[1:]:
+                    b.cancel(t)
+                return None, 503
+        if key is not None:
+            latency_tracker.observe(key, time.time() - started)
+        for b, t in tickets:
+            b.record(t, result[0])
+        return result, result[0]
+
+    @asyncio.coroutine
+    def _send(self, method, url, kwargs):
+        """
+        Send a request and read its content for `_attempt`.
+        """
+        response = yield from self.transport.session.request(method, url, **kwargs)
+        try:
+            data = None
+            if 200 <= response.status < 300:
+                data = yield from response.json()
+        finally:
+            yield from response.release()
+        return response.status, data
+
+    @asyncio.coroutine
+    def renew_token(self, username, password):
+        """
+        Will attempt to get a new access_token from the cloud service
+        using `username` and `password`.
+
+        An invalid login will return the tuple (None, None) otherwise a
+        tuple (access_token, expires_by) is returned and the
+        `access_token` attribute is set.
+        """
+        self.access_token = None
+        expires_at = None
+        data = {'grant_type': 'password', 'username': username, 'password': password}
+        status, d = yield from self._request('POST', 'oauth', 'token',
+            auth=aiohttp.BasicAuth('spark', 'spark'), data=data)
+        if d is not None:
+            self.access_token = d['access_token']
+            expires_at = timezone.now() + timedelta(seconds=int(d['expires_in']))
+        return (self.access_token, expires_at)
+
+    @asyncio.coroutine
+    def discover_tokens(self, username, password):
+        """
+        Will attempt to find any tokens already active on this account.
+        If any are found, the most recent token will be returned in a
+        tuple (access_token, expires_by) and the `access_token`
+        attribute is set, otherwise (None, None) is returned.
+        """
+        token, expires_at = None, None
+        status, entries = yield from self._request('GET', 'v1', 'access_tokens',
+            auth=aiohttp.BasicAuth(username, password))
+        for entry in entries or []:
+            entry['expires_at'] = datetime.strptime(entry['expires_at'],
+                CLOUD_DATETIME_FORMAT)
+            if expires_at is None or entry['expires_at'] > expires_at:
+                expires_at = entry['expires_at']
+                token = entry['token']
+                self.access_token = token
+        return (token, expires_at)
+
+    @asyncio.coroutine
+    def all_devices(self):
+        """
+        Get the available Spark cores from this access token.
+        """
+        if self.access_token is None:
+            return []
+        status, devices = yield from self._request('GET', 'v1', 'devices',
+            key=('devices', self.api_uri), retry=True,
+            params={'access_token': self.access_token})
+        return [AsyncCloudDevice(self, **d) for d in devices or []]
+
+    @asyncio.coroutine
+    def device(self, device_id):
+        """
+        Get an available Spark core for a given device id.
+        """
+        if self.access_token is None:
+            return None
+        status, device = yield from self._request('GET', 'v1', 'devices', device_id,
+            key=('device', self.api_uri), retry=True,
+            params={'access_token': self.access_token})
+        if device is None:
+            return None
+        cloud_device = AsyncCloudDevice(self, **device)
+        cloud_device._extra = device
+        return cloud_device
+
+    @asyncio.coroutine
+    def call_many(self, device_ids, func_name, func_args=None):
+        """
+        Call a function on many devices at once. Returns a dictionary
+        mapping each device id to the result of its call or to the
+        `ServiceError` it raised.
+        """
+        devices = [AsyncCloudDevice(self, id=i) for i in device_ids]
+        results = yield from asyncio.gather(
+            *[d.call(func_name, func_args) for d in devices],
+            loop=self.transport.loop, return_exceptions=True)
+        return dict(zip(device_ids, results))
+
+
+class AsyncCloudDevice:
+    """
+    Represents a Spark cloud device. Mirrors `services.CloudDevice`
+    except that `call` and `read` are coroutines.
+    """
+    def __init__(self, cloud, id=None, name=None, connected=True, last_heard=None, **kwargs):
+        """
+        Constructor.
+        """
+        self.cloud = cloud
+        self.name = name
+        self.id = id
+        self.connected = connected
+        self.last_heard = last_heard
+        self.last_app = None
+        self._extra = {}
+
+    @asyncio.coroutine
+    def call(self, func_name, func_args):
+        """
+        Call a function on this device and return the result which will
+        always be an integer for a successful call. An unsuccessful call
+        will raise a `ServiceError`.
+        """
+        status, data = yield from self.cloud._request('POST', 'v1', 'devices', self.id,
+            func_name, key=('call', func_name, self.id), device_id=self.id,
+            data={'access_token': self.cloud.access_token, 'args': str(func_args)})
+        if data is None:
+            raise ServiceError(status)
+        try:
+            return data['return_value']
+        except KeyError:
+            # this typically indicates that the device is not connected.
+            raise ServiceError(504)
+
+    @asyncio.coroutine
+    def read(self, var_name):
+        """
+        Read the value of a variable. An unsuccessful read will raise a
+        `ServiceError`.
+        """
+        status, data = yield from self.cloud._request('GET', 'v1', 'devices', self.id,
+            var_name, key=('read', self.id), device_id=self.id, retry=True,
+            params={'access_token': self.cloud.access_token})
+        if data is None:
+            raise ServiceError(status)
+        try:
+            return data['result']
+        except KeyError:
+            # this typically indicates that the device is not connected.
+            raise ServiceError(504)
+
+    @property
+    def variables(self):
+        """
+        The available variables for this device as a dictionary mapping
+        a name to a type (either 'int32', 'string', or 'double'). Only
+        known for devices from `AsyncSparkCloud.device`.
+        """
+        return self._extra.get('variables', {})
+
+    @property
+    def functions(self):
+        """
+        The available functions for this device in a list. Only known
+        for devices from `AsyncSparkCloud.device`.
+        """
+        return self._extra.get('functions', [])
@@ -4,6 +4,7 @@ apps.py - contains classes for building device apps, which are the
 """
 from django.template.loader import render_to_string
 from django.template import RequestContext
+from django.utils.html import format_html
 
 
 class DeviceAppError(Exception):
@@ -67,6 +68,15 @@ class DeviceAppBase:
         context = RequestContext(request, self.get_context_data())
         return render_to_string(self.template_name, context_instance=context)
 
+    def render_unavailable(self, request):
+        """
+        Render a placeholder for this device, used when `render` doesn't
+        finish in time.
+        """
+        return format_html('<div class="panel panel-default">'
+            '<div class="panel-heading"><h4>{0}</h4></div>'
+            '<div class="panel-body">Status unavailable</div></div>', self.device.name)
+
 
 class DefaultDeviceApp(DeviceAppBase):
     """
@@ -0,0 +1,166 @@
+"""
+breaker.py - circuit breakers for Spark cloud requests.
+"""
+import time
+
+from django.core.cache import cache
+
+from .settings import get_spark_settings
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to something that keeps failing. Its state
+    is kept in the Django cache, so processes only share it when the
+    cache is shared, as with the Redis `CACHES` of the project settings.
+    With a per-process cache each process trips its own breaker.
+
+    The breaker is `closed` while fewer than `failure_rate` of the calls
+    in the current `window` failed, or there were fewer than
+    `min_calls` of them. Past that it is `open` and rejects every call
+    for `reset_timeout` seconds, then `half-open`, letting a single
+    probe call through: if it succeeds the breaker closes, otherwise it
+    opens again.
+
+    Callers ask `admit` for a ticket, make the call if they got one and
+    hand the ticket back to `record` with the outcome.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, failure_statuses, failure_rate=0.5, min_calls=10, window=60,
+            reset_timeout=30):
+        """
+        Constructor. Responses with a status code in `failure_statuses`
+        count as failures.
+        """
+        self.name = name
+        self.failure_statuses = frozenset(failure_statuses)
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+
+    def state(self):
+        """
+        Get the current state, one of `CLOSED`, `OPEN` or `HALF_OPEN`.
+        """
+        opened_at = cache.get(self._key('opened'))
+        if opened_at is None:
+            return self.CLOSED
+        if time.time() < opened_at + self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def stats(self):
+        """
+        Get the state and the number of calls and failures in the
+        current window.
+        """
+        bucket = self._bucket()
+        counts = cache.get_many([self._key('calls', bucket), self._key('failures', bucket)])
+        return {
+            'state': self.state(),
+            'calls': counts.get(self._key('calls', bucket), 0),
+            'failures': counts.get(self._key('failures', bucket), 0)
+        }
+
+    def admit(self):
+        """
+        Get a ticket for a call, or None if the call must not be made.
+        """
+        state = self.state()
+        if state == self.CLOSED:
+            return 'call'
+        if state == self.HALF_OPEN and cache.add(self._key('probe'), 1, self.reset_timeout):
+            return 'probe'
+        return None
+
+    def cancel(self, ticket):
+        """
+        Give back a ticket for a call that wasn't made.
+        """
+        if ticket == 'probe':
+            cache.delete(self._key('probe'))
+
+    def record(self, ticket, status_code):
+        """
+        Record the outcome of a call made with `ticket`, `status_code`
+        is None if no response was received at all.
+        """
+        failed = status_code is None or status_code in self.failure_statuses
+        if ticket == 'probe':
+            if failed:
+                cache.set(self._key('opened'), time.time(), None)
+            else:
+                cache.delete(self._key('opened'))
+            cache.delete(self._key('probe'))
+            return
+        calls = self._count('calls')
+        if failed:
+            failures = self._count('failures')
+            if calls >= self.min_calls and failures >= calls * self.failure_rate:
+                cache.add(self._key('opened'), time.time(), None)
+
+    def reset(self):
+        """
+        Close the breaker and forget the calls of the current window.
+        """
+        bucket = self._bucket()
+        cache.delete_many([self._key('opened'), self._key('probe'),
+            self._key('calls', bucket), self._key('failures', bucket)])
+
+    def _count(self, name):
+        """
+        Increment a counter for the current window and return it.
+        """
+        key = self._key(name, self._bucket())
+        if cache.add(key, 1, self.window * 2):
+            return 1
+        try:
+            return cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, self.window * 2)
+            return 1
+
+    def _bucket(self):
+        """
+        Get the number of the current window.
+        """
+        return int(time.time() // self.window)
+
+    def _key(self, *parts):
+        """
+        Get a cache key for this breaker.
+        """
+        return '.'.join(['spark.breaker', self.name] + [str(p) for p in parts])
+
+
+# responses that mean the cloud itself is in trouble.
+CLOUD_FAILURES = (500, 502, 503)
+# responses that mean the cloud couldn't reach the device.
+DEVICE_FAILURES = (408, 504)
+
+
+def _breaker(name, failure_statuses):
+    """
+    Get a breaker configured from the `SPARK` settings.
+    """
+    s = get_spark_settings()
+    return CircuitBreaker(name, failure_statuses, s.BREAKER_FAILURE_RATE,
+        s.BREAKER_MIN_CALLS, s.BREAKER_WINDOW, s.BREAKER_RESET_TIMEOUT)
+
+
+def cloud_breaker(api_uri):
+    """
+    Get the breaker for the Spark cloud at `api_uri`.
+    """
+    return _breaker('cloud.{0}'.format(api_uri), CLOUD_FAILURES)
+
+
+def device_breaker(device_id):
+    """
+    Get the breaker for the device with the cloud id `device_id`.
+    """
+    return _breaker('device.{0}'.format(device_id), DEVICE_FAILURES)
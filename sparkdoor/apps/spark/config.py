@@ -0,0 +1,22 @@
+"""
+config.py - Django app configuration for the `spark` app.
+"""
+from django.apps import AppConfig
+
+
+class SparkConfig(AppConfig):
+    """
+    App configuration for `sparkdoor.apps.spark`.
+    """
+    name = 'sparkdoor.apps.spark'
+    label = 'spark'
+    verbose_name = 'Spark'
+
+    def ready(self):
+        """
+        Load and validate the `SPARK` settings once and connect signal
+        receivers.
+        """
+        from .settings import get_spark_settings
+        get_spark_settings()
+        from . import signals
@@ -38,7 +38,11 @@ class RegisterDeviceForm(forms.ModelForm):
         device_id = data.get('device_id', None)
 
         if device_id and not Device.objects.filter(device_id=device_id).exists():
-            device = CloudCredentials.objects.cloud_service().device(device_id)
+            try:
+                device = CloudCredentials.objects.cloud_service().device(device_id)
+            except ServiceError:
+                self.add_error('device_id', 'The Spark cloud could not be reached.')
+                return data
             if device is None:
                 self.add_error('device_id', 'This device id is invalid.')
             else:
@@ -0,0 +1,320 @@
+"""
+locks.py - distributed locks for running a task on one worker at a
+    time.
+"""
+import functools
+import logging
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+import redis
+
+from .settings import get_spark_settings
+
+
+logger = logging.getLogger(__name__)
+
+LOCK_EXPIRE = 60 * 3 # 3 minutes
+
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def lock_stats():
+    """
+    Get this process's lock counters: `acquired`, `contended` (gave up
+    waiting), `lost` (the lease ran out before it was released) and
+    `wait_seconds` (total time spent waiting).
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _count(**counts):
+    """
+    Add to the lock counters.
+    """
+    with _stats_lock:
+        _stats.update(counts)
+
+
+class LockBase:
+    """
+    A lock with an expiring lease, identified by `name` and owned by
+    whoever holds its random token. Only the owner can release or renew
+    the lease, so a worker whose lease ran out can't release a lock
+    another worker has since taken.
+
+    Used as a context manager the lock is acquired without waiting,
+    the lease is renewed every third of `timeout` while the block runs
+    and the lock is always released at the end:
+
+        with get_lock('some.job') as locked:
+            if locked:
+                ...
+    """
+    def __init__(self, name, timeout=LOCK_EXPIRE):
+        """
+        Constructor.
+        """
+        self.name = name
+        self.timeout = timeout
+        self.token = None
+        self._renewer = None
+        self._stop_renewing = threading.Event()
+
+    def acquire(self, wait=0):
+        """
+        Try to take the lock for up to `wait` seconds, returns True if
+        it was taken.
+        """
+        token = uuid.uuid4().hex
+        started = time.time()
+        deadline = started + wait
+        acquired = self._acquire(token)
+        while not acquired and time.time() < deadline:
+            time.sleep(min(0.1, max(deadline - time.time(), 0)))
+            acquired = self._acquire(token)
+        waited = time.time() - started
+        if acquired:
+            self.token = token
+            _count(acquired=1, wait_seconds=waited)
+        else:
+            _count(contended=1, wait_seconds=waited)
+            logger.debug('Lock %s is held elsewhere', self.name)
+        return acquired
+
+    def release(self):
+        """
+        Release the lock if it is still ours.
+        """
+        self._stop()
+        if self.token is not None:
+            if not self._release(self.token):
+                _count(lost=1)
+                logger.warning('Lock %s expired before it was released', self.name)
+            self.token = None
+
+    def renew(self):
+        """
+        Extend the lease to `timeout` seconds from now, returns False if
+        the lock is no longer ours.
+        """
+        if self.token is None or not self._renew(self.token):
+            _count(lost=1)
+            logger.warning('Lock %s was lost', self.name)
+            return False
+        return True
+
+    def __enter__(self):
+        """
+        Take the lock without waiting and keep its lease renewed.
+        """
+        locked = self.acquire()
+        if locked:
+            self._stop_renewing.clear()
+            self._renewer = threading.Thread(target=self._keep_renewed,
+                name='lock-{0}'.format(self.name))
+            self._renewer.daemon = True
+            self._renewer.start()
+        return locked
+
+    def __exit__(self, *exc_info):
+        """
+        Release the lock.
+        """
+        self.release()
+
+    def _keep_renewed(self):
+        """
+        Background thread, renews the lease until it is stopped or lost.
+        """
+        while not self._stop_renewing.wait(self.timeout / 3):
+            if not self.renew():
+                return
+
+    def _stop(self):
+        """
+        Stop renewing the lease.
+        """
+        renewer, self._renewer = self._renewer, None
+        if renewer is not None:
+            self._stop_renewing.set()
+            if renewer is not threading.current_thread():
+                renewer.join()
+
+    def _acquire(self, token):
+        """
+        Set the lock to `token` if it is free, returns True if it was.
+        """
+        raise NotImplementedError
+
+    def _release(self, token):
+        """
+        Delete the lock if it holds `token`, returns True if it did.
+        """
+        raise NotImplementedError
+
+    def _renew(self, token):
+        """
+        Reset the lease if the lock holds `token`, returns True if it did.
+        """
+        raise NotImplementedError
+
+
+class RedisLock(LockBase):
+    """
+    A `LockBase` kept in Redis. Taking the lock is a single
+    `SET NX PX`, releasing and renewing compare the owner token in a Lua
+    script so both are atomic.
+    """
+    def __init__(self, client, name, timeout=LOCK_EXPIRE):
+        """
+        Constructor.
+        """
+        super(RedisLock, self).__init__(name, timeout)
+        self.client = client
+        self.key = '{0}-LOCK'.format(name)
+
+    def _acquire(self, token):
+        """
+        Set the lock to `token` if it is free, returns True if it was.
+        """
+        return bool(self.client.set(self.key, token, nx=True, px=int(self.timeout * 1000)))
+
+    def _release(self, token):
+        """
+        Delete the lock if it holds `token`, returns True if it did.
+        """
+        return bool(self.client.eval(RELEASE_SCRIPT, 1, self.key, token))
+
+    def _renew(self, token):
+        """
+        Reset the lease if the lock holds `token`, returns True if it did.
+        """
+        return bool(self.client.eval(RENEW_SCRIPT, 1, self.key, token,
+            int(self.timeout * 1000)))
+
+
+class CacheLock(LockBase):
+    """
+    A `LockBase` kept in the Django cache, for when Redis isn't
+    available. Only as shared as the cache backend is, and releasing and
+    renewing check the owner and then act in two steps.
+    """
+    def __init__(self, name, timeout=LOCK_EXPIRE):
+        """
+        Constructor.
+        """
+        super(CacheLock, self).__init__(name, timeout)
+        self.key = '{0}-LOCK'.format(name)
+
+    def _acquire(self, token):
+        """
+        Set the lock to `token` if it is free, returns True if it was.
+        """
+        return cache.add(self.key, token, self.timeout)
+
+    def _release(self, token):
+        """
+        Delete the lock if it holds `token`, returns True if it did.
+        """
+        if cache.get(self.key) != token:
+            return False
+        cache.delete(self.key)
+        return True
+
+    def _renew(self, token):
+        """
+        Reset the lease if the lock holds `token`, returns True if it did.
+        """
+        if cache.get(self.key) != token:
+            return False
+        cache.set(self.key, token, self.timeout)
+        return True
+
+
+_client = None
+_client_url = None
+_client_lock = threading.Lock()
+
+
+def get_lock_client():
+    """
+    Get a Redis client for the `LOCK_URL` in the `SPARK` settings, or
+    the Celery `BROKER_URL` if that isn't set. Returns None if neither
+    is a Redis URL.
+    """
+    global _client, _client_url
+    url = get_spark_settings().LOCK_URL or getattr(settings, 'BROKER_URL', None) or ''
+    if not url.startswith(('redis://', 'rediss://', 'unix://')):
+        return None
+    with _client_lock:
+        if _client is None or _client_url != url:
+            _client = redis.StrictRedis.from_url(url)
+            _client_url = url
+        return _client
+
+
+def reset_lock_client():
+    """
+    Forget the shared Redis client.
+    """
+    global _client, _client_url
+    with _client_lock:
+        _client, _client_url = None, None
+
+
+def get_lock(name, timeout=LOCK_EXPIRE):
+    """
+    Get a `RedisLock` for `name` if Redis is configured, otherwise a
+    `CacheLock`.
+    """
+    client = get_lock_client()
+    if client is None:
+        return CacheLock(name, timeout)
+    return RedisLock(client, name, timeout)
+
+
+def singleton_task(name=None, timeout=LOCK_EXPIRE):
+    """
+    Decorator that only runs the decorated function while holding the
+    lock `name`, which defaults to the function's dotted path. If
+    another worker holds it the call returns None straight away. Put it
+    below `shared_task`:
+
+        @shared_task
+        @singleton_task()
+        def some_job():
+            ...
+    """
+    def decorator(fn):
+        lock_name = name or '{0}.{1}'.format(fn.__module__, fn.__name__)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with get_lock(lock_name, timeout) as locked:
+                if locked:
+                    return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,93 @@
+"""
+benchmark_device_list.py - management command that times the device
+    list endpoint for an account with many devices.
+"""
+import time
+from optparse import make_option
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from rest_framework import serializers as drf_serializers
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from ...models import Device
+from ...serializers import DeviceSerializer
+from ...views import DeviceAPIView
+
+
+class Rollback(Exception):
+    """
+    Raised to roll back the benchmark data.
+    """
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Creates `--devices` devices for one user inside a transaction, times
+    serializing them field by field and with the list path of
+    `DeviceSerializer`, times `GET /api/devices/` and then rolls
+    everything back.
+    """
+    help = 'Time the device list endpoint for an account with many devices.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--devices', type='int', default=10000),
+        make_option('--app', default='door'),
+        make_option('--repeat', type='int', default=3),
+    )
+
+    def handle(self, *args, **options):
+        """
+        Run the benchmark.
+        """
+        # requests are built for the test server's host name.
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver']), transaction.atomic():
+                self._run(options['devices'], options['app'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _run(self, device_count, app_name, repeat):
+        """
+        Create the data and time the serializers and the view.
+        """
+        user = get_user_model().objects.create(username='benchmark-device-list')
+        Device.objects.bulk_create([Device(device_id='bench{0}'.format(i),
+            name='bench{0}'.format(i), user=user, app_name=app_name)
+            for i in range(device_count)])
+        devices = list(Device.objects.for_user(user).select_related('presence'))
+        request = APIRequestFactory().get('/api/devices/')
+        request.user = user
+        self.stdout.write('{0} devices running {1}, best of {2}'.format(device_count,
+            app_name, repeat))
+
+        def per_field():
+            serializer = DeviceSerializer(devices, many=True, context={'request': request})
+            return len([drf_serializers.ModelSerializer.to_native(serializer, d)
+                for d in devices])
+
+        def list_path():
+            return len(DeviceSerializer(devices, many=True, context={'request': request}).data)
+
+        view = DeviceAPIView.as_view()
+        def endpoint():
+            # the endpoint only returns a page of devices.
+            get = APIRequestFactory().get('/api/devices/')
+            force_authenticate(get, user)
+            return len(view(get).render().data['devices'])
+
+        for name, run in (('per field', per_field), ('list path', list_path),
+                ('GET /api/devices/', endpoint)):
+            best = None
+            for i in range(repeat):
+                started = time.time()
+                count = run()
+                elapsed = time.time() - started
+                best = elapsed if best is None else min(best, elapsed)
+            self.stdout.write('{0:>18}: {1:.1f} ms, {2:.1f} us/device'.format(name,
+                best * 1e3, best / count * 1e6))
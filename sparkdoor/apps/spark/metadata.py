@@ -0,0 +1,155 @@
+"""
+metadata.py - shared cache for Spark cloud device metadata.
+"""
+import random
+import threading
+import time
+
+from django.core.cache import cache
+
+from .settings import get_spark_settings
+
+
+class MetadataCache:
+    """
+    A bounded, approximately LRU cache of device metadata (the
+    `variables` and `functions` reported by the cloud) kept in the
+    Django cache so that entries are shared between requests and
+    processes.
+
+    Entries are stored under a generation number kept in the cache and
+    only the current and the previous generation are read. Once half of
+    `max_entries` have been stored in the current generation the next
+    one is started, so a hit in the previous generation copies the entry
+    forward and entries that weren't used for a whole generation become
+    unreachable and are left to expire. Every operation touches a fixed
+    number of keys and all shared counters are updated with `incr`, so
+    concurrent processes can't lose each other's updates, at the price
+    of evicting in batches rather than strictly by recency.
+    """
+    def __init__(self, prefix='spark.metadata', max_entries=500, timeout=60*60):
+        """
+        Constructor.
+        """
+        self.prefix = prefix
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.generation_size = max(max_entries // 2, 1)
+        self._generation_key = '{0}.generation'.format(prefix)
+
+    def get(self, key):
+        """
+        Get the metadata stored for `key` or None.
+        """
+        generation = self._generation()
+        current = self._key(generation, key)
+        previous = self._key(generation - 1, key)
+        entries = cache.get_many([current, previous])
+        if current in entries:
+            return entries[current][0]
+        if previous in entries:
+            value, expires = entries[previous]
+            self._store(generation, key, value, expires)
+            return value
+        return None
+
+    def set(self, key, value, timeout=None):
+        """
+        Store `value` for `key`, expiring it after `timeout` seconds or
+        the default timeout.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        self._store(self._generation(), key, value, time.time() + timeout)
+
+    def invalidate(self, key):
+        """
+        Remove the entry for `key`.
+        """
+        generation = self._generation()
+        cache.delete_many([self._key(generation, key),
+            self._key(generation - 1, key)])
+
+    def clear(self):
+        """
+        Remove all entries by moving past the generations that are read.
+        """
+        self._next_generation(2)
+
+    def _key(self, generation, key):
+        """
+        Get the Django cache key for an entry in `generation`.
+        """
+        return '{0}.{1}.{2}'.format(self.prefix, generation, key)
+
+    def _generation(self):
+        """
+        Get the current generation, starting from a random number if it
+        isn't in the cache so old generations aren't read again.
+        """
+        generation = cache.get(self._generation_key)
+        if generation is None:
+            cache.add(self._generation_key, random.randint(0, 2 ** 48), None)
+            generation = cache.get(self._generation_key)
+        return generation
+
+    def _store(self, generation, key, value, expires):
+        """
+        Store `value` for `key` in `generation` until the `expires`
+        timestamp and start the next generation once this one is full.
+        """
+        timeout = expires - time.time()
+        if timeout <= 0:
+            return
+        cache.set(self._key(generation, key), (value, expires), timeout)
+        if self._count(generation) == self.generation_size:
+            self._next_generation()
+
+    def _count(self, generation):
+        """
+        Atomically count an entry stored in `generation` and return the
+        number stored so far.
+        """
+        count_key = '{0}.count.{1}'.format(self.prefix, generation)
+        if cache.add(count_key, 1, self.timeout * 2):
+            return 1
+        try:
+            return cache.incr(count_key)
+        except ValueError:
+            return 1
+
+    def _next_generation(self, delta=1):
+        """
+        Atomically move the current generation forward by `delta`.
+        """
+        try:
+            cache.incr(self._generation_key, delta)
+        except ValueError:
+            self._generation()
+
+
+_metadata_cache = None
+_metadata_cache_lock = threading.Lock()
+
+
+def get_metadata_cache():
+    """
+    Get the process-wide `MetadataCache`, creating it from the `SPARK`
+    settings on first use.
+    """
+    global _metadata_cache
+    with _metadata_cache_lock:
+        if _metadata_cache is None:
+            s = get_spark_settings()
+            _metadata_cache = MetadataCache(max_entries=s.METADATA_MAX_ENTRIES,
+                timeout=s.METADATA_TIMEOUT)
+        return _metadata_cache
+
+
+def reset_metadata_cache():
+    """
+    Forget the process-wide `MetadataCache` so the next call to
+    `get_metadata_cache` rebuilds it. Stored entries are kept.
+    """
+    global _metadata_cache
+    with _metadata_cache_lock:
+        _metadata_cache = None
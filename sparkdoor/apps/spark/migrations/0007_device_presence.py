@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spark', '0006_device_app_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DevicePresence',
+            fields=[
+                ('device', models.OneToOneField(related_name='presence', serialize=False, to='spark.Device', primary_key=True)),
+                ('connected', models.BooleanField(default=False)),
+                ('last_heard', models.DateTimeField(null=True)),
+                ('checked_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('interval', models.PositiveIntegerField(default=0)),
+                ('next_check', models.DateTimeField(default=django.utils.timezone.now, db_index=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spark', '0007_device_presence'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='device',
+            index_together=set([('user', 'name', 'id')]),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('spark', '0008_device_list_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceAction',
+            fields=[
+                ('id', models.CharField(serialize=False, max_length=32, primary_key=True)),
+                ('state', models.CharField(default='pending', max_length=10, choices=[('pending', 'Pending'), ('done', 'Done')])),
+                ('status', models.PositiveSmallIntegerField(null=True)),
+                ('data', models.TextField(blank=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, db_index=True)),
+                ('user', models.ForeignKey(to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
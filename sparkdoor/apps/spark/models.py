@@ -1,14 +1,18 @@
 """
 models.py - `spark` app models module.
 """
-from datetime import timedelta
+import threading
+from datetime import timedelta, datetime
 
-from django.db import models
+from django.db import models, connections, transaction
 from django.conf import settings
 from django.utils import timezone
 
-from .services import SparkCloud, CloudDevice, ServiceError
-from .settings import SparkSettings
+from .metadata import get_metadata_cache
+from .services import CLOUD_DATETIME_FORMAT, SparkCloud, CloudDevice, ServiceError
+from .settings import get_spark_settings
+from .tokens import token_cache
+from .versions import device_versions
 
 
 class CloudCredentialsManager(models.Manager):
@@ -20,20 +24,19 @@ class CloudCredentialsManager(models.Manager):
         Get a cloud service instance initialized with the most current
         credentials.
         """
-        latest = self._latest()
-        if latest is None:
+        access_token = self._access_token()
+        if access_token is None:
             return None
-        return SparkCloud(SparkSettings().API_URI, latest.access_token)
+        return SparkCloud(get_spark_settings().API_URI, access_token)
 
     def _access_token(self):
         """
         Get the most recent valid `access_token`, if one isn't found
-        then None is returned.
+        then None is returned. The token is served from
+        `tokens.token_cache` which only queries the database when it
+        changes.
         """
-        latest = self._latest()
-        if latest is None:
-            return None
-        return latest.access_token
+        return token_cache.get(self._latest)
 
     def refresh_token(self):
         """
@@ -43,7 +46,7 @@ class CloudCredentialsManager(models.Manager):
         """
         latest = self._latest()
         if latest is None or latest.expires_soon():
-            cloud = SparkCloud(SparkSettings().API_URI)
+            cloud = SparkCloud(get_spark_settings().API_URI)
             self._discover_tokens(cloud)
             if self._access_token() is None:
                 self._renew_token(cloud)
@@ -52,7 +55,7 @@ class CloudCredentialsManager(models.Manager):
         """
         Get a new token from the cloud service and record it.
         """
-        s = SparkSettings()
+        s = get_spark_settings()
         token, expires_at = cloud.renew_token(s.USERNAME, s.PASSWORD)
         CloudCredentials(access_token=token, expires_at=expires_at).save()
 
@@ -61,7 +64,7 @@ class CloudCredentialsManager(models.Manager):
         Get existing tokens from the cloud service and save the most
         recent.
         """
-        s = SparkSettings()
+        s = get_spark_settings()
         token, expires_at = cloud.discover_tokens(s.USERNAME, s.PASSWORD)
         if (token is not None and expires_at is not None and
                 not self.filter(access_token=token).exists()):
@@ -93,16 +96,87 @@ class CloudCredentials(models.Model):
         Determine if these credentials are still within the exipiration
         date.
         """
-        window = SparkSettings().RENEW_TOKEN_WINDOW
+        window = get_spark_settings().RENEW_TOKEN_WINDOW
         return self.expires_at <= (timezone.now() + timedelta(seconds=window))
 
     objects = CloudCredentialsManager()
 
 
-class DeviceManager(models.Manager):
+class CloudStateBatch:
+    """
+    Shared by the devices of a `DeviceQuerySet.with_cloud_state` query.
+    The first time any of them needs its `CloudDevice`, a single
+    `SparkCloud.all_devices` request loads the cloud state for all of
+    them.
+    """
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self._lock = threading.Lock()
+        self._cloud_devices = None
+
+    def cloud_device(self, device):
+        """
+        Get the `CloudDevice` for `device` or None if the cloud doesn't
+        know about it.
+        """
+        with self._lock:
+            if self._cloud_devices is None:
+                self._cloud_devices = self._load()
+        cloud_device = self._cloud_devices.get(device.device_id)
+        if cloud_device is not None and cloud_device.metadata_key is None:
+            cloud_device.metadata_key = device.metadata_key
+        return cloud_device
+
+    def _load(self):
+        """
+        Get all the devices on the cloud account mapped by id.
+        """
+        cloud = CloudCredentials.objects.cloud_service()
+        if cloud is None:
+            return {}
+        return {d.id: d for d in cloud.all_devices()}
+
+
+class DeviceQuerySet(models.QuerySet):
     """
     Custom query set for `Device` model.
     """
+    _with_cloud_state = False
+
+    def with_cloud_state(self):
+        """
+        Make the devices in this query set share a `CloudStateBatch`,
+        so they cost one cloud request altogether instead of one each.
+        Nothing is requested until a device actually needs the cloud.
+        """
+        return self._clone(_with_cloud_state=True)
+
+    def _clone(self, klass=None, setup=False, **kwargs):
+        """
+        Keep the `with_cloud_state` flag on cloned query sets.
+        """
+        kwargs.setdefault('_with_cloud_state', self._with_cloud_state)
+        return super(DeviceQuerySet, self)._clone(klass, setup, **kwargs)
+
+    def _fetch_all(self):
+        """
+        Attach a `CloudStateBatch` to the fetched devices if requested.
+        """
+        attach = self._with_cloud_state and self._result_cache is None
+        super(DeviceQuerySet, self)._fetch_all()
+        if attach:
+            batch = CloudStateBatch()
+            for device in self._result_cache:
+                if isinstance(device, Device):
+                    device._cloud_batch = batch
+
+
+class DeviceManager(models.Manager.from_queryset(DeviceQuerySet)):
+    """
+    Custom model manager for `Device` model.
+    """
     def for_user(self, user):
         """
         Get a list of devices for a user.
@@ -135,13 +209,16 @@ class Device(models.Model):
 
     class Meta:
         unique_together = ('name', 'user')
+        # pages through a user's devices in name order.
+        index_together = ('user', 'name', 'id')
 
-    def call(self, func_name, func_args):
+    def call(self, func_name, func_args, timeout=None):
         """
         Call a function on this device and return the result which will
-        always be an integer for a successfull call.
+        always be an integer for a successfull call. Functions that block
+        on the device should be given a fixed `timeout` in seconds.
         """
-        return self._cloud_device.call(func_name, func_args)
+        return self._cloud_device.call(func_name, func_args, timeout)
     call.do_not_call_in_templates = True
 
     def read(self, var_name):
@@ -150,13 +227,26 @@ class Device(models.Model):
         """
         return self._cloud_device.read(var_name)
 
+    def read_many(self, var_names):
+        """
+        Read several variables at once, returns a tuple of a dictionary
+        of the values read and a dictionary of the errors for the rest.
+        """
+        return self._cloud_device.read_many(var_names)
+
     def get_app(self):
         """
         Use the `APPS` entry in the `SPARK` settings to get a
         `spark.views.DeviceAppBase` subclass for this device.
         """
-        app_class = SparkSettings().APPS.get(self.app_name, SparkSettings().DEFAULT_APP)
-        return app_class(self)
+        return self.get_app_class()(self)
+
+    def get_app_class(self):
+        """
+        Get the app class for this device's `app_name`.
+        """
+        s = get_spark_settings()
+        return s.APPS.get(self.app_name, s.DEFAULT_APP)
 
     @property
     def variables(self):
@@ -173,14 +263,221 @@ class Device(models.Model):
         """
         return self._cloud_device.functions
 
+    @property
+    def metadata_key(self):
+        """
+        The key that this device's `variables` and `functions` are
+        shared under. Devices running the same known firmware share an
+        entry, devices with unrecognized firmware get their own.
+        """
+        if self.app_name and self.app_name != 'default':
+            return 'app.{0}'.format(self.app_name)
+        return 'device.{0}'.format(self.device_id)
+
+    def invalidate_metadata(self):
+        """
+        Drop the shared `variables` and `functions` for this device, for
+        instance after it has been flashed with new firmware.
+        """
+        get_metadata_cache().invalidate(self.metadata_key)
+        if hasattr(self, '_cached_cloud_device'):
+            del self._cached_cloud_device
+
     @property
     def _cloud_device(self):
         """
         Get a `CloudDevice` instance from the Spark cloud and cache it.
         """
         if not hasattr(self, '_cached_cloud_device'):
-            cloud = CloudCredentials.objects.cloud_service()
-            self._cached_cloud_device = cloud.device(self.device_id)
+            batch = getattr(self, '_cloud_batch', None)
+            if batch is not None:
+                self._cached_cloud_device = batch.cloud_device(self)
+            else:
+                cloud = CloudCredentials.objects.cloud_service()
+                self._cached_cloud_device = cloud.device(self.device_id, self.metadata_key)
         if self._cached_cloud_device is None:
             raise ServiceError(502)
         return self._cached_cloud_device
+
+
+def parse_last_heard(value):
+    """
+    Parse a `last_heard` time from the cloud, returns None if there
+    isn't a valid one.
+    """
+    try:
+        return datetime.strptime(value, CLOUD_DATETIME_FORMAT).replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+class DevicePresenceManager(models.Manager):
+    """
+    Custom model manager for `DevicePresence`.
+    """
+    def poll(self, load, now=None):
+        """
+        Record the presence of the registered devices from the cloud
+        devices returned by `load`, which is only called if a device
+        is due to be checked. Returns the number of devices saved.
+
+        A device is saved when it is due or its presence changed, and
+        its owner's `device_versions` is bumped when it changed. An
+        online device is heard from all the time, so `last_heard` only
+        counts as a change, and is only recorded, when it moved by
+        `PRESENCE_ACTIVE_WINDOW` or more. Devices that changed or were
+        heard from within that window are checked again after
+        `PRESENCE_MIN_INTERVAL`, idle devices wait twice as long as
+        last time, up to `PRESENCE_MAX_INTERVAL`. The intervals only
+        throttle how often a device is saved, the cloud is asked for
+        every device whenever one is due.
+        """
+        now = now or timezone.now()
+        if (not self.filter(next_check__lte=now).exists() and
+                not Device.objects.filter(presence__isnull=True).exists()):
+            return 0
+        cloud_devices = {d.id: d for d in load()}
+        if not cloud_devices:
+            # registered devices are always on the cloud account, so
+            # nothing at all means the cloud didn't answer.
+            return 0
+
+        s = get_spark_settings()
+        window = timedelta(seconds=s.PRESENCE_ACTIVE_WINDOW)
+        presences = {p.device_id: p for p in self.all()}
+        created, updated, changed = [], [], []
+        for pk, device_id in Device.objects.values_list('pk', 'device_id'):
+            cloud_device = cloud_devices.get(device_id)
+            connected = bool(cloud_device is not None and cloud_device.connected)
+            last_heard = parse_last_heard(getattr(cloud_device, 'last_heard', None))
+            presence = presences.get(pk)
+            if presence is None:
+                presence = DevicePresence(device_id=pk, interval=s.PRESENCE_MIN_INTERVAL)
+                created.append(presence)
+                changed.append(pk)
+            else:
+                if last_heard is None or presence.last_heard is None:
+                    heard_changed = last_heard != presence.last_heard
+                else:
+                    heard_changed = abs(last_heard - presence.last_heard) >= window
+                is_changed = presence.connected != connected or heard_changed
+                if not is_changed and presence.next_check > now:
+                    continue
+                if is_changed:
+                    changed.append(pk)
+                active = is_changed or (last_heard is not None and now - last_heard < window)
+                presence.interval = s.PRESENCE_MIN_INTERVAL if active else min(
+                    max(presence.interval, 1) * 2, s.PRESENCE_MAX_INTERVAL)
+                if not heard_changed:
+                    last_heard = presence.last_heard
+                updated.append(presence)
+            presence.connected = connected
+            presence.last_heard = last_heard
+            presence.checked_at = now
+            presence.next_check = now + timedelta(seconds=presence.interval)
+
+        with transaction.atomic(using=self.db):
+            self.bulk_create(created)
+            self.bulk_update(updated, ['connected', 'last_heard', 'checked_at', 'interval',
+                'next_check'])
+        # presence is part of the device responses but bulk writes don't
+        # send signals, so bump the owners' versions here.
+        for user_id in set(Device.objects.filter(pk__in=changed).values_list('user_id',
+                flat=True)):
+            device_versions.bump(user_id)
+        return len(created) + len(updated)
+
+    def bulk_update(self, presences, fields, batch_size=500):
+        """
+        Save `fields` of many presences with a single UPDATE for every
+        `batch_size` of them.
+        """
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        meta = self.model._meta
+        pk_column = qn(meta.pk.column)
+        for i in range(0, len(presences), batch_size):
+            batch = presences[i:i + batch_size]
+            assignments, params = [], []
+            for name in fields:
+                field = meta.get_field(name)
+                value = '%s'
+                if connection.vendor == 'postgresql':
+                    # a column of NULLs would otherwise be typed as text.
+                    value = 'CAST(%s AS {0})'.format(field.db_type(connection))
+                cases = []
+                for presence in batch:
+                    cases.append('WHEN %s THEN {0}'.format(value))
+                    params.extend([presence.pk,
+                        field.get_db_prep_save(getattr(presence, field.attname), connection)])
+                assignments.append('{0} = CASE {1} {2} END'.format(qn(field.column),
+                    pk_column, ' '.join(cases)))
+            params.extend(presence.pk for presence in batch)
+            sql = 'UPDATE {0} SET {1} WHERE {2} IN ({3})'.format(qn(meta.db_table),
+                ', '.join(assignments), pk_column, ', '.join(['%s'] * len(batch)))
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+
+
+class DevicePresence(models.Model):
+    """
+    Whether a device is connected to the Spark cloud, as last seen by
+    the `tasks.poll_device_presence` task, so that showing it never
+    waits on the cloud.
+    """
+    device = models.OneToOneField(Device, primary_key=True, related_name='presence')
+    connected = models.BooleanField(default=False)
+    last_heard = models.DateTimeField(null=True)
+    checked_at = models.DateTimeField(default=timezone.now)
+    interval = models.PositiveIntegerField(default=0) # seconds
+    next_check = models.DateTimeField(default=timezone.now, db_index=True)
+
+    objects = DevicePresenceManager()
+
+
+class DeviceActionManager(models.Manager):
+    """
+    Custom model manager for `DeviceAction`.
+    """
+    def live(self):
+        """
+        Get the actions recorded within the `ACTION_RESULT_TIMEOUT`
+        setting.
+        """
+        return self.filter(created__gte=self._expired_before())
+
+    def expired(self):
+        """
+        Get the actions recorded longer than `ACTION_RESULT_TIMEOUT`
+        ago.
+        """
+        return self.filter(created__lt=self._expired_before())
+
+    def _expired_before(self):
+        """
+        Get the time before which actions are expired.
+        """
+        return timezone.now() - timedelta(seconds=get_spark_settings().ACTION_RESULT_TIMEOUT)
+
+
+class DeviceAction(models.Model):
+    """
+    The status of a device action that runs on a Celery worker instead
+    of in the request, see the `actions` module. It is kept in the
+    database so the web processes see what the workers record.
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+    STATE_CHOICES = (
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+    )
+
+    id = models.CharField(max_length=32, primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=False)
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default=PENDING)
+    status = models.PositiveSmallIntegerField(null=True)
+    data = models.TextField(blank=True) # JSON
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+
+    objects = DeviceActionManager()
@@ -0,0 +1,98 @@
+"""
+retries.py - a shared budget for retrying Spark cloud requests.
+"""
+import random
+import time
+
+from django.core.cache import cache
+
+from .settings import get_spark_settings
+
+
+class RetryBudget:
+    """
+    Limits retries to a fraction of the requests made, so that when the
+    cloud is struggling retries can't multiply the load on it. The
+    counts are kept in the Django cache, so every process draws on the
+    same budget when the cache is shared, as with the Redis `CACHES` of
+    the project settings, and each has its own budget otherwise.
+
+    Within each `window` at most `ratio` retries are allowed for every
+    request, plus `min_retries` so that a quiet site can still retry.
+    """
+    def __init__(self, ratio=0.1, min_retries=10, window=10):
+        """
+        Constructor.
+        """
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+
+    def deposit(self):
+        """
+        Count a request, which earns `ratio` retries.
+        """
+        self._count('requests')
+
+    def withdraw(self):
+        """
+        Take a retry from the budget, returns False if it is spent.
+        """
+        bucket = self._bucket()
+        requests = cache.get(self._key('requests', bucket), 0)
+        retries = self._count('retries')
+        return retries <= requests * self.ratio + self.min_retries
+
+    def stats(self):
+        """
+        Get the number of requests and retries in the current window.
+        """
+        bucket = self._bucket()
+        counts = cache.get_many([self._key('requests', bucket), self._key('retries', bucket)])
+        return {
+            'requests': counts.get(self._key('requests', bucket), 0),
+            'retries': counts.get(self._key('retries', bucket), 0)
+        }
+
+    def _count(self, name):
+        """
+        Increment a counter for the current window and return it.
+        """
+        key = self._key(name, self._bucket())
+        if cache.add(key, 1, self.window * 2):
+            return 1
+        try:
+            return cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, self.window * 2)
+            return 1
+
+    def _bucket(self):
+        """
+        Get the number of the current window.
+        """
+        return int(time.time() // self.window)
+
+    def _key(self, *parts):
+        """
+        Get a cache key for the budget.
+        """
+        return '.'.join(['spark.retries'] + [str(p) for p in parts])
+
+
+def retry_budget():
+    """
+    Get the retry budget configured from the `SPARK` settings.
+    """
+    s = get_spark_settings()
+    return RetryBudget(s.RETRY_BUDGET, s.RETRY_BUDGET_MIN)
+
+
+def backoff(attempt):
+    """
+    Get how long to wait before retry number `attempt`, starting from 1.
+    The delay is drawn at random up to `RETRY_BACKOFF` doubled for each
+    earlier retry, so that clients which failed together don't retry
+    together.
+    """
+    return random.uniform(0, get_spark_settings().RETRY_BACKOFF * 2 ** (attempt - 1))
@@ -1,10 +1,19 @@
 """
 serializers.py - `spark` app serializers module.
 """
+from collections import OrderedDict
+
 from rest_framework import serializers
 from rest_framework.reverse import reverse
 
-from .models import Device
+from .apps import DeviceAppBase
+from .models import Device, DevicePresence
+
+
+# stand-ins for a device's primary key and an action name when reversing
+# the urls that `DeviceSerializer` fills in for a list of devices.
+PK_PLACEHOLDER = '918273645'
+ACTION_PLACEHOLDER = 'action-placeholder'
 
 
 class DeviceSerializer(serializers.ModelSerializer):
@@ -15,9 +24,57 @@ class DeviceSerializer(serializers.ModelSerializer):
 
     actions = serializers.SerializerMethodField('get_actions')
 
+    connected = serializers.SerializerMethodField('get_connected')
+
+    last_heard = serializers.SerializerMethodField('get_last_heard')
+
     class Meta:
         model = Device
-        fields = ('id', 'name', 'app_name', 'href', 'actions')
+        fields = ('id', 'name', 'app_name', 'href', 'actions', 'connected', 'last_heard')
+
+    def __init__(self, *args, **kwargs):
+        """
+        Constructor. Pass `fields` to serialize only the fields named in
+        it, the others aren't computed at all.
+        """
+        fields = kwargs.pop('fields', None)
+        super(DeviceSerializer, self).__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                del self.fields[name]
+
+    def to_native(self, obj):
+        """
+        Serialize a device. A list of devices skips the generic field
+        machinery and builds each device's data directly, filling its
+        urls into templates that are reversed once for the whole list
+        and looking the action names up once per app.
+        """
+        if not self.many or obj.id is None:
+            return super(DeviceSerializer, self).to_native(obj)
+        fields = self.fields
+        pk = str(obj.id)
+        data = OrderedDict()
+        if 'id' in fields:
+            data['id'] = obj.id
+        if 'name' in fields:
+            data['name'] = obj.name
+        if 'app_name' in fields:
+            data['app_name'] = obj.app_name
+        if 'href' in fields:
+            detail = self._url_templates()[0]
+            data['href'] = detail[0] + pk + detail[1]
+        if 'actions' in fields:
+            action = self._url_templates()[1]
+            data['actions'] = [{'href': action[0] + pk + action[1] + a + action[2], 'name': a}
+                for a in self._action_names(obj)]
+        if 'connected' in fields or 'last_heard' in fields:
+            presence = self._presence(obj)
+            if 'connected' in fields:
+                data['connected'] = presence.connected if presence is not None else None
+            if 'last_heard' in fields:
+                data['last_heard'] = presence.last_heard if presence is not None else None
+        return data
 
     def get_self_uri(self, obj):
         """
@@ -35,3 +92,59 @@ class DeviceSerializer(serializers.ModelSerializer):
         href = lambda a: reverse('devices-action', kwargs={'pk': obj.id, 'action': a},
             request=self.context['request'])
         return [{'href': href(a), 'name': a} for a in obj.get_app().get_action_names()]
+
+    def get_connected(self, obj):
+        """
+        Whether the device was connected when its presence was last
+        checked, None if it hasn't been checked yet.
+        """
+        presence = self._presence(obj)
+        return presence.connected if presence is not None else None
+
+    def get_last_heard(self, obj):
+        """
+        When the cloud last heard from the device.
+        """
+        presence = self._presence(obj)
+        return presence.last_heard if presence is not None else None
+
+    def _presence(self, obj):
+        """
+        Get the recorded `DevicePresence` of a device or None.
+        """
+        try:
+            return obj.presence
+        except DevicePresence.DoesNotExist:
+            return None
+
+    def _url_templates(self):
+        """
+        Get the detail url split around the primary key and the action
+        url split around the primary key and the action name.
+        """
+        templates = getattr(self, '_url_templates_cached', None)
+        if templates is None:
+            request = self.context['request']
+            detail = reverse('devices-detail', kwargs={'pk': PK_PLACEHOLDER}, request=request)
+            action = reverse('devices-action', kwargs={'pk': PK_PLACEHOLDER,
+                'action': ACTION_PLACEHOLDER}, request=request)
+            action_start, action_rest = action.split(PK_PLACEHOLDER, 1)
+            templates = self._url_templates_cached = (detail.split(PK_PLACEHOLDER, 1),
+                [action_start] + action_rest.split(ACTION_PLACEHOLDER, 1))
+        return templates
+
+    def _action_names(self, obj):
+        """
+        Get the action names of a device's app, which are shared by
+        every device of an app unless it overrides `get_action_names`.
+        """
+        cache = getattr(self, '_action_names_cached', None)
+        if cache is None:
+            cache = self._action_names_cached = {}
+        names = cache.get(obj.app_name)
+        if names is None:
+            app_class = obj.get_app_class()
+            if getattr(app_class, 'get_action_names', None) is not DeviceAppBase.get_action_names:
+                return obj.get_app().get_action_names()
+            names = cache[obj.app_name] = list(app_class.action_names)
+        return names
@@ -1,15 +1,31 @@
 """
 services.py - module for interacting with a Spark cloud service.
 """
+import time
+from concurrent.futures import wait
 from datetime import timedelta, datetime
 
 from django.utils import timezone
 
-from hammock import Hammock
+import requests
+
+from sparkdoor.libs.flight import SingleFlight
+from sparkdoor.libs.pools import SharedExecutor
+
+from .breaker import cloud_breaker, device_breaker
+from .metadata import get_metadata_cache
+from .retries import backoff, retry_budget
+from .settings import get_spark_settings
+from .timeouts import (adaptive_timeout, deadline as request_deadline, latency_tracker,
+    remaining_time)
+from .transport import get_transport
 
 
 CLOUD_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
 
+# statuses of failed reads that are worth another try.
+RETRY_STATUSES = (500, 502, 503, 504)
+
 
 class ServiceError(Exception):
     """
@@ -17,7 +33,12 @@ class ServiceError(Exception):
     """
     def __init__(self, status_code=500, *args):
         self.status_code = status_code
-        return super(self.__class__, self).__init__(*args)
+        return super(self.__class__, self).__init__(status_code, *args)
+
+
+call_flight = SingleFlight('spark.call', shared_errors=(ServiceError,))
+
+read_executor = SharedExecutor(lambda: get_spark_settings().READ_WORKERS)
 
 
 class SparkCloud:
@@ -26,14 +47,110 @@ class SparkCloud:
     evaluation. Requests to the Spark cloud are sent on demand and
     cached.
     """
-    def __init__(self, api_uri, access_token=None):
+    def __init__(self, api_uri, access_token=None, transport=None):
         """
         Instances a new web service using the path in `api_uri`. An 
         `access_token` can be specified if one has already been granted.
+        Requests are sent over `transport`, which defaults to the
+        process-wide pooled `transport.Transport`.
         """
-        self._service = Hammock(api_uri)
+        transport = transport or get_transport()
+        self._service = transport.service(api_uri)
+        self.api_uri = api_uri
         self.access_token = access_token
 
+    def _send(self, send, key, device_id=None, retry=False, timeout=None):
+        """
+        Send a request by calling `send` with a timeout, adapted to the
+        latency of earlier requests for `key` unless a fixed `timeout`
+        is given and cut short by the thread's deadline (see the
+        `timeouts` module), through the circuit breakers for this cloud
+        and, if given, the device `device_id` (see the `breaker`
+        module).
+
+        Raises `ServiceError(503)` without sending anything while a
+        breaker is open, `ServiceError(503)` if the cloud can't be
+        reached and `ServiceError(504)` if it doesn't answer in time or
+        the deadline has passed. Only idempotent requests should be sent
+        with `retry`, they are retried up to `READ_RETRIES` times on
+        errors that may pass, while the `retries.RetryBudget` and the
+        deadline allow it.
+        """
+        budget = retry_budget()
+        budget.deposit()
+        retries = get_spark_settings().READ_RETRIES if retry else 0
+        response, status_code = None, 504
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                delay = backoff(attempt)
+                remaining = remaining_time()
+                if remaining is not None and remaining <= delay:
+                    break
+                time.sleep(delay)
+            attempt_timeout = self._timeout(key, timeout)
+            if attempt_timeout <= 0:
+                break
+            response, status_code = self._attempt(send, key, device_id, attempt_timeout)
+            if (status_code not in RETRY_STATUSES or attempt == retries or
+                    not budget.withdraw()):
+                break
+        if response is None:
+            raise ServiceError(status_code)
+        return response
+
+    def _timeout(self, key, timeout=None):
+        """
+        Get the timeout for a request for `key`, `timeout` if it is
+        given, which is never past the thread's deadline.
+        """
+        if timeout is None:
+            timeout = adaptive_timeout(key)
+        remaining = remaining_time()
+        if remaining is not None:
+            timeout = min(timeout, remaining)
+        return timeout
+
+    def _attempt(self, send, key, device_id, timeout):
+        """
+        Make a single attempt at a request for `_send` with `timeout`,
+        returns the response, or None if there wasn't one, and the
+        status code.
+        """
+        breakers = [cloud_breaker(self.api_uri)]
+        if device_id is not None:
+            breakers.append(device_breaker(device_id))
+        tickets = []
+        for breaker in breakers:
+            ticket = breaker.admit()
+            if ticket is None:
+                for b, t in tickets:
+                    b.cancel(t)
+                raise ServiceError(503)
+            tickets.append((breaker, ticket))
+        started = time.time()
+        try:
+            response = send(timeout)
+        except requests.Timeout:
+            # the request took at least `timeout`, so the timeouts for
+            # `key` grow when it keeps timing out.
+            latency_tracker.observe(key, timeout)
+            # the cloud answers slowly when the device does, so only the
+            # device's breaker counts it as a failure.
+            status_code = 504 if device_id is not None else None
+            for b, t in tickets:
+                b.record(t, status_code)
+            return None, 504
+        except requests.RequestException:
+            # the device isn't to blame when the cloud can't be reached.
+            tickets[0][0].record(tickets[0][1], None)
+            for b, t in tickets[1:]:
+                b.cancel(t)
+            return None, 503
+        latency_tracker.observe(key, time.time() - started)
+        for b, t in tickets:
+            b.record(t, response.status_code)
+        return response, response.status_code
+
     def renew_token(self, username, password):
         """
         Will attempt to get a new access_token from the cloud service
@@ -46,7 +163,8 @@ class SparkCloud:
         self.access_token = None
         expires_at = None
         data = {'grant_type': 'password', 'username': username, 'password': password}
-        response = self._service.oauth.token.POST(auth=('spark', 'spark'), data=data)
+        response = self._service.oauth.token.POST(auth=('spark', 'spark'), data=data,
+            timeout=get_spark_settings().TIMEOUT)
         if response.ok:
             d = response.json()
             self.access_token = d['access_token']
@@ -61,7 +179,8 @@ class SparkCloud:
         attribute is set, otherwise (None, None) is returned.
         """
         token, expires_at = None, None
-        response = self._service.v1.access_tokens.GET(auth=(username, password))
+        response = self._service.v1.access_tokens.GET(auth=(username, password),
+            timeout=get_spark_settings().TIMEOUT)
         if response.ok:
             for entry in response.json():
                 entry['expires_at'] = datetime.strptime(entry['expires_at'],
@@ -78,34 +197,67 @@ class SparkCloud:
         """
         if self.access_token is None:
             return []
-        response = self._service.v1.devices.GET(params={'access_token': self.access_token})
+        response = self._send(lambda timeout: self._service.v1.devices.GET(
+            params={'access_token': self.access_token}, timeout=timeout),
+            ('devices', self.api_uri), retry=True)
         if response.ok:
             devices = response.json()
             return [CloudDevice(self, **d) for d in devices]
         return []
 
-    def device(self, device_id):
+    def device(self, device_id, metadata_key=None):
         """
         Get an available Spark core for a given device id.
+
+        If a `metadata_key` is given and metadata for it is in the
+        shared `metadata.MetadataCache`, the device is built from it
+        without asking the cloud. Its `name`, `connected` and
+        `last_heard` are then None as they aren't known, and a device
+        the cloud doesn't know about isn't noticed until a call or read
+        on it fails with a 404.
         """
         if self.access_token is None:
             return []
-        response = self._service.v1.devices.GET(device_id, params={'access_token': self.access_token})
+        if metadata_key is not None:
+            metadata = get_metadata_cache().get(metadata_key)
+            if metadata is not None:
+                cloud_device = CloudDevice(self, id=device_id, connected=None,
+                    metadata_key=metadata_key)
+                cloud_device._extra = dict(metadata, id=device_id)
+                return cloud_device
+        response = self._send(lambda timeout: self._service.v1.devices.GET(device_id,
+            params={'access_token': self.access_token}, timeout=timeout),
+            ('device', self.api_uri), retry=True)
         if response.ok:
             device = response.json()
-            cloud_device = CloudDevice(self, **device)
+            cloud_device = CloudDevice(self, metadata_key=metadata_key, **device)
             cloud_device._extra = device
+            cloud_device._store_metadata()
             return cloud_device
         return None
 
+    def publish(self, name, data=''):
+        """
+        Publish a private event to the event stream of this account's
+        devices. An unsuccessful publish will raise a `ServiceError`.
+        """
+        response = self._send(lambda timeout: self._service.v1.devices.events.POST(
+            data={'access_token': self.access_token, 'name': name, 'data': data,
+            'private': 'true'}, timeout=timeout), ('publish', self.api_uri))
+        if not response.ok:
+            raise ServiceError(response.status_code)
+
 
 class CloudDevice:
     """
     Represents a Spark cloud device.
     """
-    def __init__(self, cloud, id=None, name=None, connected=True, last_heard=None, **kwargs):
+    def __init__(self, cloud, id=None, name=None, connected=True, last_heard=None,
+            metadata_key=None, **kwargs):
         """
-        Constructor.
+        Constructor. Devices given the same `metadata_key` share their
+        `variables` and `functions` through the `metadata.MetadataCache`.
+        A `connected` of None means the state isn't known.
         """
         self.cloud = cloud
         self.name = name
@@ -113,17 +265,27 @@ class CloudDevice:
         self.connected = connected
         self.last_heard = last_heard
         self.last_app = None
+        self.metadata_key = metadata_key
 
     @property
     def _extra(self):
         """
-        Get extra info from the cloud when requested. Result is
-        cached.
+        Get extra info from the shared metadata cache or from the cloud
+        when requested. Result is cached.
         """
         if not hasattr(self, '_extra_cached'):
-            response = self.cloud._service.v1.devices.GET(self.id,
-                params={'access_token':self.cloud.access_token})
-            self._extra_cached = response.json() if response.ok else {}
+            metadata = None
+            if self.metadata_key is not None:
+                metadata = get_metadata_cache().get(self.metadata_key)
+            if metadata is not None:
+                self._extra_cached = dict(metadata, id=self.id)
+            else:
+                response = self.cloud._send(lambda timeout: self.cloud._service.v1.devices.GET(
+                    self.id, params={'access_token':self.cloud.access_token}, timeout=timeout),
+                    ('device', self.cloud.api_uri), retry=True)
+                self._extra_cached = response.json() if response.ok else {}
+                if response.ok:
+                    self._store_metadata()
         return self._extra_cached
 
     @_extra.setter
@@ -133,21 +295,60 @@ class CloudDevice:
         """
         self._extra_cached = value
 
-    def call(self, func_name, func_args):
+    def _store_metadata(self):
+        """
+        Share the `variables` and `functions` of this device with other
+        devices that have the same `metadata_key`.
+        """
+        if self.metadata_key is not None:
+            get_metadata_cache().set(self.metadata_key, {
+                'variables': self._extra_cached.get('variables', {}),
+                'functions': self._extra_cached.get('functions', [])
+            })
+
+    def _invalidate_metadata(self):
+        """
+        Drop the shared metadata, used when the cloud doesn't know about
+        a function or variable, which usually means the device was
+        flashed with new firmware.
+        """
+        if self.metadata_key is not None:
+            get_metadata_cache().invalidate(self.metadata_key)
+
+    def call(self, func_name, func_args, timeout=None):
         """
         Call a function on this device and return the result which will
         always be an integer for a successful call. An unsuccessful call
         will raise a `ServiceError`.
+
+        The timeout adapts to the latency of earlier calls of the same
+        function, functions that block on the device, waiting for a
+        card to be read for instance, should be given a fixed `timeout`
+        in seconds instead.
+
+        Identical calls made at the same time, from any thread or
+        process, share a single cloud request, see `call_flight`.
         """
         func_args = str(func_args)
-        response = self.cloud._service.v1.devices.POST(self.id, func_name,
-            data={'access_token':self.cloud.access_token, 'args':func_args})
+        return call_flight.do((self.id, func_name, func_args),
+            lambda: self._call(func_name, func_args, timeout))
+
+    def _call(self, func_name, func_args, timeout=None):
+        """
+        Send a function call to the cloud.
+        """
+        response = self.cloud._send(lambda t: self.cloud._service.v1.devices.POST(
+            self.id, func_name, data={'access_token':self.cloud.access_token,
+            'args':func_args}, timeout=t), ('call', func_name, self.id), self.id,
+            timeout=timeout)
         if response.ok:
             try:
                 return response.json()['return_value']
             except KeyError:
                 # this typically indicates that the device is not connected.
                 raise ServiceError(504) 
+        if response.status_code == 404:
+            self._invalidate_metadata()
         raise ServiceError(response.status_code)
 
     def read(self, var_name):
@@ -155,16 +356,65 @@ class CloudDevice:
         Read the value of a variable. An unsuccessful read will raise a
         `ServiceError`.
         """
-        response = self.cloud._service.v1.devices.GET(self.id, var_name,
-            params={'access_token':self.cloud.access_token})
+        response = self.cloud._send(lambda timeout: self.cloud._service.v1.devices.GET(
+            self.id, var_name, params={'access_token':self.cloud.access_token},
+            timeout=timeout), ('read', self.id), self.id, retry=True)
         if response.ok:
             try:
                 return response.json()['result']
             except KeyError:
                 # this typically indicates that the device is not connected.
                 raise ServiceError(504) 
+        if response.status_code == 404:
+            self._invalidate_metadata()
         raise ServiceError(response.status_code)
 
+    def read_many(self, var_names, deadline=None):
+        """
+        Read several variables at once on the shared `read_executor`,
+        so they cost about as long as the slowest read instead of all of
+        them together. Returns a tuple of a dictionary of the values
+        that were read and a dictionary of the `ServiceError` for each
+        one that wasn't, a response that isn't valid JSON is a 502.
+
+        The reads give up after `deadline` seconds, the `READ_DEADLINE`
+        setting by default, or at the calling thread's own deadline if
+        that is sooner, and then fail with a 504. The deadline is
+        passed down as the reads' timeout, so a read that is late
+        doesn't keep holding a worker.
+        """
+        var_names = list(dict.fromkeys(var_names))
+        if deadline is None:
+            deadline = get_spark_settings().READ_DEADLINE
+        remaining = remaining_time()
+        if remaining is not None:
+            deadline = min(deadline, remaining)
+        until = time.time() + deadline
+        futures = {read_executor.submit(self._read_until, name, until): name
+            for name in var_names}
+        wait(futures, max(deadline, 0))
+        values, errors = {}, {}
+        for future, name in futures.items():
+            if not future.done():
+                future.cancel()
+                errors[name] = ServiceError(504)
+            elif isinstance(future.exception(), ServiceError):
+                errors[name] = future.exception()
+            elif isinstance(future.exception(), ValueError):
+                errors[name] = ServiceError(502)
+            elif future.exception() is not None:
+                errors[name] = ServiceError(500)
+            else:
+                values[name] = future.result()
+        return values, errors
+
+    def _read_until(self, var_name, until):
+        """
+        Read a variable for `read_many`, giving up at `until`.
+        """
+        with request_deadline(until):
+            return self.read(var_name)
+
     @property
     def variables(self):
         """
@@ -1,6 +1,8 @@
 """
 settings.py - module for loading settings for the `spark` app.
 """
+import threading
+
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 
@@ -12,19 +14,46 @@ from .apps import DefaultDeviceApp
 DEFAULTS = {
     'DEFAULT_APP': DefaultDeviceApp,
     'CLOUD_API_URI': 'https://api.spark.io',
-    'CLOUD_RENEW_TOKEN_WINDOW': 60*60*24 # 24 hours
+    'CLOUD_RENEW_TOKEN_WINDOW': 60*60*24, # 24 hours
+    'CLOUD_POOL_SIZE': 10,
+    'CLOUD_METADATA_TIMEOUT': 60*60, # 1 hour
+    'CLOUD_METADATA_MAX_ENTRIES': 500,
+    'CLOUD_ASYNC_CONCURRENCY': 100,
+    'CLOUD_BREAKER_FAILURE_RATE': 0.5,
+    'CLOUD_BREAKER_MIN_CALLS': 10,
+    'CLOUD_BREAKER_WINDOW': 60, # seconds
+    'CLOUD_BREAKER_RESET_TIMEOUT': 30, # seconds
+    'CLOUD_TIMEOUT': 10, # seconds, until a request's latency is known
+    'CLOUD_TIMEOUT_MIN': 1, # seconds
+    'CLOUD_TIMEOUT_MAX': 30, # seconds
+    'CLOUD_TIMEOUT_FACTOR': 3, # times the 99th percentile latency
+    'CLOUD_READ_RETRIES': 2,
+    'CLOUD_RETRY_BACKOFF': 0.1, # seconds, doubled for each retry
+    'CLOUD_RETRY_BUDGET': 0.1, # retries allowed per request
+    'CLOUD_RETRY_BUDGET_MIN': 10, # retries always allowed every 10 seconds
+    'CLOUD_READ_WORKERS': 20,
+    'CLOUD_READ_DEADLINE': 5, # seconds
+    'CLOUD_STREAM_TIMEOUT': 90, # seconds without an event before reconnecting
+    'EVENT_STREAM_MAX_CONNECTIONS': 8, # per process, keep below the server's threads
+    'PRESENCE_MIN_INTERVAL': 15, # seconds
+    'PRESENCE_MAX_INTERVAL': 60*10, # 10 minutes
+    'PRESENCE_ACTIVE_WINDOW': 60*5, # 5 minutes
+    'DEVICE_PAGE_SIZE': 100,
+    'DEVICE_MAX_PAGE_SIZE': 1000,
+    'RENDER_WORKERS': 0, # render devices one at a time
+    'RENDER_TIMEOUT': 3, # seconds
+    'ACTION_RESULT_TIMEOUT': 60*60, # 1 hour
+    'LOCK_URL': None # use BROKER_URL if it is a redis url
 }
 
 
 def load_apps(apps):
     """
-    Load the `APPS` entries. If an entry is a string, than attempt
-    to dynamically load it.
+    Load the `APPS` entries into a new dictionary. If an entry is a
+    string, than attempt to dynamically load it.
     """
-    for name, app in apps.items():
-        if isinstance(app, str):
-            apps[name] = str_import(app)
-    return apps
+    return {name: str_import(app) if isinstance(app, str) else app
+        for name, app in apps.items()}
 
 
 class SparkSettings:
@@ -32,7 +61,12 @@ class SparkSettings:
     Class for getting settings from Django's setting. If appropriate
     defaults exist, they should be used, otherwise an exception is
     raised.
+
+    Instances are read-only once loaded. Use `get_spark_settings` to
+    share one instance instead of loading the settings again.
     """
+    _frozen = False
+
     def __init__(self):
         """
         Load spark settings from Django's settings.
@@ -45,6 +79,91 @@ class SparkSettings:
         self.RENEW_TOKEN_WINDOW = settings.SPARK.get('CLOUD_RENEW_TOKEN_WINDOW',
             DEFAULTS['CLOUD_RENEW_TOKEN_WINDOW'])
 
+        self.POOL_SIZE = settings.SPARK.get('CLOUD_POOL_SIZE',
+            DEFAULTS['CLOUD_POOL_SIZE'])
+
+        self.METADATA_TIMEOUT = settings.SPARK.get('CLOUD_METADATA_TIMEOUT',
+            DEFAULTS['CLOUD_METADATA_TIMEOUT'])
+
+        self.METADATA_MAX_ENTRIES = settings.SPARK.get('CLOUD_METADATA_MAX_ENTRIES',
+            DEFAULTS['CLOUD_METADATA_MAX_ENTRIES'])
+
+        self.ASYNC_CONCURRENCY = settings.SPARK.get('CLOUD_ASYNC_CONCURRENCY',
+            DEFAULTS['CLOUD_ASYNC_CONCURRENCY'])
+
+        self.BREAKER_FAILURE_RATE = settings.SPARK.get('CLOUD_BREAKER_FAILURE_RATE',
+            DEFAULTS['CLOUD_BREAKER_FAILURE_RATE'])
+
+        self.BREAKER_MIN_CALLS = settings.SPARK.get('CLOUD_BREAKER_MIN_CALLS',
+            DEFAULTS['CLOUD_BREAKER_MIN_CALLS'])
+
+        self.BREAKER_WINDOW = settings.SPARK.get('CLOUD_BREAKER_WINDOW',
+            DEFAULTS['CLOUD_BREAKER_WINDOW'])
+
+        self.BREAKER_RESET_TIMEOUT = settings.SPARK.get('CLOUD_BREAKER_RESET_TIMEOUT',
+            DEFAULTS['CLOUD_BREAKER_RESET_TIMEOUT'])
+
+        self.TIMEOUT = settings.SPARK.get('CLOUD_TIMEOUT', DEFAULTS['CLOUD_TIMEOUT'])
+
+        self.TIMEOUT_MIN = settings.SPARK.get('CLOUD_TIMEOUT_MIN',
+            DEFAULTS['CLOUD_TIMEOUT_MIN'])
+
+        self.TIMEOUT_MAX = settings.SPARK.get('CLOUD_TIMEOUT_MAX',
+            DEFAULTS['CLOUD_TIMEOUT_MAX'])
+
+        self.TIMEOUT_FACTOR = settings.SPARK.get('CLOUD_TIMEOUT_FACTOR',
+            DEFAULTS['CLOUD_TIMEOUT_FACTOR'])
+
+        self.READ_RETRIES = settings.SPARK.get('CLOUD_READ_RETRIES',
+            DEFAULTS['CLOUD_READ_RETRIES'])
+
+        self.RETRY_BACKOFF = settings.SPARK.get('CLOUD_RETRY_BACKOFF',
+            DEFAULTS['CLOUD_RETRY_BACKOFF'])
+
+        self.RETRY_BUDGET = settings.SPARK.get('CLOUD_RETRY_BUDGET',
+            DEFAULTS['CLOUD_RETRY_BUDGET'])
+
+        self.RETRY_BUDGET_MIN = settings.SPARK.get('CLOUD_RETRY_BUDGET_MIN',
+            DEFAULTS['CLOUD_RETRY_BUDGET_MIN'])
+
+        self.READ_WORKERS = settings.SPARK.get('CLOUD_READ_WORKERS',
+            DEFAULTS['CLOUD_READ_WORKERS'])
+
+        self.READ_DEADLINE = settings.SPARK.get('CLOUD_READ_DEADLINE',
+            DEFAULTS['CLOUD_READ_DEADLINE'])
+
+        self.STREAM_TIMEOUT = settings.SPARK.get('CLOUD_STREAM_TIMEOUT',
+            DEFAULTS['CLOUD_STREAM_TIMEOUT'])
+
+        self.EVENT_STREAM_MAX_CONNECTIONS = settings.SPARK.get('EVENT_STREAM_MAX_CONNECTIONS',
+            DEFAULTS['EVENT_STREAM_MAX_CONNECTIONS'])
+
+        self.PRESENCE_MIN_INTERVAL = settings.SPARK.get('PRESENCE_MIN_INTERVAL',
+            DEFAULTS['PRESENCE_MIN_INTERVAL'])
+
+        self.PRESENCE_MAX_INTERVAL = settings.SPARK.get('PRESENCE_MAX_INTERVAL',
+            DEFAULTS['PRESENCE_MAX_INTERVAL'])
+
+        self.PRESENCE_ACTIVE_WINDOW = settings.SPARK.get('PRESENCE_ACTIVE_WINDOW',
+            DEFAULTS['PRESENCE_ACTIVE_WINDOW'])
+
+        self.DEVICE_PAGE_SIZE = settings.SPARK.get('DEVICE_PAGE_SIZE',
+            DEFAULTS['DEVICE_PAGE_SIZE'])
+
+        self.DEVICE_MAX_PAGE_SIZE = settings.SPARK.get('DEVICE_MAX_PAGE_SIZE',
+            DEFAULTS['DEVICE_MAX_PAGE_SIZE'])
+
+        self.RENDER_WORKERS = settings.SPARK.get('RENDER_WORKERS',
+            DEFAULTS['RENDER_WORKERS'])
+
+        self.RENDER_TIMEOUT = settings.SPARK.get('RENDER_TIMEOUT',
+            DEFAULTS['RENDER_TIMEOUT'])
+
+        self.ACTION_RESULT_TIMEOUT = settings.SPARK.get('ACTION_RESULT_TIMEOUT',
+            DEFAULTS['ACTION_RESULT_TIMEOUT'])
+
+        self.LOCK_URL = settings.SPARK.get('LOCK_URL', DEFAULTS['LOCK_URL'])
+
         self.USERNAME = settings.SPARK.get('CLOUD_USERNAME', None)
         if self.USERNAME is None:
             raise ImproperlyConfigured('The Spark app requires a CLOUD_USERNAME to be set in the SPARK settings. This should be your login username for your spark cloud service.')
@@ -59,3 +178,39 @@ class SparkSettings:
         self.APPS = load_apps(raw_apps)
 
         self.DEFAULT_APP = settings.SPARK.get('DEFAULT_APP', DEFAULTS['DEFAULT_APP'])
+
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        """
+        Prevent changes after the settings are loaded.
+        """
+        if self._frozen:
+            raise AttributeError('SparkSettings are read-only.')
+        super(SparkSettings, self).__setattr__(name, value)
+
+
+_spark_settings = None
+_spark_settings_lock = threading.Lock()
+
+
+def get_spark_settings():
+    """
+    Get the shared `SparkSettings`, loading and validating them the
+    first time.
+    """
+    global _spark_settings
+    with _spark_settings_lock:
+        if _spark_settings is None:
+            _spark_settings = SparkSettings()
+        return _spark_settings
+
+
+def reset_spark_settings():
+    """
+    Forget the shared `SparkSettings` so the next call to
+    `get_spark_settings` loads them again.
+    """
+    global _spark_settings
+    with _spark_settings_lock:
+        _spark_settings = None
@@ -0,0 +1,59 @@
+"""
+signals.py - signal receivers for the `spark` app.
+"""
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+
+from .locks import reset_lock_client
+from .metadata import reset_metadata_cache
+from .models import CloudCredentials, Device
+from .services import read_executor
+from .settings import reset_spark_settings
+from .tokens import token_cache
+from .transport import reset_transport
+from .versions import device_versions
+
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+def invalidate_device_metadata(sender, instance, **kwargs):
+    """
+    A device that is registered again, renamed, or removed may be
+    running different firmware, so drop its shared metadata.
+    """
+    instance.invalidate_metadata()
+
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+def bump_device_version(sender, instance, **kwargs):
+    """
+    The user's devices changed, so cached device responses are stale.
+    """
+    device_versions.bump(instance.user_id)
+
+
+@receiver(post_save, sender=CloudCredentials)
+@receiver(post_delete, sender=CloudCredentials)
+def invalidate_access_token(sender, instance, **kwargs):
+    """
+    Credentials were added or removed, so the current token may have
+    changed.
+    """
+    token_cache.invalidate()
+
+
+@receiver(setting_changed)
+def reset_spark_settings_cache(sender, setting, **kwargs):
+    """
+    Load the `SPARK` settings again when they are changed, which only
+    happens in tests, along with everything that was built from them.
+    """
+    if setting == 'SPARK':
+        reset_spark_settings()
+        reset_transport()
+        reset_metadata_cache()
+        token_cache.invalidate()
+        reset_lock_client()
+        read_executor.shutdown(wait=False)
@@ -0,0 +1,356 @@
+"""
+streams.py - a shared connection to the Spark cloud's event stream,
+    fanned out to any number of subscribers.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import requests
+
+from .models import CloudCredentials
+from .services import ServiceError
+from .settings import get_spark_settings
+from .transport import get_transport
+
+
+logger = logging.getLogger(__name__)
+
+# events published by this site are named with this prefix and carry
+# the id of their device as their data, see `publish`.
+SERVER_PREFIX = 'sparkdoor/'
+
+
+def parse_events(lines):
+    """
+    Parse the lines of a server-sent event stream into a dictionary for
+    each device event with its `name`, `device` id, `data` and
+    `published_at` time.
+    """
+    name, data = None, []
+    for line in lines:
+        if line:
+            field, _, value = line.partition(':')
+            if field == 'event':
+                name = value.strip()
+            elif field == 'data':
+                data.append(value.strip())
+            continue
+        if name is not None and data:
+            event = _device_event(name, '\n'.join(data))
+            if event is not None:
+                yield event
+        name, data = None, []
+
+
+def _device_event(name, data):
+    """
+    Build a device event from an event's `name` and JSON `data`, or
+    return None if it isn't one.
+    """
+    try:
+        payload = json.loads(data)
+    except ValueError:
+        return None
+    if name.startswith(SERVER_PREFIX):
+        device = payload.get('data')
+    else:
+        device = payload.get('coreid')
+    if not device:
+        return None
+    return {
+        'name': name,
+        'device': device,
+        'data': payload.get('data'),
+        'published_at': payload.get('published_at')
+    }
+
+
+def cloud_events():
+    """
+    Connect to the Spark cloud's stream of events for the account's
+    devices and yield them as they arrive. Raises `ServiceError` if
+    there is no access token or the stream is refused, and a
+    `requests.RequestException` if the connection fails or is silent
+    for longer than the `STREAM_TIMEOUT` setting.
+    """
+    s = get_spark_settings()
+    access_token = CloudCredentials.objects._access_token()
+    if access_token is None:
+        raise ServiceError(401)
+    url = '{0}/v1/devices/events'.format(s.API_URI.rstrip('/'))
+    response = get_transport().session(s.API_URI).get(url,
+        params={'access_token': access_token}, stream=True,
+        timeout=(s.TIMEOUT, s.STREAM_TIMEOUT))
+    try:
+        if not response.ok:
+            raise ServiceError(response.status_code)
+        response.encoding = 'utf-8'
+        for event in parse_events(response.iter_lines(decode_unicode=True)):
+            yield event
+    finally:
+        response.close()
+
+
+def publish(device_id, name):
+    """
+    Publish the event `SERVER_PREFIX` + `name` for the device with the
+    cloud id `device_id` through the Spark cloud, so that it reaches the
+    `EventHub` of every process. Publishing is best effort, returns
+    False if it failed. It costs a cloud request, so requests should
+    use `tasks.publish_device_event` instead.
+    """
+    cloud = CloudCredentials.objects.cloud_service()
+    if cloud is None:
+        return False
+    try:
+        cloud.publish(SERVER_PREFIX + name, device_id)
+    except ServiceError:
+        logger.warning('Could not publish %s for device %s', name, device_id)
+        return False
+    return True
+
+
+class Subscription:
+    """
+    The events of a set of devices delivered by an `EventHub`. Iterating
+    over it blocks until the next event, yielding None every
+    `heartbeat` seconds without one, and stops once it is closed.
+    """
+    def __init__(self, hub, device_ids, heartbeat=15, max_size=100):
+        """
+        Constructor.
+        """
+        self.hub = hub
+        self.device_ids = frozenset(device_ids)
+        self.heartbeat = heartbeat
+        self.closed = False
+        self._queue = queue.Queue(max_size)
+
+    def put(self, event):
+        """
+        Deliver `event`, returns False if the subscriber has fallen too
+        far behind to take it.
+        """
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            return False
+        return True
+
+    def close(self):
+        """
+        Stop the subscription.
+        """
+        if not self.closed:
+            self.closed = True
+            self.hub.unsubscribe(self)
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                pass
+
+    def __iter__(self):
+        """
+        Yield events, and None as a heartbeat, until closed.
+        """
+        while not self.closed:
+            try:
+                event = self._queue.get(timeout=self.heartbeat)
+            except queue.Empty:
+                yield None
+                continue
+            if event is not None:
+                yield event
+
+
+class EventHub:
+    """
+    Holds a single connection to an upstream event `source` per process
+    and hands each event to the subscriptions for its device, so the
+    number of browsers watching doesn't change the load on the cloud.
+
+    `source` is called to connect and returns an iterable of device
+    events as built by `parse_events`. The connection is made when the
+    first subscription is taken and is made again, after
+    `RECONNECT_DELAY` seconds, whenever it ends or fails. Once nobody is
+    subscribed the connection is dropped, which is noticed at its next
+    event.
+    """
+    RECONNECT_DELAY = 1 # seconds
+    MAX_RECONNECT_DELAY = 30 # seconds
+
+    def __init__(self, source=cloud_events):
+        """
+        Constructor.
+        """
+        self.source = source
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._thread = None
+        self._pid = None
+
+    def subscribe(self, device_ids, heartbeat=15):
+        """
+        Get a `Subscription` to the events of the devices with the cloud
+        ids in `device_ids`. It must be closed when no longer needed.
+        """
+        subscription = Subscription(self, device_ids, heartbeat)
+        with self._lock:
+            for device_id in subscription.device_ids:
+                self._subscribers.setdefault(device_id, set()).add(subscription)
+            self._start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Stop delivering events to `subscription`.
+        """
+        with self._lock:
+            for device_id in subscription.device_ids:
+                subscribers = self._subscribers.get(device_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[device_id]
+
+    def dispatch(self, event):
+        """
+        Hand `event` to the subscriptions for its device. Subscribers
+        that can't keep up are closed, their browsers will reconnect.
+        """
+        with self._lock:
+            subscribers = list(self._subscribers.get(event['device'], ()))
+        for subscription in subscribers:
+            if not subscription.put(event):
+                logger.warning('Closing an event subscription that fell behind')
+                subscription.close()
+
+    def _start(self):
+        """
+        Start the upstream thread if it isn't running in this process,
+        the lock must be held.
+        """
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = None
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='spark-events')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _idle(self):
+        """
+        Stop the upstream thread if nobody is subscribed, returns True
+        if it should stop.
+        """
+        with self._lock:
+            if not self._subscribers:
+                self._thread = None
+                return True
+            return False
+
+    def _run(self):
+        """
+        Upstream thread, relays events until nobody is subscribed.
+        """
+        delay = self.RECONNECT_DELAY
+        while not self._idle():
+            try:
+                for event in self.source():
+                    delay = self.RECONNECT_DELAY
+                    self.dispatch(event)
+                    if self._idle():
+                        return
+            except (ServiceError, requests.RequestException) as err:
+                logger.warning('Event stream failed: %r', err)
+            except Exception:
+                logger.exception('Event stream failed')
+            time.sleep(delay)
+            delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+
+
+event_hub = EventHub()
+
+
+class StreamLimit:
+    """
+    Counts the event streams open in this process. Each stream holds a
+    web server thread for as long as it is open, so they must be limited
+    to fewer than the server has, see `EVENT_STREAM_MAX_CONNECTIONS`.
+    """
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def acquire(self, limit):
+        """
+        Count a new stream, returns False if `limit` are already open.
+        """
+        with self._lock:
+            if self.count >= limit:
+                return False
+            self.count += 1
+            return True
+
+    def release(self):
+        """
+        Count a stream as closed.
+        """
+        with self._lock:
+            self.count -= 1
+
+
+stream_limit = StreamLimit()
+
+
+class OpenStream:
+    """
+    The response content of a browser's event stream, counted by
+    `stream_limit` and fed by `subscription`. Iterating over it yields
+    `chunks`, closing it closes the subscription and gives its place in
+    `stream_limit` back.
+
+    Servers close a response whether or not they iterated over it, a
+    HEAD request or a browser that went away before the first event for
+    instance, and a response that is dropped is closed when it is
+    garbage collected, so a stream can't be left holding its place.
+    """
+    def __init__(self, chunks, subscription):
+        """
+        Constructor, `stream_limit` must have been acquired.
+        """
+        self.chunks = chunks
+        self.subscription = subscription
+        self.closed = False
+
+    def __iter__(self):
+        """
+        Iterate over the chunks.
+        """
+        return iter(self.chunks)
+
+    def close(self):
+        """
+        Stop the stream.
+        """
+        if not self.closed:
+            self.closed = True
+            try:
+                if hasattr(self.chunks, 'close'):
+                    self.chunks.close()
+            finally:
+                self.subscription.close()
+                stream_limit.release()
+
+    def __del__(self):
+        """
+        Close a stream that was dropped without being closed.
+        """
+        self.close()
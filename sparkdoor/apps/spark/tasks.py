@@ -1,46 +1,92 @@
 """
 tasks.py - `spark` app web worker tasks module.
 """
-from django.core.cache import cache
-
 from contextlib import contextmanager
 
 from celery import shared_task
 
-from .models import CloudCredentials
-
-
-LOCK_EXPIRE = 60 * 3 # 3 minutes
+from .actions import finish_action
+from .apps import DeviceAppError
+from .locks import LOCK_EXPIRE, get_lock, singleton_task
+from .models import CloudCredentials, Device, DeviceAction, DevicePresence
+from .services import ServiceError
+from .streams import publish
 
 
 @contextmanager
-def task_lock(key):
+def task_lock(key, timeout=LOCK_EXPIRE):
     """
-    Unique task lock implementation taken from Celery docs here:
-    http://celery.readthedocs.org/en/latest/tutorials/task-cookbook.html
-    Should probably be replaced with something more robust but will work
-    as long as the Django cache backend is setup.
+    Hold the distributed lock `key` for the duration of the block, see
+    `locks.LockBase`. The lock is released even if the block raises.
 
     The context returned is either True or False indicating whether the
     task is unique or not.
     """
-    lock_id = '{0}-LOCK'.format(key)
-    acquire_lock = lambda: cache.add(lock_id, 'true', LOCK_EXPIRE)
-    release_lock = lambda: cache.delete(lock_id)
-    if acquire_lock():
-        yield True
-        release_lock()
-    else:
-        yield False
+    with get_lock(key, timeout) as locked:
+        yield locked
 
 
 @shared_task
+@singleton_task()
 def refresh_access_token():
     """
     Run this task periodically to check for soon to expire access tokens
     and request a new one when needed.
     """
-    key = '{0}.refresh_access_token'.format(__name__)
-    with task_lock(key) as locked:
-        if locked:
-            CloudCredentials.objects.refresh_token()
+    CloudCredentials.objects.refresh_token()
+
+
+@shared_task
+@singleton_task()
+def poll_device_presence():
+    """
+    Run this task every `PRESENCE_MIN_INTERVAL` seconds to keep the
+    `DevicePresence` of every device up to date, at the cost of at most
+    one cloud request per run.
+    """
+    cloud = CloudCredentials.objects.cloud_service()
+    if cloud is not None:
+        try:
+            DevicePresence.objects.poll(cloud.all_devices)
+        except ServiceError:
+            pass
+
+
+@shared_task
+def run_device_action(action_id, device_pk, name, data):
+    """
+    Run the device app action `name` for a request that asked for an
+    asynchronous response and record the outcome under `action_id`,
+    see the `actions` module.
+    """
+    try:
+        status, result = 200, Device.objects.get(pk=device_pk).get_app().action(name, data)
+    except Device.DoesNotExist:
+        status, result = 404, {'detail': 'Not found'}
+    except DeviceAppError as err:
+        status, result = err.status_code, {'detail': err.msg}
+    except Exception:
+        finish_action(action_id, 500, {'detail': 'Action failed'})
+        raise
+    finish_action(action_id, status, result)
+
+
+@shared_task(rate_limit='1/s')
+def publish_device_event(device_id, name):
+    """
+    Publish the event `name` for the device with the cloud id
+    `device_id`, see `streams.publish`, so requests don't wait on the
+    cloud for it. The cloud only allows about one event a second, each
+    worker publishes at most that often.
+    """
+    publish(device_id, name)
+
+
+@shared_task
+@singleton_task()
+def sweep_device_actions():
+    """
+    Run this task periodically to delete the status records of device
+    actions older than the `ACTION_RESULT_TIMEOUT` setting.
+    """
+    DeviceAction.objects.expired().delete()
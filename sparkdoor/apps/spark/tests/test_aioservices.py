@@ -0,0 +1,201 @@
+"""
+test_aioservices.py - unit tests for the `spark` app's aioservices
+    module.
+"""
+import os
+import json
+import asyncio
+from unittest import mock
+from urllib.parse import urlsplit
+
+from django.test import SimpleTestCase, override_settings
+
+from .mocks import RESPONSE_DIR, ACCESS_TOKEN
+from ..aioservices import AsyncSparkCloud, AsyncCloudDevice
+from ..breaker import CircuitBreaker, device_breaker
+from ..services import ServiceError
+from ..timeouts import latency_tracker
+
+
+API_URI = 'https://api.test.com'
+
+spark_test_settings = {
+    'CLOUD_USERNAME': 'a_user',
+    'CLOUD_PASSWORD': 'password',
+    'CLOUD_API_URI': API_URI,
+    'CLOUD_TIMEOUT': 0.1,
+    'CLOUD_READ_RETRIES': 0,
+    'APPS': {}
+}
+
+
+class FakeResponse:
+    """
+    Stand-in for an `aiohttp` response.
+    """
+    def __init__(self, status, content):
+        self.status = status
+        self.content = content
+
+    @asyncio.coroutine
+    def json(self):
+        return self.content
+
+    @asyncio.coroutine
+    def release(self):
+        pass
+
+
+class FakeSession:
+    """
+    Stand-in for an `aiohttp.ClientSession` that serves the same JSON
+    files as `mocks.spark_cloud_mock` and records how many requests are
+    in flight at once.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+        self.delay = 0
+
+    @asyncio.coroutine
+    def request(self, method, url, params=None, data=None, auth=None):
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            yield from asyncio.sleep(self.delay, loop=self.loop)
+        finally:
+            self.in_flight -= 1
+        if (params or data or {}).get('access_token') != ACCESS_TOKEN:
+            return FakeResponse(400, {})
+        path = urlsplit(url).path.strip('/')
+        try:
+            with open(os.path.join(RESPONSE_DIR, '{0}.json'.format(path)), 'rb') as f:
+                return FakeResponse(200, json.loads(f.read().decode('utf-8')))
+        except IOError:
+            return FakeResponse(404, {})
+
+
+class FakeTransport:
+    """
+    Stand-in for `aioservices.AsyncTransport`.
+    """
+    def __init__(self, loop, concurrency):
+        self.loop = loop
+        self.semaphore = asyncio.Semaphore(concurrency, loop=loop)
+        self.session = FakeSession(loop)
+
+
+@override_settings(SPARK=spark_test_settings)
+class AsyncSparkCloudTestCase(SimpleTestCase):
+    """
+    Test case for `aioservices.AsyncSparkCloud` and
+    `aioservices.AsyncCloudDevice`.
+    """
+    def setUp(self):
+        """
+        Make a cloud on a fresh event loop.
+        """
+        self.loop = asyncio.new_event_loop()
+        self.transport = FakeTransport(self.loop, 2)
+        self.cloud = AsyncSparkCloud(API_URI, ACCESS_TOKEN, self.transport)
+        latency_tracker.clear()
+        device_breaker('12345abcde12345abcde').reset()
+
+    def tearDown(self):
+        """
+        Close the event loop.
+        """
+        self.loop.close()
+
+    def run_coroutine(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_all_devices(self):
+        """
+        Test that `all_devices` returns a list of `AsyncCloudDevice`
+        instances.
+        """
+        devices = self.run_coroutine(self.cloud.all_devices())
+        self.assertTrue(len(devices) > 0)
+        for d in devices:
+            self.assertIsInstance(d, AsyncCloudDevice)
+            self.assertEqual(d.cloud, self.cloud)
+
+    def test_all_devices_with_invalid_access_token(self):
+        """
+        Test that `all_devices` returns an empty list when an invalid
+        access token is used.
+        """
+        self.cloud.access_token = 'invalid_token'
+        self.assertEqual(self.run_coroutine(self.cloud.all_devices()), [])
+
+    def test_device(self):
+        """
+        Test that `device` returns a device with its variables and
+        functions.
+        """
+        device = self.run_coroutine(self.cloud.device('12345abcde12345abcde'))
+        self.assertIsInstance(device, AsyncCloudDevice)
+        self.assertIn('func', device.functions)
+        self.assertIn('int_var', device.variables)
+
+    def test_device_with_nonexistant_device_id(self):
+        """
+        Test that `device` returns None for an unknown device id.
+        """
+        self.assertIsNone(self.run_coroutine(self.cloud.device('not_a_device_id')))
+
+    def test_read(self):
+        """
+        Test that `read` returns the value of a variable and raises a
+        `ServiceError` for a nonexistant variable.
+        """
+        device = AsyncCloudDevice(self.cloud, id='12345abcde12345abcde')
+        self.assertEqual(self.run_coroutine(device.read('int_var')), 123)
+        with self.assertRaises(ServiceError):
+            self.run_coroutine(device.read('not_a_variable'))
+
+    def test_call(self):
+        """
+        Test that `call` returns an int after a successful call.
+        """
+        device = AsyncCloudDevice(self.cloud, id='12345abcde12345abcde')
+        self.assertIsInstance(self.run_coroutine(device.call('func', 'args')), int)
+
+    def test_call_many_is_bounded(self):
+        """
+        Test that `call_many` returns a result for every device while
+        keeping no more requests in flight than the transport allows.
+        """
+        ids = ['12345abcde12345abcde'] * 10 + ['not_a_device_id']
+        results = self.run_coroutine(self.cloud.call_many(ids, 'func'))
+        self.assertEqual(results['12345abcde12345abcde'], 0)
+        self.assertIsInstance(results['not_a_device_id'], ServiceError)
+        self.assertEqual(self.transport.session.max_in_flight, 2)
+
+    def test_timeout(self):
+        """
+        Test that a request that doesn't answer within the timeout
+        raises a 504 and counts against the device's breaker.
+        """
+        self.transport.session.delay = 1
+        device = AsyncCloudDevice(self.cloud, id='12345abcde12345abcde')
+        with self.assertRaises(ServiceError) as cm:
+            self.run_coroutine(device.read('int_var'))
+        self.assertEqual(cm.exception.status_code, 504)
+        self.assertEqual(self.transport.session.in_flight, 0)
+        self.assertEqual(device_breaker('12345abcde12345abcde').stats()['failures'], 1)
+
+    def test_open_breaker(self):
+        """
+        Test that nothing is sent while a breaker is open.
+        """
+        device = AsyncCloudDevice(self.cloud, id='12345abcde12345abcde')
+        with mock.patch.object(CircuitBreaker, 'admit', return_value=None):
+            with self.assertRaises(ServiceError) as cm:
+                self.run_coroutine(device.call('func', 'args'))
+        self.assertEqual(cm.exception.status_code, 503)
+        self.assertEqual(self.transport.session.requests, 0)
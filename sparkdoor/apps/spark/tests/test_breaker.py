@@ -0,0 +1,88 @@
+"""
+test_breaker.py - test cases for the `spark` app's breaker module.
+"""
+import time
+
+from django.test import SimpleTestCase, override_settings
+
+from sparkdoor.libs.httmock import HTTMock, all_requests
+
+from .mocks import ACCESS_TOKEN
+from ..breaker import CircuitBreaker, device_breaker
+from ..services import SparkCloud, CloudDevice, ServiceError
+
+
+spark_test_settings = {
+    'CLOUD_USERNAME': 'a_user',
+    'CLOUD_PASSWORD': 'password',
+    'CLOUD_API_URI': 'https://api.test.com',
+    'CLOUD_BREAKER_MIN_CALLS': 2,
+    'CLOUD_BREAKER_RESET_TIMEOUT': 0.2,
+    'CLOUD_READ_RETRIES': 0,
+    'APPS': {}
+}
+
+
+@override_settings(SPARK=spark_test_settings)
+class CircuitBreakerTestCase(SimpleTestCase):
+    """
+    Test case for `breaker.CircuitBreaker`.
+    """
+    def setUp(self):
+        """
+        Start with a closed breaker.
+        """
+        self.breaker = CircuitBreaker('test', [504], min_calls=2, reset_timeout=0.2)
+        self.breaker.reset()
+
+    def test_opens(self):
+        """
+        Test that the breaker opens once enough calls fail.
+        """
+        self.breaker.record(self.breaker.admit(), 200)
+        self.breaker.record(self.breaker.admit(), 200)
+        self.breaker.record(self.breaker.admit(), 504)
+        self.assertEqual(self.breaker.state(), CircuitBreaker.CLOSED)
+        self.breaker.record(self.breaker.admit(), 504)
+        self.assertEqual(self.breaker.state(), CircuitBreaker.OPEN)
+        self.assertIsNone(self.breaker.admit())
+
+    def test_half_open(self):
+        """
+        Test that a single probe is let through after the reset timeout
+        and closes the breaker when it succeeds.
+        """
+        for i in range(2):
+            self.breaker.record(self.breaker.admit(), None)
+        time.sleep(0.3)
+        self.assertEqual(self.breaker.state(), CircuitBreaker.HALF_OPEN)
+        probe = self.breaker.admit()
+        self.assertEqual(probe, 'probe')
+        self.assertIsNone(self.breaker.admit())
+        self.breaker.record(probe, 200)
+        self.assertEqual(self.breaker.state(), CircuitBreaker.CLOSED)
+
+    def test_fast_fail(self):
+        """
+        Test that calls to a device with an open breaker fail with a 503
+        without a request being sent.
+        """
+        sent = []
+
+        @all_requests
+        def timeout_mock(url_split, request):
+            sent.append(url_split.path)
+            return {'status_code': 504, 'content': {}}
+
+        breaker = device_breaker('broken')
+        breaker.reset()
+        device = CloudDevice(SparkCloud('https://api.test.com', ACCESS_TOKEN), id='broken')
+        with HTTMock(timeout_mock):
+            for i in range(2):
+                with self.assertRaises(ServiceError):
+                    device.read('var')
+            with self.assertRaises(ServiceError) as cm:
+                device.read('var')
+        self.assertEqual(cm.exception.status_code, 503)
+        self.assertEqual(len(sent), 2)
+        breaker.reset()
@@ -0,0 +1,81 @@
+"""
+test_locks.py - test cases for the `spark` app's locks module.
+"""
+from django.test import SimpleTestCase, override_settings
+
+from ..locks import CacheLock, get_lock, singleton_task, lock_stats
+
+
+spark_test_settings = {
+    'CLOUD_USERNAME': 'a_user',
+    'CLOUD_PASSWORD': 'password',
+    'LOCK_URL': 'cache://',
+    'APPS': {}
+}
+
+
+@override_settings(SPARK=spark_test_settings)
+class LocksTestCase(SimpleTestCase):
+    """
+    Test case for `locks.CacheLock` and `locks.singleton_task`.
+    """
+    def test_get_lock(self):
+        """
+        Test that the Django cache is used without a Redis url.
+        """
+        self.assertIsInstance(get_lock('test.lock'), CacheLock)
+
+    def test_only_one_owner(self):
+        """
+        Test that a held lock can't be taken and that only its owner
+        can release it.
+        """
+        first, second = CacheLock('test.lock'), CacheLock('test.lock')
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire(wait=0.2))
+        second.release()
+        self.assertFalse(CacheLock('test.lock').acquire())
+        first.release()
+        self.assertTrue(second.acquire())
+        second.release()
+
+    def test_renew(self):
+        """
+        Test that `renew` fails once the lock belongs to someone else.
+        """
+        lock = CacheLock('test.lock')
+        lock.acquire()
+        self.assertTrue(lock.renew())
+        lock.release()
+        self.assertFalse(lock.renew())
+
+    def test_singleton_task(self):
+        """
+        Test that a singleton task is skipped while its lock is held and
+        that the lock is released when the task raises.
+        """
+        calls = []
+
+        @singleton_task('test.task')
+        def task(fail=False):
+            calls.append(fail)
+            if fail:
+                raise ValueError
+            return 'done'
+
+        with get_lock('test.task') as locked:
+            self.assertTrue(locked)
+            self.assertIsNone(task())
+        with self.assertRaises(ValueError):
+            task(fail=True)
+        self.assertEqual(task(), 'done')
+        self.assertEqual(calls, [True, False])
+
+    def test_lock_stats(self):
+        """
+        Test that contended locks are counted.
+        """
+        before = lock_stats().get('contended', 0)
+        with get_lock('test.lock'):
+            get_lock('test.lock').acquire()
+        self.assertEqual(lock_stats()['contended'], before + 1)
@@ -0,0 +1,127 @@
+"""
+test_metadata.py - test cases for the `spark` app's metadata module.
+"""
+from django.test import SimpleTestCase, override_settings
+
+from sparkdoor.libs.httmock import HTTMock
+
+from .mocks import spark_cloud_mock, ACCESS_TOKEN
+from ..metadata import MetadataCache, get_metadata_cache
+from ..services import SparkCloud, ServiceError
+
+
+spark_test_settings = {
+    'CLOUD_USERNAME': 'a_user',
+    'CLOUD_PASSWORD': 'password',
+    'CLOUD_API_URI': 'https://api.test.com',
+    'APPS': {}
+}
+
+
+class MetadataCacheTestCase(SimpleTestCase):
+    """
+    Test case for `metadata.MetadataCache`.
+    """
+    def setUp(self):
+        """
+        Make an empty cache.
+        """
+        self.metadata = MetadataCache(prefix='test.metadata', max_entries=4)
+        self.metadata.clear()
+
+    def test_set_and_get(self):
+        """
+        Test that `get` returns what was stored with `set`.
+        """
+        self.metadata.set('door', {'functions': ['open']})
+        self.assertEqual(self.metadata.get('door'), {'functions': ['open']})
+        self.assertIsNone(self.metadata.get('not_stored'))
+
+    def test_per_entry_timeout(self):
+        """
+        Test that an entry stored with a zero timeout has expired.
+        """
+        self.metadata.set('door', {'functions': ['open']}, timeout=0)
+        self.assertIsNone(self.metadata.get('door'))
+
+    def test_invalidate(self):
+        """
+        Test that `invalidate` removes an entry.
+        """
+        self.metadata.set('door', {'functions': ['open']})
+        self.metadata.invalidate('door')
+        self.assertIsNone(self.metadata.get('door'))
+
+    def test_evicts_least_recently_used(self):
+        """
+        Test that entries that weren't used while a generation filled up
+        are evicted and that the ones that were are kept.
+        """
+        self.metadata.set('first', {})
+        self.metadata.set('second', {})
+        self.metadata.get('first')
+        self.metadata.set('third', {})
+        self.assertIsNone(self.metadata.get('second'))
+        self.assertEqual(self.metadata.get('third'), {})
+        self.assertEqual(self.metadata.get('first'), {})
+
+    def test_clear(self):
+        """
+        Test that `clear` removes all entries.
+        """
+        self.metadata.set('first', {})
+        self.metadata.set('second', {})
+        self.metadata.set('third', {})
+        self.metadata.clear()
+        self.assertIsNone(self.metadata.get('first'))
+        self.assertIsNone(self.metadata.get('third'))
+
+
+@override_settings(SPARK=spark_test_settings)
+class SharedMetadataTestCase(SimpleTestCase):
+    """
+    Test case for sharing metadata between `services.CloudDevice`
+    instances.
+    """
+    @classmethod
+    def setUpClass(cls):
+        """
+        Add test settings shortcuts.
+        """
+        cls.API_URI = spark_test_settings['CLOUD_API_URI']
+
+    def setUp(self):
+        """
+        Start from an empty cache.
+        """
+        get_metadata_cache().clear()
+
+    def test_device_stores_metadata(self):
+        """
+        Test that `SparkCloud.device` shares the metadata it fetched and
+        that a second lookup is served without asking the cloud.
+        """
+        cloud = SparkCloud(self.API_URI, ACCESS_TOKEN)
+        with HTTMock(spark_cloud_mock):
+            device_id = cloud.all_devices()[0].id
+            fetched = cloud.device(device_id, 'app.door')
+        cached = cloud.device(device_id, 'app.door')
+        self.assertEqual(cached.id, device_id)
+        self.assertEqual(cached.variables, fetched.variables)
+        self.assertEqual(cached.functions, fetched.functions)
+        self.assertIsNone(cached.name)
+        self.assertIsNone(cached.connected)
+        self.assertIsNone(cached.last_heard)
+
+    def test_unknown_variable_invalidates_metadata(self):
+        """
+        Test that reading a variable the cloud doesn't know about drops
+        the shared metadata.
+        """
+        cloud = SparkCloud(self.API_URI, ACCESS_TOKEN)
+        with HTTMock(spark_cloud_mock):
+            device_id = cloud.all_devices()[0].id
+            device = cloud.device(device_id, 'app.door')
+            with self.assertRaises(ServiceError):
+                device.read('not_a_variable')
+        self.assertIsNone(get_metadata_cache().get('app.door'))
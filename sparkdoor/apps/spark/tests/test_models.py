@@ -10,9 +10,10 @@ from sparkdoor.libs.httmock import HTTMock
 
 from .mocks import spark_cloud_mock, ACCESS_TOKEN
 from .factories import CloudCredentialsFactory, DeviceFactory
-from ..models import CloudCredentials, Device
-from ..services import SparkCloud
+from ..models import CloudCredentials, Device, DevicePresence
+from ..services import CLOUD_DATETIME_FORMAT, SparkCloud, CloudDevice, ServiceError
 from ..settings import SparkSettings
+from ..versions import device_versions
 
 
 class TestApp:
@@ -84,6 +85,20 @@ class CloudCredentialsTestCase(TestCase):
         self.assertEqual(token, ACCESS_TOKEN)
         CloudCredentials.objects.all().delete()
 
+    def test_access_token_cached(self):
+        """
+        Test that `_access_token` only queries the database again after
+        the credentials change.
+        """
+        old = self.factory.create(access_token='old', expires_at=self.old_dt)
+        self.assertEqual(CloudCredentials.objects._access_token(), 'old')
+        with self.assertNumQueries(0):
+            self.assertEqual(CloudCredentials.objects._access_token(), 'old')
+        cur = self.factory.create(access_token=ACCESS_TOKEN, expires_at=self.current_dt)
+        self.assertEqual(CloudCredentials.objects._access_token(), ACCESS_TOKEN)
+        CloudCredentials.objects.all().delete()
+        self.assertIsNone(CloudCredentials.objects._access_token())
+
     def test_access_token_empty(self):
         """
         Test that `_access_token` returns None if there isn't any saved
@@ -203,6 +218,25 @@ class DeviceTestCase(TestCase):
         device = Device.objects.by_device_id(self.user, self.device.device_id)
         self.assertEqual(device, self.device)
 
+    def test_with_cloud_state(self):
+        """
+        Test that the devices of a `with_cloud_state` query set get their
+        cloud state from a single request.
+        """
+        paths = []
+        def counting_mock(url, request):
+            paths.append(url.path)
+            return spark_cloud_mock(url, request)
+        devices = Device.objects.all().with_cloud_state().order_by('id')
+        with HTTMock(counting_mock):
+            for d in devices:
+                if d == self.device:
+                    self.assertEqual(d._cloud_device.id, self.device.device_id)
+                else:
+                    with self.assertRaises(ServiceError):
+                        d._cloud_device
+        self.assertEqual(paths, ['/v1/devices'])
+
     def test_call(self):
         """
         Test that `call` calls a function of a cloud device and returns
@@ -258,3 +292,106 @@ class DeviceTestCase(TestCase):
         """
         with HTTMock(spark_cloud_mock):
             self.assertEqual(self.device.functions, self.cloud_device.functions)
+
+
+@override_settings(SPARK=dict(spark_test_settings, PRESENCE_MIN_INTERVAL=10,
+    PRESENCE_MAX_INTERVAL=40, PRESENCE_ACTIVE_WINDOW=60))
+class DevicePresenceTestCase(TestCase):
+    """
+    Test case for `models.DevicePresence`.
+    """
+    def setUp(self):
+        """
+        Add devices and a fake cloud.
+        """
+        self.now = timezone.now()
+        self.online = DeviceFactory.create(device_id='online')
+        self.offline = DeviceFactory.create(device_id='offline')
+        self.loads = []
+        self.cloud_devices = [
+            CloudDevice(None, id='online', connected=True,
+                last_heard=self.now.strftime(CLOUD_DATETIME_FORMAT)),
+            CloudDevice(None, id='offline', connected=False,
+                last_heard=(self.now - timedelta(days=1)).strftime(CLOUD_DATETIME_FORMAT))
+        ]
+
+    def load(self):
+        self.loads.append(1)
+        return self.cloud_devices
+
+    def poll(self, seconds):
+        return DevicePresence.objects.poll(self.load, self.now + timedelta(seconds=seconds))
+
+    def test_poll(self):
+        """
+        Test that every device's presence is recorded.
+        """
+        self.assertEqual(self.poll(0), Device.objects.count())
+        presence = DevicePresence.objects.get(device=self.online)
+        self.assertTrue(presence.connected)
+        self.assertEqual(presence.last_heard.replace(microsecond=0),
+            self.now.replace(microsecond=0))
+        self.assertFalse(DevicePresence.objects.get(device=self.offline).connected)
+
+    def test_poll_not_due(self):
+        """
+        Test that the cloud isn't asked until a device is due.
+        """
+        self.poll(0)
+        self.assertEqual(self.poll(5), 0)
+        self.assertEqual(len(self.loads), 1)
+
+    def test_backoff(self):
+        """
+        Test that idle devices are checked less and less often while
+        active devices keep being checked often.
+        """
+        self.poll(0)
+        self.poll(10)
+        self.poll(30)
+        self.assertEqual(DevicePresence.objects.get(device=self.offline).interval, 40)
+        self.assertEqual(DevicePresence.objects.get(device=self.online).interval, 10)
+
+    def test_change_resets_interval(self):
+        """
+        Test that a device whose presence changed is saved even if it
+        isn't due and is checked often again.
+        """
+        self.poll(0)
+        self.poll(10)
+        self.cloud_devices[1].connected = True
+        self.poll(20)
+        presence = DevicePresence.objects.get(device=self.offline)
+        self.assertTrue(presence.connected)
+        self.assertEqual(presence.interval, 10)
+
+    def test_last_heard_tolerance(self):
+        """
+        Test that an online device being heard from again isn't a change
+        until `last_heard` moved by `PRESENCE_ACTIVE_WINDOW`.
+        """
+        self.poll(0)
+        version = device_versions.get(self.online.user_id)
+        self.cloud_devices[0].last_heard = (self.now + timedelta(seconds=20)).strftime(
+            CLOUD_DATETIME_FORMAT)
+        self.assertEqual(self.poll(5), 0)
+        self.poll(10)
+        presence = DevicePresence.objects.get(device=self.online)
+        self.assertEqual(presence.last_heard.replace(microsecond=0),
+            self.now.replace(microsecond=0))
+        self.assertEqual(device_versions.get(self.online.user_id), version)
+        self.cloud_devices[0].last_heard = (self.now + timedelta(seconds=70)).strftime(
+            CLOUD_DATETIME_FORMAT)
+        self.assertEqual(self.poll(20), 1)
+        presence = DevicePresence.objects.get(device=self.online)
+        self.assertEqual(presence.last_heard.replace(microsecond=0),
+            (self.now + timedelta(seconds=70)).replace(microsecond=0))
+        self.assertNotEqual(device_versions.get(self.online.user_id), version)
+
+    def test_poll_no_answer(self):
+        """
+        Test that nothing is recorded when the cloud has no devices.
+        """
+        self.cloud_devices = []
+        self.assertEqual(self.poll(0), 0)
+        self.assertFalse(DevicePresence.objects.exists())
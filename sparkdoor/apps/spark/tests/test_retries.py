@@ -0,0 +1,94 @@
+"""
+test_retries.py - test cases for the `spark` app's retries module.
+"""
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from sparkdoor.libs.httmock import HTTMock, all_requests
+
+from .mocks import ACCESS_TOKEN
+from ..breaker import cloud_breaker, device_breaker
+from ..retries import RetryBudget
+from ..services import SparkCloud, CloudDevice, ServiceError
+
+
+spark_test_settings = {
+    'CLOUD_USERNAME': 'a_user',
+    'CLOUD_PASSWORD': 'password',
+    'CLOUD_API_URI': 'https://api.test.com',
+    'CLOUD_READ_RETRIES': 2,
+    'CLOUD_RETRY_BACKOFF': 0.01,
+    'CLOUD_RETRY_BUDGET_MIN': 2,
+    'APPS': {}
+}
+
+
+@override_settings(SPARK=spark_test_settings)
+class RetryTestCase(SimpleTestCase):
+    """
+    Test case for `retries.RetryBudget` and retried requests.
+    """
+    def setUp(self):
+        """
+        Start with an unused budget and a closed breaker.
+        """
+        budget = RetryBudget()
+        cache.delete_many([budget._key(name, budget._bucket() + i)
+            for name in ('requests', 'retries') for i in (0, 1)])
+        cloud_breaker('https://api.test.com').reset()
+        self.sent = []
+
+        @all_requests
+        def flaky_mock(url_split, request):
+            self.sent.append(request.method.lower())
+            return {'status_code': 503 if len(self.sent) % 3 else 200,
+                'content': {'result': 1, 'return_value': 1}}
+        self.flaky_mock = flaky_mock
+        self.device = CloudDevice(SparkCloud('https://api.test.com', ACCESS_TOKEN),
+            id='flaky')
+
+    def tearDown(self):
+        """
+        Close the breaker again.
+        """
+        device_breaker('flaky').reset()
+
+    def test_budget(self):
+        """
+        Test that retries are limited to a share of the requests.
+        """
+        budget = RetryBudget(ratio=0.5, min_retries=1)
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        for i in range(4):
+            budget.deposit()
+        self.assertTrue(budget.withdraw())
+        self.assertEqual(budget.stats(), {'requests': 4, 'retries': 3})
+
+    def test_read_retried(self):
+        """
+        Test that a failed read is retried.
+        """
+        with HTTMock(self.flaky_mock):
+            self.assertEqual(self.device.read('var'), 1)
+        self.assertEqual(self.sent, ['get', 'get', 'get'])
+
+    def test_call_not_retried(self):
+        """
+        Test that function calls, which aren't idempotent, aren't
+        retried.
+        """
+        with HTTMock(self.flaky_mock):
+            with self.assertRaises(ServiceError):
+                self.device.call('func', 'args')
+        self.assertEqual(self.sent, ['post'])
+
+    def test_budget_spent(self):
+        """
+        Test that reads stop being retried once the budget is spent.
+        """
+        with HTTMock(self.flaky_mock):
+            self.device.read('var')
+            with self.assertRaises(ServiceError):
+                self.device.read('var')
+        self.assertEqual(len(self.sent), 4)
@@ -2,6 +2,9 @@
 test_serializers.py - test cases for the `spark` app's serializers
     module.
 """
+from datetime import datetime
+from itertools import combinations
+
 from django.test import SimpleTestCase, override_settings
 from django.conf.urls import patterns, url
 
@@ -9,6 +12,7 @@ from rest_framework.test import APIRequestFactory, force_authenticate
 
 from .factories import DeviceFactory
 from .. import serializers, apps
+from ..models import DevicePresence
 
 
 urlpatterns = patterns('',
@@ -52,6 +56,43 @@ class DeviceSerializerTestCase(SimpleTestCase):
             'actions': [
                 { 'name': 'test-action',
                   'href': 'http://testserver/devices/1/test-action/'}
-            ]
+            ],
+            'connected': None,
+            'last_heard': None
         }
         self.assertEqual(expected_data, serializer.data)
+
+    def test_serialize_many(self):
+        """
+        Test that a list of devices is serialized like each device on
+        its own.
+        """
+        devices = [DeviceFactory.build(id=i, app_name=a)
+            for i, a in enumerate(['test_app', 'other', 'test_app'], 1)]
+        context = {'request': APIRequestFactory().get(path='', user=devices[0].user)}
+        serializer = serializers.DeviceSerializer(devices, many=True, context=context)
+        expected_data = [dict(serializers.DeviceSerializer(d, context=context).data)
+            for d in devices]
+        self.assertEqual([dict(d) for d in serializer.data], expected_data)
+        self.assertEqual(serializer.data[2]['actions'][0]['href'],
+            'http://testserver/devices/3/test-action/')
+
+    def test_serialize_many_fields(self):
+        """
+        Test that a list of devices is serialized like each device on
+        its own for every choice of `fields`.
+        """
+        devices = [DeviceFactory.build(id=i, app_name=a)
+            for i, a in enumerate(['test_app', 'other'], 1)]
+        devices[0].presence = DevicePresence(device=devices[0], connected=True,
+            last_heard=datetime(2014, 12, 1))
+        context = {'request': APIRequestFactory().get(path='', user=devices[0].user)}
+        names = serializers.DeviceSerializer.Meta.fields
+        for n in range(len(names) + 1):
+            for fields in combinations(names, n):
+                serializer = serializers.DeviceSerializer(devices, many=True, context=context,
+                    fields=fields)
+                expected_data = [serializers.DeviceSerializer(d, context=context,
+                    fields=fields).data for d in devices]
+                self.assertEqual([dict(d) for d in serializer.data],
+                    [dict(d) for d in expected_data], fields)
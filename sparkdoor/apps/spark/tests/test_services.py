@@ -1,14 +1,18 @@
 """
 test_serives.py - unit tests for the `spark` app's services module.
 """
+import threading
+import time
 from datetime import datetime
 
 from django.test import SimpleTestCase, override_settings
 
-from sparkdoor.libs.httmock import HTTMock
+from sparkdoor.libs.flight import SingleFlight
+from sparkdoor.libs.httmock import HTTMock, all_requests
 
 from .mocks import spark_cloud_mock, ACCESS_TOKEN
 from ..services import SparkCloud, CloudDevice, ServiceError
+from ..timeouts import remaining_time
 
 
 spark_test_settings = {
@@ -216,3 +220,85 @@ class CloudDeviceTestCase(SimpleTestCase):
             for name in device.variables.keys():
                 val = device.read(name)
                 self.assertIsInstance(val, (int, float, str))
+
+    def test_call_coalesced(self):
+        """
+        Test that identical calls made at the same time, from threads
+        of this process or from another process, share one request.
+        """
+        posts = []
+
+        @all_requests
+        def slow_mock(url_split, request):
+            if request.method.lower() == 'post':
+                posts.append(url_split.path)
+                time.sleep(0.3)
+            return spark_cloud_mock(url_split, request)
+
+        other_process = SingleFlight('spark.call', shared_errors=(ServiceError,))
+        results = []
+        with HTTMock(slow_mock):
+            device = CloudDevice(SparkCloud(self.API_URI, ACCESS_TOKEN),
+                id='12345abcde12345abcde')
+            calls = [lambda: device.call('func', 'args') for _ in range(3)]
+            calls.append(lambda: other_process.do((device.id, 'func', 'args'),
+                lambda: device._call('func', 'args')))
+            threads = [threading.Thread(target=lambda c=c: results.append(c()))
+                for c in calls]
+            for thread in threads:
+                thread.start()
+                time.sleep(0.02)
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(posts), 1)
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(len(results), 4)
+
+    def test_read_many(self):
+        """
+        Test that `read_many` returns the values that were read and the
+        errors for the rest.
+        """
+        with HTTMock(spark_cloud_mock):
+            device = SparkCloud(self.API_URI, ACCESS_TOKEN).all_devices()[0]
+            names = list(device.variables.keys())
+            values, errors = device.read_many(names + ['not_a_variable'])
+        self.assertEqual(sorted(values), sorted(names))
+        self.assertEqual(list(errors), ['not_a_variable'])
+        self.assertIsInstance(errors['not_a_variable'], ServiceError)
+
+    def test_read_many_deadline(self):
+        """
+        Test that reads are made concurrently and those that don't
+        finish before the deadline fail with a 504.
+        """
+        @all_requests
+        def slow_mock(url_split, request):
+            if url_split.path.endswith('slow'):
+                time.sleep(0.5)
+            return {'status_code': 200, 'content': {'result': 1}}
+
+        device = CloudDevice(SparkCloud(self.API_URI, ACCESS_TOKEN), id='12345abcde12345abcde')
+        started = time.time()
+        with HTTMock(slow_mock):
+            values, errors = device.read_many(['a', 'b', 'c', 'slow'], deadline=0.2)
+        self.assertLess(time.time() - started, 0.4)
+        self.assertEqual(values, {'a': 1, 'b': 1, 'c': 1})
+        self.assertEqual(errors['slow'].status_code, 504)
+
+    def test_read_many_errors(self):
+        """
+        Test that a response that isn't JSON only fails its own read and
+        that the reads are sent with the deadline as their timeout.
+        """
+        @all_requests
+        def mixed_mock(url_split, request):
+            if url_split.path.endswith('broken'):
+                return {'status_code': 200, 'content': b'not json'}
+            return {'status_code': 200, 'content': {'result': remaining_time()}}
+
+        device = CloudDevice(SparkCloud(self.API_URI, ACCESS_TOKEN), id='12345abcde12345abcde')
+        with HTTMock(mixed_mock):
+            values, errors = device.read_many(['a', 'broken'], deadline=1)
+        self.assertTrue(0 < values['a'] <= 1)
+        self.assertEqual(errors['broken'].status_code, 502)
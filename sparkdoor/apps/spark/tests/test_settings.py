@@ -5,7 +5,7 @@ from django.test import SimpleTestCase, override_settings
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 
-from ..settings import SparkSettings, DEFAULTS, load_apps
+from ..settings import SparkSettings, DEFAULTS, load_apps, get_spark_settings
 
 
 class TestApp:
@@ -48,6 +48,17 @@ class SparkSettingsTestCase(SimpleTestCase):
         self.assertEqual(spark_settings.RENEW_TOKEN_WINDOW,
             DEFAULTS['CLOUD_RENEW_TOKEN_WINDOW'])
 
+    @override_settings(
+        SPARK={'CLOUD_USERNAME': '...', 'CLOUD_PASSWORD': '...', 'APPS': {}})
+    def test_cloud_pool_size_has_default(self):
+        """
+        Test the `SPARK.CLOUD_POOL_SIZE` defaults properly when not
+        defined.
+        """
+        self.assertIsNone(settings.SPARK.get('CLOUD_POOL_SIZE', None))
+        spark_settings = SparkSettings()
+        self.assertEqual(spark_settings.POOL_SIZE, DEFAULTS['CLOUD_POOL_SIZE'])
+
     @override_settings(SPARK={'CLOUD_PASSWORD': '...', 'APPS': {}})
     def test_cloud_username_must_be_defined(self):
         """
@@ -93,6 +104,39 @@ class SparkSettingsTestCase(SimpleTestCase):
         apps = load_apps({'some_app': app_import_str})
         self.assertIs(apps['some_app'], TestApp)
 
+    def test_load_apps_copies(self):
+        """
+        Test that `load_apps` leaves the dictionary it was given alone.
+        """
+        app_import_str = '{0}.{1}'.format(TestApp.__module__, TestApp.__name__)
+        raw_apps = {'some_app': app_import_str}
+        load_apps(raw_apps)
+        self.assertEqual(raw_apps['some_app'], app_import_str)
+
+    @override_settings(
+        SPARK={'CLOUD_USERNAME': '...', 'CLOUD_PASSWORD': '...', 'APPS': {}})
+    def test_settings_are_read_only(self):
+        """
+        Test that a loaded `SparkSettings` can't be changed.
+        """
+        spark_settings = SparkSettings()
+        with self.assertRaises(AttributeError):
+            spark_settings.API_URI = 'http://api.somewhere.com'
+
+    def test_get_spark_settings(self):
+        """
+        Test that `get_spark_settings` returns the same instance until
+        the `SPARK` setting is changed.
+        """
+        with self.settings(SPARK={'CLOUD_USERNAME': 'first', 'CLOUD_PASSWORD': '...',
+                'APPS': {}}):
+            spark_settings = get_spark_settings()
+            self.assertIs(get_spark_settings(), spark_settings)
+            self.assertEqual(spark_settings.USERNAME, 'first')
+        with self.settings(SPARK={'CLOUD_USERNAME': 'second', 'CLOUD_PASSWORD': '...',
+                'APPS': {}}):
+            self.assertEqual(get_spark_settings().USERNAME, 'second')
+
     def test_settings(self):
         """
         Test that settings in `SPARK` are properly assigned into the
@@ -0,0 +1,234 @@
+"""
+test_streams.py - test cases for the `spark` app's streams module.
+"""
+import json
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from sparkdoor.libs.testmixins import ViewsTestMixin
+
+from .factories import CloudCredentialsFactory, DeviceFactory
+from .mocks import ACCESS_TOKEN
+from .. import views
+from ..streams import EventHub, cloud_events, parse_events, stream_limit
+
+
+STREAM = [
+    ':ok',
+    '',
+    'event: spark/status',
+    'data: {"data":"online","ttl":"60","published_at":"2014-12-01T00:00:00.000Z","coreid":"abc"}',
+    '',
+    'event: sparkdoor/opened',
+    'data: {"data":"abc","ttl":"60","published_at":"2014-12-01T00:00:01.000Z","coreid":"001"}',
+    '',
+    'event: not-json',
+    'data: online',
+    ''
+]
+
+
+class EventStreamHandler(BaseHTTPRequestHandler):
+    """
+    A local stand-in for the Spark cloud's event stream.
+    """
+    def do_GET(self):
+        if ACCESS_TOKEN not in self.path:
+            self.send_response(400)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        for line in STREAM:
+            self.wfile.write('{0}\n'.format(line).encode('utf-8'))
+            self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+class EventStreamServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+spark_test_settings = {
+    'CLOUD_USERNAME': 'a_user',
+    'CLOUD_PASSWORD': 'password',
+    'APPS': {}
+}
+
+
+class ParseEventsTestCase(SimpleTestCase):
+    """
+    Test case for `streams.parse_events`.
+    """
+    def test_parse_events(self):
+        """
+        Test that device events are parsed and routed by device id,
+        which is the data of events published by this site.
+        """
+        events = list(parse_events(STREAM))
+        self.assertEqual([e['name'] for e in events], ['spark/status', 'sparkdoor/opened'])
+        self.assertEqual([e['device'] for e in events], ['abc', 'abc'])
+        self.assertEqual(events[0]['data'], 'online')
+
+
+class CloudEventsTestCase(TestCase):
+    """
+    Test case for `streams.cloud_events` against a local stand-in.
+    """
+    @classmethod
+    def setUpClass(cls):
+        """
+        Start the stand-in.
+        """
+        cls.server = EventStreamServer(('127.0.0.1', 0), EventStreamHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.api_uri = 'http://127.0.0.1:{0}'.format(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Stop the stand-in.
+        """
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_cloud_events(self):
+        """
+        Test that events are read from the cloud's stream.
+        """
+        CloudCredentialsFactory(access_token=ACCESS_TOKEN)
+        with self.settings(SPARK=dict(spark_test_settings, CLOUD_API_URI=self.api_uri)):
+            events = list(cloud_events())
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events[1]['name'], 'sparkdoor/opened')
+
+
+class EventHubTestCase(SimpleTestCase):
+    """
+    Test case for `streams.EventHub`.
+    """
+    def setUp(self):
+        """
+        Make a hub whose source is fed from a queue.
+        """
+        self.upstream = queue.Queue()
+        self.connections = []
+
+        def source():
+            self.connections.append(1)
+            while True:
+                event = self.upstream.get()
+                if event is None:
+                    return
+                yield event
+        self.hub = EventHub(source)
+
+    def tearDown(self):
+        """
+        Let the source end.
+        """
+        self.upstream.put(None)
+
+    def test_fan_out(self):
+        """
+        Test that subscribers share one upstream connection and only get
+        the events of their devices.
+        """
+        a = iter(self.hub.subscribe(['a', 'b'], heartbeat=1))
+        b = iter(self.hub.subscribe(['b'], heartbeat=1))
+        self.upstream.put({'device': 'a', 'name': 'x'})
+        self.upstream.put({'device': 'b', 'name': 'y'})
+        self.assertEqual(next(a)['name'], 'x')
+        self.assertEqual(next(a)['name'], 'y')
+        self.assertEqual(next(b)['name'], 'y')
+        self.assertEqual(len(self.connections), 1)
+
+    def test_heartbeat(self):
+        """
+        Test that None is yielded while there are no events and that a
+        closed subscription stops.
+        """
+        subscription = self.hub.subscribe(['a'], heartbeat=0.05)
+        events = iter(subscription)
+        self.assertIsNone(next(events))
+        subscription.close()
+        self.assertEqual(list(events), [])
+        self.assertEqual(self.hub._subscribers, {})
+
+
+@override_settings(SPARK=spark_test_settings)
+class DeviceEventsViewTestCase(ViewsTestMixin, TestCase):
+    """
+    Test case for `views.DeviceEventsView`.
+    """
+    view_class = views.DeviceEventsView
+
+    def test_stream(self):
+        """
+        Test that events of the user's devices are streamed.
+        """
+        device = DeviceFactory(device_id='abc')
+        hub = EventHub(lambda: iter([]))
+        with mock.patch.object(views, 'event_hub', hub), \
+                mock.patch.object(views, 'connection'):
+            response = self.send_request_to_view(user=device.user)
+            content = iter(response.streaming_content)
+            self.assertEqual(next(content), b'retry: 3000\n\n')
+            hub.dispatch({'device': 'abc', 'name': 'spark/status', 'data': 'online',
+                'published_at': None})
+            chunk = next(content).decode('utf-8')
+            response.close()
+        name, data = chunk.strip().split('\n')
+        self.assertEqual(name, 'event: spark/status')
+        self.assertEqual(json.loads(data[len('data: '):]),
+            {'device': device.pk, 'data': 'online', 'published_at': None})
+        self.assertEqual(hub._subscribers, {})
+        self.assertEqual(stream_limit.count, 0)
+
+    def test_close_unread(self):
+        """
+        Test that a stream that is closed or dropped before it is read
+        gives its subscription and its place back.
+        """
+        device = DeviceFactory(device_id='abc')
+        hub = EventHub(lambda: iter([]))
+        with mock.patch.object(views, 'event_hub', hub), \
+                mock.patch.object(views, 'connection'):
+            self.send_request_to_view(user=device.user).close()
+            self.assertEqual(stream_limit.count, 0)
+            self.assertEqual(hub._subscribers, {})
+            self.send_request_to_view(user=device.user)
+            self.assertEqual(stream_limit.count, 0)
+            self.assertEqual(hub._subscribers, {})
+
+    def test_max_connections(self):
+        """
+        Test that streams beyond `EVENT_STREAM_MAX_CONNECTIONS` are
+        refused.
+        """
+        device = DeviceFactory(device_id='abc')
+        hub = EventHub(lambda: iter([]))
+        settings = dict(spark_test_settings, EVENT_STREAM_MAX_CONNECTIONS=1)
+        with self.settings(SPARK=settings), mock.patch.object(views, 'event_hub', hub), \
+                mock.patch.object(views, 'connection'):
+            first = self.send_request_to_view(user=device.user)
+            next(iter(first.streaming_content))
+            response = self.send_request_to_view(user=device.user)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '60')
+            first.close()
+            response = self.send_request_to_view(user=device.user)
+            self.assertEqual(response.status_code, 200)
+            next(iter(response.streaming_content))
+            response.close()
+        self.assertEqual(stream_limit.count, 0)
@@ -9,16 +9,28 @@ from django.utils import timezone
 from sparkdoor.libs.httmock import HTTMock
 
 from .mocks import spark_cloud_mock, ACCESS_TOKEN
-from .factories import CloudCredentialsFactory
-from ..tasks import refresh_access_token
-from ..models import CloudCredentials
+from sparkdoor.libs.factories import UserFactory
+from .factories import CloudCredentialsFactory, DeviceFactory
+from .. import actions, apps
+from ..tasks import (refresh_access_token, poll_device_presence, run_device_action,
+    sweep_device_actions)
+from ..models import CloudCredentials, DeviceAction, DevicePresence
+
+
+class TestApp(apps.DeviceAppBase):
+    action_names = ['test_action', 'fail']
+    def action(self, name, args):
+        if name == 'fail':
+            raise apps.DeviceAppError('Device could not be reached', 504)
+        return args
 
 
 spark_test_settings = {
     'CLOUD_USERNAME': 'a_user',
     'CLOUD_PASSWORD': 'password',
     'CLOUD_API_URI': 'https://api.test.com',
-    'APPS': {}
+    'LOCK_URL': 'cache://',
+    'APPS': {'test_app': TestApp}
 }
 
 
@@ -61,3 +73,64 @@ class RefreshAccessTokenTestCase(TestCase):
         self.assertEqual(CloudCredentials.objects.count(), 2)
         self.assertEqual(CloudCredentials.objects._access_token(), ACCESS_TOKEN)
         CloudCredentials.objects.all().delete()
+
+
+@override_settings(SPARK=spark_test_settings)
+class PollDevicePresenceTestCase(TestCase):
+    """
+    Test case for `tasks.poll_device_presence`.
+    """
+    def test_poll(self):
+        """
+        Test that the presence of registered devices is recorded.
+        """
+        CloudCredentialsFactory.create(access_token=ACCESS_TOKEN)
+        device = DeviceFactory.create(device_id='12345abcde12345abcde')
+        with HTTMock(spark_cloud_mock):
+            poll_device_presence()
+        presence = DevicePresence.objects.get(device=device)
+        self.assertTrue(presence.connected)
+        self.assertIsNotNone(presence.last_heard)
+
+
+@override_settings(SPARK=spark_test_settings)
+class RunDeviceActionTestCase(TestCase):
+    """
+    Test case for `tasks.run_device_action`.
+    """
+    @classmethod
+    def setUpClass(cls):
+        """
+        Add a test device.
+        """
+        cls.user = UserFactory.create()
+        cls.device = DeviceFactory.create(user=cls.user, app_name='test_app')
+
+    def test_records_result(self):
+        """
+        Test that the action's result is recorded.
+        """
+        action_id = actions.create_action(self.user)
+        run_device_action(action_id, self.device.pk, 'test_action', {'a': 1})
+        record = actions.get_action(action_id, self.user)
+        self.assertEqual(record['state'], actions.DONE)
+        self.assertEqual((record['status'], record['data']), (200, {'a': 1}))
+
+    def test_records_error(self):
+        """
+        Test that a `DeviceAppError` is recorded with its status code.
+        """
+        action_id = actions.create_action(self.user)
+        run_device_action(action_id, self.device.pk, 'fail', {})
+        self.assertEqual(actions.get_action(action_id, self.user)['status'], 504)
+
+    def test_sweep_device_actions(self):
+        """
+        Test that expired action records are deleted.
+        """
+        old_id, new_id = actions.create_action(self.user), actions.create_action(self.user)
+        DeviceAction.objects.filter(id=old_id).update(
+            created=timezone.now() - timedelta(hours=2))
+        self.assertIsNone(actions.get_action(old_id, self.user))
+        sweep_device_actions()
+        self.assertEqual(list(DeviceAction.objects.values_list('id', flat=True)), [new_id])
@@ -0,0 +1,161 @@
+"""
+test_timeouts.py - test cases for the `spark` app's timeouts module.
+"""
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+import requests
+
+from sparkdoor.libs.httmock import HTTMock, all_requests
+
+from .mocks import ACCESS_TOKEN
+from ..breaker import device_breaker
+from ..services import CloudDevice, SparkCloud, ServiceError
+from ..timeouts import (LatencyTracker, adaptive_timeout, deadline, latency_tracker,
+    remaining_time)
+
+
+spark_test_settings = {
+    'CLOUD_USERNAME': 'a_user',
+    'CLOUD_PASSWORD': 'password',
+    'CLOUD_API_URI': 'https://api.test.com',
+    'CLOUD_TIMEOUT': 5,
+    'CLOUD_TIMEOUT_MIN': 0.5,
+    'CLOUD_TIMEOUT_MAX': 20,
+    'CLOUD_TIMEOUT_FACTOR': 2,
+    'CLOUD_READ_RETRIES': 0,
+    'APPS': {}
+}
+
+
+@override_settings(SPARK=spark_test_settings)
+class LatencyTrackerTestCase(SimpleTestCase):
+    """
+    Test case for `timeouts.LatencyTracker` and `adaptive_timeout`.
+    """
+    def setUp(self):
+        """
+        Start without any latencies.
+        """
+        latency_tracker.clear()
+
+    def test_percentile(self):
+        """
+        Test that percentiles are only known after enough samples.
+        """
+        tracker = LatencyTracker(samples=100, min_samples=10)
+        for i in range(9):
+            tracker.observe('key', 1)
+        self.assertIsNone(tracker.percentile('key', 0.99))
+        for i in range(91):
+            tracker.observe('key', 0.1 if i < 90 else 3)
+        self.assertEqual(tracker.percentile('key', 0.5), 0.1)
+        self.assertEqual(tracker.percentile('key', 0.99), 3)
+
+    def test_max_keys(self):
+        """
+        Test that only the most recently used keys are kept.
+        """
+        tracker = LatencyTracker(min_samples=1, max_keys=2)
+        tracker.observe('a', 1)
+        tracker.observe('b', 1)
+        tracker.observe('a', 1)
+        tracker.observe('c', 1)
+        self.assertIsNone(tracker.percentile('b', 0.5))
+        self.assertEqual(tracker.percentile('a', 0.5), 1)
+
+    def test_adaptive_timeout(self):
+        """
+        Test that the timeout is the default until the latency is known
+        and then follows it within the limits.
+        """
+        self.assertEqual(adaptive_timeout('key'), 5)
+        for i in range(latency_tracker.min_samples):
+            latency_tracker.observe('key', 2)
+        self.assertEqual(adaptive_timeout('key'), 4)
+        for i in range(latency_tracker.samples):
+            latency_tracker.observe('key', 0.01)
+        self.assertEqual(adaptive_timeout('key'), 0.5)
+        for i in range(latency_tracker.samples):
+            latency_tracker.observe('key', 60)
+        self.assertEqual(adaptive_timeout('key'), 20)
+
+    def test_request_timeout(self):
+        """
+        Test that requests are sent with the timeout for their key and
+        that a request that times out raises a 504.
+        """
+        timeouts = []
+
+        def send(timeout):
+            timeouts.append(timeout)
+            raise requests.Timeout()
+
+        for i in range(latency_tracker.min_samples):
+            latency_tracker.observe(('read', 'slow'), 1)
+        cloud = SparkCloud('https://api.test.com', ACCESS_TOKEN)
+        with self.assertRaises(ServiceError) as cm:
+            cloud._send(send, ('read', 'slow'), 'slow', retry=True)
+        self.assertEqual(cm.exception.status_code, 504)
+        self.assertEqual(timeouts, [2])
+        device_breaker('slow').reset()
+
+    def test_call_timeout(self):
+        """
+        Test that each function of a device has its own timeout, that a
+        fixed timeout is used as given and that timeouts are learned.
+        """
+        timeouts = []
+        real_attempt = SparkCloud._attempt
+
+        def attempt(cloud, send, key, device_id, timeout):
+            timeouts.append((key[1], timeout))
+            return real_attempt(cloud, send, key, device_id, timeout)
+
+        @all_requests
+        def cloud_mock(url_split, request):
+            if url_split.path.endswith('slow'):
+                raise requests.Timeout()
+            return {'status_code': 200, 'content': {'return_value': 1}}
+
+        for i in range(latency_tracker.min_samples):
+            latency_tracker.observe(('call', 'fast', 'abc'), 0.01)
+        device = CloudDevice(SparkCloud('https://api.test.com', ACCESS_TOKEN), id='abc')
+        with HTTMock(cloud_mock), mock.patch.object(SparkCloud, '_attempt', attempt):
+            device.call('fast', None)
+            device.call('other', None)
+            device.call('fixed', None, timeout=30)
+            for i in range(latency_tracker.min_samples):
+                with self.assertRaises(ServiceError):
+                    device.call('slow', None)
+                device_breaker('abc').reset()
+        self.assertEqual(timeouts[:3], [('fast', 0.5), ('other', 5), ('fixed', 30)])
+        self.assertEqual(adaptive_timeout(('call', 'slow', 'abc')), 10)
+
+    def test_deadline(self):
+        """
+        Test that a deadline shortens the timeout of requests and that
+        nothing is sent once it has passed.
+        """
+        timeouts = []
+
+        def send(timeout):
+            timeouts.append(timeout)
+            raise requests.Timeout()
+
+        cloud = SparkCloud('https://api.test.com', ACCESS_TOKEN)
+        self.assertIsNone(remaining_time())
+        with deadline(time.time() + 1):
+            with deadline(time.time() + 60):
+                self.assertLessEqual(remaining_time(), 1)
+            with self.assertRaises(ServiceError):
+                cloud._send(send, 'key')
+        with deadline(time.time() - 1):
+            with self.assertRaises(ServiceError) as cm:
+                cloud._send(send, 'key')
+        self.assertEqual(cm.exception.status_code, 504)
+        self.assertEqual(len(timeouts), 1)
+        self.assertLessEqual(timeouts[0], 1)
+        self.assertIsNone(remaining_time())
@@ -0,0 +1,95 @@
+"""
+test_transport.py - test cases for the `spark` app's transport module.
+"""
+from django.test import SimpleTestCase, override_settings
+
+from sparkdoor.libs.httmock import HTTMock
+
+from .mocks import spark_cloud_mock, ACCESS_TOKEN
+from ..services import SparkCloud
+from ..transport import Transport, get_transport, reset_transport
+
+
+spark_test_settings = {
+    'CLOUD_USERNAME': 'a_user',
+    'CLOUD_PASSWORD': 'password',
+    'CLOUD_API_URI': 'https://api.test.com',
+    'CLOUD_POOL_SIZE': 3,
+    'APPS': {}
+}
+
+
+@override_settings(SPARK=spark_test_settings)
+class TransportTestCase(SimpleTestCase):
+    """
+    Test case for `transport.Transport`.
+    """
+    @classmethod
+    def setUpClass(cls):
+        """
+        Add test settings shortcuts.
+        """
+        cls.API_URI = spark_test_settings['CLOUD_API_URI']
+
+    def test_session_per_host(self):
+        """
+        Test that `session` returns the same session for a host and a
+        different session for another host.
+        """
+        transport = Transport()
+        session = transport.session(self.API_URI)
+        self.assertIs(transport.session(self.API_URI + '/v1'), session)
+        self.assertIsNot(transport.session('https://other.test.com'), session)
+
+    def test_pool_size(self):
+        """
+        Test that sessions are mounted with an adapter that keeps
+        `pool_size` connections.
+        """
+        transport = Transport(pool_size=7)
+        adapter = transport.session(self.API_URI).get_adapter(self.API_URI)
+        self.assertEqual(adapter._pool_maxsize, 7)
+
+    def test_service_uses_shared_session(self):
+        """
+        Test that `service` returns a `Hammock` bound to the shared
+        session.
+        """
+        transport = Transport()
+        service = transport.service(self.API_URI)
+        self.assertIs(service, transport.service(self.API_URI))
+        self.assertIs(service.v1.devices._session, transport.session(self.API_URI))
+
+    def test_sessions_dropped_after_fork(self):
+        """
+        Test that a new session is built when the process id changes.
+        """
+        transport = Transport()
+        session = transport.session(self.API_URI)
+        transport._pid = -1
+        self.assertIsNot(transport.session(self.API_URI), session)
+
+    def test_get_transport(self):
+        """
+        Test that `get_transport` returns a single transport built with
+        the `CLOUD_POOL_SIZE` setting until `reset_transport` is called.
+        """
+        reset_transport()
+        transport = get_transport()
+        self.assertIs(get_transport(), transport)
+        self.assertEqual(transport.pool_size, spark_test_settings['CLOUD_POOL_SIZE'])
+        reset_transport()
+        self.assertIsNot(get_transport(), transport)
+        reset_transport()
+
+    def test_spark_clouds_share_session(self):
+        """
+        Test that separate `SparkCloud` instances send requests over the
+        same session.
+        """
+        transport = Transport()
+        with HTTMock(spark_cloud_mock):
+            first = SparkCloud(self.API_URI, ACCESS_TOKEN, transport)
+            second = SparkCloud(self.API_URI, ACCESS_TOKEN, transport)
+            self.assertTrue(len(first.all_devices()) > 0)
+        self.assertIs(first._service._session, second._service._session)
@@ -0,0 +1,42 @@
+"""
+test_versions.py - test cases for the `spark` app's versions module.
+"""
+import time
+import uuid
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from ..versions import VersionCounter
+
+
+class VersionCounterTestCase(SimpleTestCase):
+    """
+    Test case for `versions.VersionCounter`.
+    """
+    def setUp(self):
+        """
+        Start with counters that were never used.
+        """
+        self.versions = VersionCounter('test.version.{0}'.format(uuid.uuid4().hex))
+
+    def test_bump(self):
+        """
+        Test that a version stays the same until it is bumped.
+        """
+        version = self.versions.get(1)
+        self.assertEqual(self.versions.get(1), version)
+        self.versions.bump(1)
+        self.assertNotEqual(self.versions.get(1), version)
+        self.assertEqual(self.versions.get(2), self.versions.get(2))
+
+    def test_evicted(self):
+        """
+        Test that a counter that was evicted doesn't start again from a
+        version that was already handed out.
+        """
+        self.versions.bump(1)
+        version = self.versions.get(1)
+        cache.delete(self.versions._key(1))
+        time.sleep(0.01)
+        self.assertGreater(self.versions.get(1), version)
@@ -1,6 +1,10 @@
 """
 test_views.py - test cases for the `spark` app's view module.
 """
+import time
+from unittest import mock
+from urllib.parse import urlsplit, parse_qs
+
 from django.test import TestCase, override_settings
 
 from rest_framework.response import Response
@@ -11,7 +15,8 @@ from sparkdoor.libs.factories import UserFactory
 
 from .factories import DeviceFactory, CloudCredentialsFactory
 from .mocks import spark_cloud_mock, ACCESS_TOKEN
-from .. import views, models, apps
+from .. import views, models, apps, actions
+from ..timeouts import remaining_time
  
 
 class TestApp(apps.DeviceAppBase):
@@ -79,6 +84,15 @@ class DeviceAPIViewTestCase(APITestMixin, TestCase):
             context={'request': request}).data
         self.assertEqual(response.data, expected_data)
 
+    def test_cloud_state_only_for_list(self):
+        """
+        Test that a single device doesn't share a cloud request for the
+        whole account.
+        """
+        view = self.build_view(self.build_request(), kwargs={'pk': self.device.id})
+        view.request = view.initialize_request(view.request)
+        self.assertFalse(hasattr(view.get_object(), '_cloud_batch'))
+
     def test_get_action(self):
         """
         Test that `get` returns a 405 when an `action` kwarg is given.
@@ -122,6 +136,202 @@ class DeviceAPIViewTestCase(APITestMixin, TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data, 'some_data')
 
+    def test_post_async(self):
+        """
+        Test that `post` queues the action and returns a 202 with a
+        status url when an asynchronous response is preferred.
+        """
+        request = self.build_request(method='POST', HTTP_PREFER='respond-async')
+        with mock.patch.object(views, 'run_device_action') as task:
+            response = self.dispatch_view(request,
+                kwargs={'pk': self.device.id, 'action': 'test_action'})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['state'], actions.PENDING)
+        self.assertEqual(response['Location'], response.data['href'])
+        action_id, device_pk, name, data = task.delay.call_args[0]
+        self.assertEqual((device_pk, name), (self.device.id, 'test_action'))
+        self.assertIn(action_id, response.data['href'])
+
+
+@override_settings(SPARK=dict(spark_test_settings, DEVICE_MAX_PAGE_SIZE=3))
+class DeviceListPagingTestCase(APITestMixin, TestCase):
+    """
+    Test case for paging and field selection of `views.DeviceAPIView`.
+    """
+    view_class = views.DeviceAPIView
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Add a user with a few devices.
+        """
+        cls.user = UserFactory.create()
+        cls.devices = [DeviceFactory.create(user=cls.user, name=n, app_name='test_app')
+            for n in ['b', 'e', 'a', 'd', 'c']]
+
+    def get_list(self, **params):
+        return self.dispatch_view(self.build_request(user=self.user, data=params))
+
+    def test_pages(self):
+        """
+        Test that following the `next` links returns every device once
+        in name order.
+        """
+        names, params, pages = [], {'page_size': 2}, 0
+        while params is not None:
+            response = self.get_list(**params)
+            self.assertEqual(response.status_code, 200)
+            names.extend(d['name'] for d in response.data['devices'])
+            pages += 1
+            next_uri = response.data['next']
+            params = None
+            if next_uri is not None:
+                params = {k: v[0] for k, v in parse_qs(urlsplit(next_uri).query).items()}
+        self.assertEqual(names, ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(pages, 3)
+
+    def test_max_page_size(self):
+        """
+        Test that pages are no bigger than `DEVICE_MAX_PAGE_SIZE`.
+        """
+        response = self.get_list(page_size=100)
+        self.assertEqual(len(response.data['devices']), 3)
+
+    def test_invalid_cursor(self):
+        """
+        Test that an invalid cursor is a 400.
+        """
+        self.assertEqual(self.get_list(cursor='not a cursor').status_code, 400)
+
+    def test_fields(self):
+        """
+        Test that only the requested fields are returned.
+        """
+        response = self.get_list(fields='id,name')
+        self.assertEqual(list(response.data['devices'][0]), ['id', 'name'])
+        request = self.build_request(user=self.user, data={'fields': 'name'})
+        response = self.dispatch_view(request, kwargs={'pk': self.devices[0].id})
+        self.assertEqual(dict(response.data), {'name': 'b'})
+
+    def test_unknown_fields(self):
+        """
+        Test that asking for an unknown field is a 400.
+        """
+        self.assertEqual(self.get_list(fields='id,secret').status_code, 400)
+        request = self.build_request(user=self.user, data={'fields': 'secret'})
+        response = self.dispatch_view(request, kwargs={'pk': self.devices[0].id})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(SPARK=spark_test_settings)
+class DeviceETagTestCase(APITestMixin, TestCase):
+    """
+    Test case for conditional GETs of `views.DeviceAPIView`.
+    """
+    view_class = views.DeviceAPIView
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Add a test device.
+        """
+        cls.user = UserFactory.create()
+        cls.device = DeviceFactory.create(user=cls.user, app_name='test_app')
+
+    def get(self, kwargs=None, **headers):
+        request = self.build_request(user=self.user, **headers)
+        return self.dispatch_view(request, kwargs=kwargs)
+
+    def test_not_modified(self):
+        """
+        Test that a matching `If-None-Match` gets a 304 without any
+        queries.
+        """
+        etag = self.get()['ETag']
+        with self.assertNumQueries(0):
+            response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_etag_changes(self):
+        """
+        Test that the tag changes with the devices and differs between
+        the list and the detail.
+        """
+        etag = self.get()['ETag']
+        detail_etag = self.get(kwargs={'pk': self.device.id})['ETag']
+        self.assertNotEqual(etag, detail_etag)
+        self.device.name = 'renamed'
+        self.device.save()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_any_etag(self):
+        """
+        Test that `If-None-Match: *` only matches an existing device of
+        the user.
+        """
+        response = self.get(kwargs={'pk': self.device.id}, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 304)
+        other = DeviceFactory.create()
+        response = self.get(kwargs={'pk': other.id}, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+        response = self.get(kwargs={'pk': other.id + 1}, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(SPARK=spark_test_settings)
+class DeviceActionViewTestCase(APITestMixin, TestCase):
+    """
+    Test case for `views.DeviceActionView`.
+    """
+    view_class = views.DeviceActionView
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Add a test user.
+        """
+        cls.user = UserFactory.create()
+
+    def test_pending(self):
+        """
+        Test that a pending action is reported as such.
+        """
+        action_id = actions.create_action(self.user)
+        response = self.send_request_to_view(kwargs={'action_id': action_id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['state'], actions.PENDING)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_done(self):
+        """
+        Test that a finished action includes its status and data.
+        """
+        action_id = actions.create_action(self.user)
+        actions.finish_action(action_id, 504, {'detail': 'Device could not be reached'})
+        response = self.send_request_to_view(kwargs={'action_id': action_id})
+        self.assertEqual(response.data['state'], actions.DONE)
+        self.assertEqual(response.data['status'], 504)
+
+    def test_other_user(self):
+        """
+        Test that another user's action isn't found.
+        """
+        action_id = actions.create_action(UserFactory.create())
+        response = self.send_request_to_view(kwargs={'action_id': action_id})
+        self.assertEqual(response.status_code, 404)
+
+
+class SlowTestApp(apps.DeviceAppBase):
+    def render(self, request):
+        if self.device.name == 'slow':
+            time.sleep(1)
+        if self.device.name == 'deadline':
+            return remaining_time()
+        return self.device.name
+
 
 class DevicesTestView(views.UserDevicesViewBase):
     template_name = 'some_template'
@@ -170,3 +380,23 @@ class UserDevicesViewBaseTestCase(ViewsTestMixin, TestCase):
             post = resp._request.POST
         self.assertIn('user', post)
         self.assertEqual(post['user'], self.user.id)
+
+    def test_render_devices_concurrently(self):
+        """
+        Test that `render_devices` renders on the thread pool when
+        `RENDER_WORKERS` is set and falls back to `render_unavailable`
+        for devices that miss the `RENDER_TIMEOUT` deadline.
+        """
+        devices = [DeviceFactory.build(name=n, app_name='slow_app')
+            for n in ('fast', 'slow', 'deadline')]
+        request = self.build_request(method='GET', path='/test/')
+        view = self.build_view(request)
+        with self.settings(SPARK=dict(spark_test_settings, RENDER_WORKERS=2,
+                RENDER_TIMEOUT=0.2, APPS={'slow_app': SlowTestApp})):
+            started = time.time()
+            rendered = view.render_devices(devices)
+            elapsed = time.time() - started
+        self.assertEqual(rendered[0], 'fast')
+        self.assertEqual(rendered[1], devices[1].get_app().render_unavailable(request))
+        self.assertTrue(0 < rendered[2] <= 0.2)
+        self.assertLess(elapsed, 1)
@@ -0,0 +1,110 @@
+"""
+timeouts.py - request timeouts that adapt to the latency observed for
+    each kind of Spark cloud request, and deadlines that bound them.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from .settings import get_spark_settings
+
+
+class LatencyTracker:
+    """
+    Keeps the latencies of the last `samples` requests for each key, a
+    tuple of the operation and the device or cloud it went to, so that
+    timeouts can follow what is normal for that key. Only the
+    `max_keys` most recently used keys are kept.
+
+    Latencies are only known to this process, which is enough to learn
+    a device's typical latency and keeps the cache out of every request.
+    """
+    def __init__(self, samples=200, min_samples=20, max_keys=1000):
+        """
+        Constructor. A key needs `min_samples` latencies before its
+        percentiles are known.
+        """
+        self.samples = samples
+        self.min_samples = min_samples
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._latencies = OrderedDict()
+
+    def observe(self, key, seconds):
+        """
+        Record that a request for `key` took `seconds`.
+        """
+        with self._lock:
+            latencies = self._latencies.pop(key, None)
+            if latencies is None:
+                latencies = deque(maxlen=self.samples)
+            latencies.append(seconds)
+            self._latencies[key] = latencies
+            while len(self._latencies) > self.max_keys:
+                self._latencies.popitem(last=False)
+
+    def percentile(self, key, q):
+        """
+        Get the `q` (between 0 and 1) percentile latency of `key`, or
+        None if there aren't enough samples.
+        """
+        with self._lock:
+            latencies = self._latencies.get(key)
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+            latencies = sorted(latencies)
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+    def clear(self):
+        """
+        Forget all latencies.
+        """
+        with self._lock:
+            self._latencies.clear()
+
+
+latency_tracker = LatencyTracker()
+
+
+def adaptive_timeout(key):
+    """
+    Get the timeout for a request for `key`: the 99th percentile of its
+    latency times `TIMEOUT_FACTOR`, kept between `TIMEOUT_MIN` and
+    `TIMEOUT_MAX`. Until the latency of `key` is known it is `TIMEOUT`.
+    """
+    s = get_spark_settings()
+    p99 = latency_tracker.percentile(key, 0.99)
+    if p99 is None:
+        return s.TIMEOUT
+    return min(max(p99 * s.TIMEOUT_FACTOR, s.TIMEOUT_MIN), s.TIMEOUT_MAX)
+
+
+_deadlines = threading.local()
+
+
+@contextmanager
+def deadline(until):
+    """
+    Make the Spark cloud requests sent by this thread within the block
+    give up at `until`, a `time.time()` timestamp, by shortening their
+    timeouts, see `remaining_time`. An earlier deadline that is already
+    in effect is kept.
+    """
+    previous = getattr(_deadlines, 'until', None)
+    _deadlines.until = until if previous is None else min(until, previous)
+    try:
+        yield
+    finally:
+        _deadlines.until = previous
+
+
+def remaining_time():
+    """
+    Get the seconds left before this thread's `deadline`, or None if
+    there isn't one.
+    """
+    until = getattr(_deadlines, 'until', None)
+    if until is None:
+        return None
+    return until - time.time()
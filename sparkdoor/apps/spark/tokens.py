@@ -0,0 +1,62 @@
+"""
+tokens.py - cache of the current Spark cloud access token.
+"""
+import time
+
+from django.core.cache import cache
+from django.utils import timezone
+
+
+class TokenCache:
+    """
+    Keeps the current access token and its expiry in the Django cache,
+    until the token expires, and in process memory, where it is only
+    trusted for `LOCAL_TIMEOUT` seconds before the shared entry is read
+    again.
+
+    `invalidate` is called by the `CloudCredentials` signal receivers,
+    so a rotated token is picked up right away by this process and
+    within `LOCAL_TIMEOUT` seconds by the others. Tokens are only
+    rotated while the old one is still valid, so a process using it a
+    little longer does no harm.
+    """
+    LOCAL_TIMEOUT = 60 # seconds
+
+    def __init__(self, key='spark.access_token'):
+        """
+        Constructor.
+        """
+        self.key = key
+        self._local = None
+
+    def get(self, load):
+        """
+        Get the current access token or None. `load` is called to get
+        the latest `CloudCredentials` when no valid token is cached.
+        """
+        now = timezone.now()
+        local = self._local
+        if local is not None and local[1] > now and local[2] > time.time():
+            return local[0]
+        entry = cache.get(self.key)
+        if entry is None or entry[1] <= now:
+            credentials = load()
+            if credentials is None:
+                self._local = None
+                return None
+            entry = (credentials.access_token, credentials.expires_at)
+            timeout = int((entry[1] - now).total_seconds())
+            if timeout > 0:
+                cache.set(self.key, entry, timeout)
+        self._local = (entry[0], entry[1], time.time() + self.LOCAL_TIMEOUT)
+        return entry[0]
+
+    def invalidate(self):
+        """
+        Forget the cached token in this and every other process.
+        """
+        self._local = None
+        cache.delete(self.key)
+
+
+token_cache = TokenCache()
@@ -0,0 +1,120 @@
+"""
+transport.py - process-wide pooled HTTP transport for the Spark cloud.
+"""
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from hammock import Hammock
+
+from .settings import get_spark_settings
+
+
+class Transport:
+    """
+    Keeps a single keep-alive `requests.Session` for each cloud host so
+    that connections, and their TLS handshakes, are reused by every
+    `SparkCloud` in the process regardless of which thread is using it.
+
+    Sessions are discarded when the process id changes so that forked
+    workers (Celery's prefork pool for instance) never share sockets
+    with their parent.
+    """
+    def __init__(self, pool_size=10):
+        """
+        Constructor. `pool_size` is the maximum number of connections
+        that are kept alive per host.
+        """
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._sessions = {}
+        self._services = {}
+
+    def session(self, api_uri):
+        """
+        Get the shared session for the host in `api_uri`.
+        """
+        with self._lock:
+            return self._session(api_uri)
+
+    def service(self, api_uri):
+        """
+        Get a root `Hammock` for `api_uri` that sends its requests with
+        the shared session. `Hammock` chains are copied on every
+        attribute access so the same root is safe to share.
+        """
+        with self._lock:
+            session = self._session(api_uri)
+            service = self._services.get(api_uri)
+            if service is None:
+                service = Hammock(api_uri)
+                service._close_session()
+                service._session = session
+                self._services[api_uri] = service
+            return service
+
+    def close(self):
+        """
+        Close all pooled connections.
+        """
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+            self._services = {}
+
+    def _session(self, api_uri):
+        """
+        Get or build the session for a host, the lock must be held.
+        """
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._sessions = {}
+            self._services = {}
+        host = urlsplit(api_uri).netloc
+        session = self._sessions.get(host)
+        if session is None:
+            session = self._sessions[host] = self._build_session()
+        return session
+
+    def _build_session(self):
+        """
+        Make a new session with a connection pool of `pool_size`.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """
+    Get the process-wide `Transport`, creating it from the `SPARK`
+    settings on first use.
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = Transport(get_spark_settings().POOL_SIZE)
+        return _transport
+
+
+def reset_transport():
+    """
+    Close and forget the process-wide `Transport` so the next call to
+    `get_transport` rebuilds it.
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is not None:
+            _transport.close()
+        _transport = None
@@ -13,6 +13,16 @@ urlpatterns = patterns('',
         name='devices-list'
     ),
     
+    url(r'^devices/events/$',
+        views.DeviceEventsView.as_view(),
+        name='devices-events'
+    ),
+
+    url(r'^devices/actions/(?P<action_id>[0-9a-f]{32})/$',
+        views.DeviceActionView.as_view(),
+        name='devices-action-status'
+    ),
+
     url(r'^devices/(?P<pk>\d+)/$',
         views.DeviceAPIView.as_view(),
         name='devices-detail'
@@ -0,0 +1,66 @@
+"""
+versions.py - version counters for telling whether cached responses
+    are still current.
+"""
+import time
+
+from django.core.cache import cache
+
+
+class VersionCounter:
+    """
+    A counter per key, kept in the Django cache, that is bumped whenever
+    something the key stands for changes. Responses tagged with a
+    version are current for as long as the version doesn't change.
+
+    Versions are bumped by whichever process made the change, Celery
+    workers included, so the cache must be shared by every process, as
+    with the Redis `CACHES` of the project settings. Otherwise a process
+    would keep answering 304 for responses that are stale.
+
+    A counter that is missing from the cache, after it was evicted for
+    instance, starts again from the current time in milliseconds so it
+    doesn't repeat a version that was handed out before.
+    """
+    def __init__(self, prefix):
+        """
+        Constructor.
+        """
+        self.prefix = prefix
+
+    def get(self, key):
+        """
+        Get the current version of `key`.
+        """
+        cache_key = self._key(key)
+        version = cache.get(cache_key)
+        if version is None:
+            cache.add(cache_key, self._seed(), None)
+            version = cache.get(cache_key)
+        return version
+
+    def bump(self, key):
+        """
+        Change the version of `key`.
+        """
+        cache_key = self._key(key)
+        try:
+            cache.incr(cache_key)
+        except ValueError:
+            cache.add(cache_key, self._seed(), None)
+
+    def _seed(self):
+        """
+        Get a starting version.
+        """
+        return int(time.time() * 1000)
+
+    def _key(self, key):
+        """
+        Get the cache key for the version of `key`.
+        """
+        return '{0}.{1}'.format(self.prefix, key)
+
+
+# the version of each user's devices, keyed by user id.
+device_versions = VersionCounter('spark.device_version')
@@ -1,17 +1,72 @@
 """
 views.py - `spark` app views module.
 """
+import base64
+import binascii
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
+from django.views.generic.base import View
 from django.views.generic.edit import CreateView
 
 from braces.views import LoginRequiredMixin, FormMessagesMixin
 
-from rest_framework import generics, mixins, response
+from rest_framework import generics, mixins, response, views
 from rest_framework.permissions import IsAuthenticated
 
+from .actions import PENDING, DONE, create_action, get_action
 from .apps import DeviceAppError
 from .forms import RegisterDeviceForm
 from .models import Device
 from .serializers import DeviceSerializer
+from .settings import get_spark_settings
+from .streams import OpenStream, event_hub, stream_limit
+from .tasks import run_device_action
+from .timeouts import deadline
+from .versions import device_versions
+
+
+def _render_app(app, request, until):
+    """
+    Render a device app on a worker thread, with its cloud requests
+    giving up at `until`, closing the thread's database connection
+    afterwards.
+    """
+    try:
+        with deadline(until):
+            return app.render(request)
+    finally:
+        connection.close()
+
+
+def encode_cursor(device):
+    """
+    Encode the position of `device` in the device list as an opaque
+    cursor.
+    """
+    position = json.dumps([device.name, device.id]).encode('utf-8')
+    return base64.urlsafe_b64encode(position).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor from `encode_cursor` into a tuple of the name and id
+    it points at, raises `ValueError` if it isn't valid.
+    """
+    try:
+        name, pk = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (binascii.Error, UnicodeError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(name, str) or not isinstance(pk, int):
+        raise ValueError('Invalid cursor')
+    return name, pk
 
 
 class DeviceAPIView(mixins.RetrieveModelMixin, mixins.ListModelMixin,
@@ -25,15 +80,27 @@ class DeviceAPIView(mixins.RetrieveModelMixin, mixins.ListModelMixin,
 
     The device list and detail endpoints are read-only for now, while
     the action endpoint is write-only and delegates to the device's app.
+
+    The list is ordered by name and paged, `?page_size=` devices at a
+    time up to the `DEVICE_MAX_PAGE_SIZE` setting, with a `next` link to
+    the following page. Both endpoints take `?fields=id,name,...` to
+    only include some fields.
+
+    Both endpoints send an `ETag` built from the version of the user's
+    devices, see `versions.device_versions`, and answer a matching
+    `If-None-Match` with a 304 before any device is looked up. An
+    `If-None-Match: *` only matches a device that exists.
     """
     serializer_class = DeviceSerializer
     permission_classes = (IsAuthenticated,)
 
     def get_queryset(self):
         """
-        Only return the devices for a specific User.
+        Only return the devices for a specific User. The list shares
+        one cloud request between its devices, see `list`, while a
+        single device only ever costs a request for itself.
         """
-        return Device.objects.for_user(self.request.user)
+        return Device.objects.for_user(self.request.user).select_related('presence')
 
     @property
     def allowed_methods(self):
@@ -43,16 +110,59 @@ class DeviceAPIView(mixins.RetrieveModelMixin, mixins.ListModelMixin,
         """
         return [('POST' if 'action' in self.kwargs else 'GET'), 'OPTIONS', 'HEAD']
 
+    def get_serializer(self, instance=None, data=None, files=None, many=False,
+            partial=False):
+        """
+        Only serialize the fields asked for with `?fields=`.
+        """
+        return self.get_serializer_class()(instance, data=data, files=files, many=many,
+            partial=partial, context=self.get_serializer_context(),
+            fields=self.requested_fields())
+
+    def requested_fields(self):
+        """
+        Get the field names from `?fields=`, or None for all of them.
+        """
+        fields = self.request.QUERY_PARAMS.get('fields')
+        if not fields:
+            return None
+        return [f.strip() for f in fields.split(',') if f.strip()]
+
     def list(self, request, *args, **kwargs):
         """
-        Add an `href` entry.
+        Respond with a page of devices after the `?cursor=` position,
+        along with an `href` entry and a `next` link that is None on the
+        last page.
         """
-        res = super(self.__class__, self).list(request, *args, **kwargs)
-        res.data = {
+        s = get_spark_settings()
+        try:
+            page_size = int(request.QUERY_PARAMS.get('page_size', s.DEVICE_PAGE_SIZE))
+        except ValueError:
+            page_size = s.DEVICE_PAGE_SIZE
+        page_size = min(max(page_size, 1), s.DEVICE_MAX_PAGE_SIZE)
+
+        devices = self.get_queryset().with_cloud_state().order_by('name', 'id')
+        cursor = request.QUERY_PARAMS.get('cursor')
+        if cursor:
+            try:
+                name, pk = decode_cursor(cursor)
+            except ValueError:
+                return response.Response({'detail': 'Invalid cursor'}, status=400)
+            devices = devices.filter(Q(name__gt=name) | Q(name=name, id__gt=pk))
+        devices = list(devices[:page_size + 1])
+
+        next_uri = None
+        if len(devices) > page_size:
+            devices = devices[:page_size]
+            params = request.QUERY_PARAMS.copy()
+            params['cursor'] = encode_cursor(devices[-1])
+            next_uri = request.build_absolute_uri('{0}?{1}'.format(request.path,
+                params.urlencode()))
+        return response.Response({
             'href': request.build_absolute_uri(request.path),
-            'devices': res.data
-        }
-        return res
+            'devices': self.get_serializer(devices, many=True).data,
+            'next': next_uri
+        })
 
     def get(self, request, *args, **kwargs):
         """
@@ -60,11 +170,46 @@ class DeviceAPIView(mixins.RetrieveModelMixin, mixins.ListModelMixin,
         like a detail view, otherwise respond like a list view.
         """
         lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
-        if lookup_url_kwarg in kwargs:
-            if 'action' in kwargs:
-                return response.Response(status=405)
-            return self.retrieve(request, *args, **kwargs)
-        return self.list(request, *args, **kwargs)
+        if 'action' in kwargs:
+            return response.Response(status=405)
+        unknown = set(self.requested_fields() or ()) - set(self.serializer_class.Meta.fields)
+        if unknown:
+            return response.Response({'detail': 'Unknown fields: {0}'.format(
+                ', '.join(sorted(unknown)))}, status=400)
+        etag = self.get_etag(request)
+        etags = set(parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')))
+        if etag in etags or ('*' in etags and self.exists()):
+            res = response.Response(status=304)
+        elif lookup_url_kwarg in kwargs:
+            res = self.retrieve(request, *args, **kwargs)
+        else:
+            res = self.list(request, *args, **kwargs)
+        if res.status_code in (200, 304):
+            res['ETag'] = quote_etag(etag)
+        return res
+
+    def get_etag(self, request):
+        """
+        Get the entity tag for this response, which changes with the
+        user's devices and with anything in the request that changes
+        the response. The version is read before any device is, so a
+        response is never tagged with a newer version than its data.
+        """
+        version = device_versions.get(request.user.pk)
+        tag = '{0}:{1}:{2}:{3}:{4}'.format(request.user.pk, version, sorted(self.kwargs.items()),
+            request.get_full_path(), request.META.get('HTTP_ACCEPT', ''))
+        return hashlib.md5(tag.encode('utf-8')).hexdigest()
+
+    def exists(self):
+        """
+        Check if the requested resource exists: the list always does, a
+        device only if it is one of the user's.
+        """
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        if lookup_url_kwarg not in self.kwargs:
+            return True
+        return self.get_queryset().filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]}).exists()
 
     def post(self, request, *args, **kwargs):
         """
@@ -75,16 +220,23 @@ class DeviceAPIView(mixins.RetrieveModelMixin, mixins.ListModelMixin,
         A 405 is raised if `action` or `pk` is not specified (indicating
         a post to the detail or list endpoints). A 404 is raised if
         `action` is not in the `action_names` attribute.
+
+        A request with a `Prefer: respond-async` header gets a 202 and
+        the action runs on a Celery worker, see `enqueue_action`.
         """
         lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
         if lookup_url_kwarg not in kwargs or 'action' not in kwargs:
             return response.Response(status=405)
 
         action = kwargs['action']
-        app = self.get_object().get_app()
+        device = self.get_object()
+        app = device.get_app()
         if action not in app.get_action_names():
             return response.Response(status=404)
 
+        if 'respond-async' in request.META.get('HTTP_PREFER', ''):
+            return self.enqueue_action(request, device, action)
+
         status = 200
         try:
             data = app.action(action, request.DATA)
@@ -93,6 +245,112 @@ class DeviceAPIView(mixins.RetrieveModelMixin, mixins.ListModelMixin,
             data = {'detail': err.msg}
         return response.Response(data=data, status=status)
 
+    def enqueue_action(self, request, device, action):
+        """
+        Queue `action` as a `tasks.run_device_action` task and respond
+        with a 202 pointing at its `DeviceActionView` status resource.
+        """
+        data = request.DATA.dict() if hasattr(request.DATA, 'dict') else request.DATA
+        action_id = create_action(request.user)
+        run_device_action.delay(action_id, device.pk, action, data)
+        href = request.build_absolute_uri(
+            reverse('devices-action-status', kwargs={'action_id': action_id}))
+        return response.Response(data={'href': href, 'state': PENDING}, status=202,
+            headers={'Location': href, 'Preference-Applied': 'respond-async'})
+
+
+class DeviceActionView(views.APIView):
+    """
+    Status resource for a device action that was queued by
+    `DeviceAPIView.enqueue_action`.
+
+    /devices/actions/<action_id>/
+
+    The `state` is `pending` until the action finishes, then it is
+    `done` and the `status` code and `data` it would have responded
+    with are included. A pending response has a `Retry-After` header
+    saying when to ask again, the request never waits for the action.
+    """
+    permission_classes = (IsAuthenticated,)
+    retry_after = 1 # seconds
+
+    def get(self, request, action_id, *args, **kwargs):
+        """
+        GET handler.
+        """
+        record = get_action(action_id, request.user)
+        if record is None:
+            return response.Response(status=404)
+        data = {'href': request.build_absolute_uri(request.path), 'state': record['state']}
+        if record['state'] == DONE:
+            data.update(status=record['status'], data=record['data'])
+            return response.Response(data=data)
+        return response.Response(data=data, headers={'Retry-After': str(self.retry_after)})
+
+
+class DeviceEventsView(LoginRequiredMixin, View):
+    """
+    Stream of live events for the current user's devices, as
+    server-sent events.
+
+    /devices/events/
+
+    Every event from the Spark cloud for one of the user's devices,
+    `spark/status` with `online` or `offline` for instance, is sent
+    with its name and the JSON `{"device": <id>, "data": <data>,
+    "published_at": <time>}`. Events are relayed from the process-wide
+    `streams.event_hub`, so watching browsers don't add cloud traffic.
+
+    A stream holds a web server thread while it is open, so the server
+    must have more threads than `EVENT_STREAM_MAX_CONNECTIONS` and send
+    each event as it is written, see the Procfile. Streams beyond that
+    limit get a 503, and each stream ends after `max_age` seconds so
+    that the browsers take turns.
+    """
+    raise_exception = True
+    heartbeat = 15 # seconds
+    retry = 3000 # milliseconds before a browser reconnects
+    max_age = 60*10 # seconds
+    retry_after = 60 # seconds before a refused browser tries again
+
+    def get(self, request, *args, **kwargs):
+        """
+        GET handler.
+        """
+        devices = dict(Device.objects.for_user(request.user).values_list('device_id', 'id'))
+        if not stream_limit.acquire(get_spark_settings().EVENT_STREAM_MAX_CONNECTIONS):
+            res = HttpResponse(status=503)
+            res['Retry-After'] = self.retry_after
+            return res
+        subscription = event_hub.subscribe(devices, self.heartbeat)
+        response = StreamingHttpResponse(OpenStream(self.stream(subscription, devices),
+            subscription), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def stream(self, subscription, devices):
+        """
+        Format the events of `subscription` for a browser, `devices`
+        maps cloud device ids to their primary keys. A comment is sent
+        as a heartbeat while there are no events, which is how a closed
+        connection is noticed.
+        """
+        # the stream can be open for minutes, don't hold on to a database
+        # connection for it.
+        connection.close()
+        until = time.time() + self.max_age
+        yield 'retry: {0}\n\n'.format(self.retry)
+        for event in subscription:
+            if time.time() >= until:
+                break
+            if event is None:
+                yield ':\n\n'
+                continue
+            data = json.dumps({'device': devices[event['device']], 'data': event['data'],
+                'published_at': event['published_at']})
+            yield 'event: {0}\ndata: {1}\n\n'.format(event['name'], data)
+
 
 class UserDevicesViewBase(LoginRequiredMixin, FormMessagesMixin, CreateView):
     """
@@ -120,10 +378,45 @@ class UserDevicesViewBase(LoginRequiredMixin, FormMessagesMixin, CreateView):
         Add a `devices` entry with available devices.
         """
         context = super(UserDevicesViewBase, self).get_context_data(**kwargs)
-        devices = Device.objects.for_user(self.request.user).order_by('name')
-        context['devices'] = [d.get_app().render(self.request) for d in devices]
+        devices = Device.objects.for_user(self.request.user).select_related(
+            'presence').with_cloud_state()
+        devices = devices.order_by('name')
+        context['devices'] = self.render_devices(devices)
         return context
 
+    def render_devices(self, devices):
+        """
+        Render each device with its app. If the `RENDER_WORKERS` setting
+        is set, the devices are rendered concurrently on up to that many
+        threads of a pool of this request's own, and any device that
+        isn't rendered within `RENDER_TIMEOUT` seconds is replaced with
+        its app's `render_unavailable`.
+
+        The deadline is also passed down to the renders' cloud requests
+        as their timeout (see `timeouts.deadline`), so a slow door gives
+        up shortly after it instead of holding on to its thread.
+        """
+        s = get_spark_settings()
+        apps = [d.get_app() for d in devices]
+        if not s.RENDER_WORKERS or not apps:
+            return [app.render(self.request) for app in apps]
+
+        until = time.time() + s.RENDER_TIMEOUT
+        executor = ThreadPoolExecutor(max_workers=min(s.RENDER_WORKERS, len(apps)))
+        try:
+            futures = [executor.submit(_render_app, app, self.request, until) for app in apps]
+            rendered = []
+            for app, future in zip(apps, futures):
+                try:
+                    rendered.append(future.result(max(0, until - time.time())))
+                except TimeoutError:
+                    future.cancel()
+                    rendered.append(app.render_unavailable(self.request))
+        finally:
+            # late renders finish on their own, bounded by the deadline.
+            executor.shutdown(wait=False)
+        return rendered
+
     def post(self, request, *args, **kwargs):
         """
         Add the user of this request.
@@ -0,0 +1,131 @@
+"""
+flight.py - single-flight coalescing of identical calls.
+"""
+import hashlib
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+
+
+class _Flight:
+    """
+    A call in progress in this process and, once it lands, its outcome.
+    """
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.landed = threading.Event()
+        self.value = None
+        self.error = None
+        self.shared = False
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time, everyone asking for a key
+    that is already in flight gets that call's result instead of making
+    their own.
+
+    Threads of one process wait on the leading thread directly. Between
+    processes the leader claims the key in the Django cache and stores
+    the outcome there for the processes that found the claim, which
+    poll for it. That only works when the cache is shared, as with the
+    Redis `CACHES` of the project settings. Exceptions listed in
+    `shared_errors` are shared like results and must be picklable. If
+    the leader fails otherwise, or doesn't land within `LEASE` seconds,
+    the others make the call themselves.
+    """
+    LEASE = 30 # seconds
+    RESULT_TIMEOUT = 5 # seconds
+    POLL_INTERVAL = 0.05 # seconds
+
+    def __init__(self, prefix, shared_errors=()):
+        """
+        Constructor.
+        """
+        self.prefix = prefix
+        self.shared_errors = tuple(shared_errors)
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, fn):
+        """
+        Call `fn` unless a call for `key`, a hashable tuple, is already
+        in flight and return its result.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.landed.wait()
+            if not flight.shared:
+                return fn()
+        else:
+            try:
+                flight.value = self._do_shared(key, fn)
+                flight.shared = True
+            except self.shared_errors as err:
+                flight.error = err
+                flight.shared = True
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.landed.set()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _do_shared(self, key, fn):
+        """
+        Call `fn` or wait for another process that is calling it.
+        """
+        claim_key = '{0}.{1}'.format(self.prefix,
+            hashlib.md5(repr(key).encode('utf-8')).hexdigest())
+        token = uuid.uuid4().hex
+        if not cache.add(claim_key, token, self.LEASE):
+            outcome = self._wait(claim_key)
+            if outcome is None:
+                return fn()
+            error, value = outcome
+            if error is not None:
+                raise error
+            return value
+        try:
+            value = fn()
+        except self.shared_errors as err:
+            cache.set(self._result_key(token), (err, None), self.RESULT_TIMEOUT)
+            raise
+        else:
+            cache.set(self._result_key(token), (None, value), self.RESULT_TIMEOUT)
+            return value
+        finally:
+            cache.delete(claim_key)
+
+    def _wait(self, claim_key):
+        """
+        Poll for the outcome of the call claimed under `claim_key`,
+        returns a tuple of the shared error or None and the result, or
+        None if the call didn't land.
+        """
+        deadline = time.time() + self.LEASE
+        token = cache.get(claim_key)
+        while token is not None and time.time() < deadline:
+            time.sleep(self.POLL_INTERVAL)
+            outcome = cache.get(self._result_key(token))
+            if outcome is not None:
+                return outcome
+            if cache.get(claim_key) != token:
+                return cache.get(self._result_key(token))
+        return None
+
+    def _result_key(self, token):
+        """
+        Get the cache key for the outcome of the call claimed with
+        `token`.
+        """
+        return '{0}.result.{1}'.format(self.prefix, token)
@@ -0,0 +1,52 @@
+"""
+pools.py - process-wide thread pools.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SharedExecutor:
+    """
+    Lazily creates a `ThreadPoolExecutor` that is shared by everything
+    in the process using this instance. A new pool is created after a
+    fork since worker threads don't survive it.
+    """
+    def __init__(self, max_workers):
+        """
+        Constructor. `max_workers` is either a number or a callable
+        returning one, which is evaluated when the pool is created.
+        """
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedule `fn(*args, **kwargs)` on the pool and return a
+        `concurrent.futures.Future`.
+        """
+        return self.get().submit(fn, *args, **kwargs)
+
+    def get(self):
+        """
+        Get the pool, creating it if needed.
+        """
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                max_workers = self.max_workers
+                if callable(max_workers):
+                    max_workers = max_workers()
+                self._executor = ThreadPoolExecutor(max_workers=max_workers)
+                self._pid = os.getpid()
+            return self._executor
+
+    def shutdown(self, wait=True):
+        """
+        Shut the pool down, a new one is created on the next `submit`.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=wait)
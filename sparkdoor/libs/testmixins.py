@@ -81,13 +81,13 @@ class APITestMixin(CBVBaseTestMixin):
     """
     request_factory = APIRequestFactory()
 
-    def build_request(self, method='GET', path='/test/', user=None,
+    def build_request(self, method='GET', path='/test/', user=None, data=None,
             token=None, **kwargs):
         """
         Creates a request using request factory.
         """
         request = super(APITestMixin, self).build_request(method=method, path=path,
-            user=user, token=token, **kwargs)
+            user=user, data=data, **kwargs)
         force_authenticate(request, user=user, token=token)
         return request
 
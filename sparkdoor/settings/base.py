@@ -202,11 +202,41 @@ CELERY_ACCEPT_CONTENT = ['json']
 
 CELERY_RESULT_SERIALIZER = 'json'
 
+# The cache must be shared by the web and Celery processes, the `spark`
+# and `common` apps keep state there that every process has to see:
+# circuit breakers, the retry budget, ETag versions and the freshness of
+# the card index.
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': get_env_or_error('SPARK_CACHE_URL', 'should be set to the url of a Redis server shared by the web and Celery processes.'),
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient'
+        }
+    }
+}
+
 from datetime import timedelta
 CELERYBEAT_SCHEDULE = {
     'sparkcloud_token_refresh': {
         'task': 'sparkdoor.apps.spark.tasks.refresh_access_token',
         'schedule': timedelta(days=1)
+    },
+    'device_presence': {
+        'task': 'sparkdoor.apps.spark.tasks.poll_device_presence',
+        'schedule': timedelta(seconds=15)
+    },
+    'device_action_sweep': {
+        'task': 'sparkdoor.apps.spark.tasks.sweep_device_actions',
+        'schedule': timedelta(hours=1)
+    },
+    'door_event_rollups': {
+        'task': 'sparkdoor.apps.common.tasks.rollup_door_events',
+        'schedule': timedelta(minutes=5)
+    },
+    'door_pass_sweep': {
+        'task': 'sparkdoor.apps.common.tasks.sweep_door_passes',
+        'schedule': timedelta(hours=1)
     }
 }
 
@@ -216,5 +246,6 @@ SPARK = {
     'CLOUD_PASSWORD': get_env_or_error('SPARK_CLOUD_PASSWORD', 'should be set to the password for SPARK_CLOUD_USERNAME.'),
     'APPS': {
         'door': 'sparkdoor.apps.common.apps.DoorApp'
-    }
+    },
+    'RENDER_WORKERS': 8
 }
@@ -0,0 +1,13 @@
+"""
+test.py - settings module for running the tests.
+"""
+from .development import *
+
+
+# keep the state the tests leave in the cache to the test process
+# instead of the Redis server shared with the development site.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    }
+}